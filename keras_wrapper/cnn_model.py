@@ -23,11 +23,13 @@ from keras.models import Sequential, model_from_json, load_model
 from keras.optimizers import *
 from keras.regularizers import l2
 from keras.utils.layer_utils import print_summary
-from keras_wrapper.dataset import Data_Batch_Generator, Homogeneous_Data_Batch_Generator, Parallel_Data_Batch_Generator
+from keras_wrapper.dataset import Data_Batch_Generator, Homogeneous_Data_Batch_Generator, Parallel_Data_Batch_Generator, \
+    Prefetch_Batch_Generator, Bucketed_Data_Batch_Generator
 from keras_wrapper.extra.callbacks import *
 from keras_wrapper.extra.read_write import file2list
 from keras_wrapper.utils import one_hot_2_indices, decode_predictions, decode_predictions_one_hot, \
-    decode_predictions_beam_search, replace_unknown_words, sampling, categorical_probas_to_classes, checkParameters, print_dict
+    decode_predictions_beam_search, replace_unknown_words, sampling, categorical_probas_to_classes, checkParameters, \
+    print_dict, remove_batch_padding
 from keras_wrapper.search import beam_search
 
 # General setup of libraries
@@ -41,10 +43,12 @@ if int(keras.__version__.split('.')[0]) == 1:
     from keras.layers import Concat as Concatenate
     from keras.layers import Convolution2D as Conv2D
     from keras.layers import Deconvolution2D as Conv2DTranspose
+    Sequence = object
 else:
     from keras.layers import Concatenate
     from keras.layers import Conv2D
     from keras.layers import Conv2DTranspose
+    from keras.utils import Sequence
 
 
 # ------------------------------------------------------- #
@@ -377,6 +381,118 @@ def read_layer_names(model, starting_name=None):
     return layers_names
 
 
+# ------------------------------------------------------- #
+#       LOSS FUNCTIONS
+# ------------------------------------------------------- #
+
+def sparse_categorical_crossentropy_smoothed(label_smoothing):
+    """
+    Builds a sparse categorical crossentropy loss with uniform label smoothing (see arxiv.org/abs/1512.00567).
+    It is equivalent to a categorical crossentropy on one-hot targets smoothed as
+    (1 - label_smoothing) * y + label_smoothing / vocabulary_len, but it works with integer targets
+    (e.g. outputs of type 'dense-text'), avoiding the construction of dense target tensors.
+
+    :param label_smoothing: Epsilon value for label smoothing.
+    :return: Loss function (y_true, y_pred).
+    """
+
+    def loss(y_true, y_pred):
+        crossentropy = K.sparse_categorical_crossentropy(y_true, y_pred)
+        if label_smoothing > 0.:
+            uniform_crossentropy = -K.mean(K.log(K.clip(y_pred, K.epsilon(), 1.)), axis=-1)
+            crossentropy = (1. - label_smoothing) * crossentropy + label_smoothing * uniform_crossentropy
+        return crossentropy
+
+    loss.__name__ = 'sparse_categorical_crossentropy_smoothed'
+    return loss
+
+
+# ------------------------------------------------------- #
+#       DATA SEQUENCES
+# ------------------------------------------------------- #
+
+class Data_Batch_Sequence(Sequence):
+    """
+    keras.utils.Sequence of the batches of a dataset split. Each batch is loaded by Dataset.getXY_FromBatch (or
+    getX_FromBatch), which does not modify the state of the dataset, so batches can be loaded concurrently by Keras
+    (workers > 1, use_multiprocessing). If shuffle is True, the samples of each epoch are shuffled with a permutation
+    which only depends on the seed and on the epoch.
+    """
+
+    def __init__(self,
+                 set_split,
+                 net,
+                 dataset,
+                 batch_size=50,
+                 normalization=False,
+                 normalization_type=None,
+                 data_augmentation=True,
+                 wo_da_patch_type='whole',
+                 da_patch_type='resize_and_rndcrop',
+                 da_enhance_list=None,
+                 mean_substraction=False,
+                 predict=False,
+                 shuffle=True,
+                 seed=None,
+                 init_sample=-1,
+                 final_sample=-1):
+        """
+        Initializes the Data_Batch_Sequence
+        :param set_split: Split (train, val, test) to retrieve data
+        :param net: Net which use the data
+        :param dataset: Dataset instance
+        :param batch_size: Size of the minibatch
+        :param normalization: Switches on/off the normalization of images
+        :param data_augmentation: Switches on/off the data augmentation of the input (only on training)
+        :param mean_substraction: Switches on/off the mean substraction for images
+        :param predict: Whether we are predicting (only inputs) or training
+        :param shuffle: Shuffle the samples of each epoch (only on training)
+        :param seed: Seed of the shuffling. If None, a random one is used
+        :param init_sample: First sample of the split (only if predicting)
+        :param final_sample: Last sample (not included) of the split (only if predicting)
+        """
+        self.set_split = set_split
+        self.net = net
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.predict = predict
+        self.shuffle = shuffle and set_split == 'train' and not predict
+        self.seed = seed if seed is not None else np.random.randint(0, 2 ** 31 - 1)
+        self.epoch = 0
+        if init_sample > -1 and final_sample > -1:
+            self.init_sample, self.final_sample = init_sample, final_sample
+        else:
+            self.init_sample, self.final_sample = 0, -1
+        self.params = {'normalization': normalization,
+                       'normalization_type': normalization_type,
+                       'meanSubstraction': mean_substraction,
+                       'dataAugmentation': data_augmentation if set_split == 'train' and not predict else False,
+                       'wo_da_patch_type': wo_da_patch_type,
+                       'da_patch_type': da_patch_type,
+                       'da_enhance_list': da_enhance_list}
+
+    def __len__(self):
+        if self.final_sample > -1:
+            n_samples = self.final_sample - self.init_sample
+        else:
+            n_samples = getattr(self.dataset, 'len_' + self.set_split)
+        return int(math.ceil(float(n_samples) / self.batch_size))
+
+    def __getitem__(self, batch_index):
+        epoch_seed = self.seed + self.epoch if self.shuffle else None
+        if self.predict:
+            X_batch = self.dataset.getX_FromBatch(self.set_split, batch_index, self.batch_size, epoch_seed=epoch_seed,
+                                                  init_sample=self.init_sample, final_sample=self.final_sample,
+                                                  **self.params)
+            return self.net.prepareData(X_batch, None)[0]
+        X_batch, Y_batch = self.dataset.getXY_FromBatch(self.set_split, batch_index, self.batch_size,
+                                                        epoch_seed=epoch_seed, **self.params)
+        return self.net.prepareData(X_batch, Y_batch)
+
+    def on_epoch_end(self):
+        self.epoch += 1
+
+
 # ------------------------------------------------------- #
 #       MAIN CLASS
 # ------------------------------------------------------- #
@@ -536,9 +652,13 @@ class Model_Wrapper(object):
                                         'maxlen': 100,  # sequence learning parameters (BeamSearch)
                                         'homogeneous_batches': False,
                                         'joint_batches': 4,
+                                        'max_tokens': None,
                                         'epochs_for_save': 1,
                                         'num_iterations_val': None,
                                         'n_parallel_loaders': 1,
+                                        'n_prefetch_batches': 0,
+                                        'sequence_workers': 0,
+                                        'use_multiprocessing': False,
                                         'normalize': False,
                                         'normalization_type': None,
                                         'mean_substraction': False,
@@ -593,6 +713,8 @@ class Model_Wrapper(object):
 
         self.default_predict_with_beam_params = {'max_batch_size': 50,
                                                  'n_parallel_loaders': 1,
+                                                 'n_prefetch_batches': 0,
+                                                 'max_tokens': None,
                                                  'beam_size': 5,
                                                  'beam_batch_size': 50,
                                                  'normalize': False,
@@ -630,6 +752,9 @@ class Model_Wrapper(object):
                                                  }
         self.default_predict_params = {'batch_size': 50,
                                        'n_parallel_loaders': 1,
+                                       'n_prefetch_batches': 0,
+                                       'sequence_workers': 0,
+                                       'use_multiprocessing': False,
                                        'normalize': False,
                                        'normalization_type': None,
                                        'wo_da_patch_type': 'whole',
@@ -674,7 +799,7 @@ class Model_Wrapper(object):
     def setOptimizer(self, lr=None, momentum=None, loss='categorical_crossentropy', loss_weights=None, metrics=None,
                      epsilon=1e-8,
                      nesterov=True, decay=0.0, clipnorm=10., clipvalue=0., optimizer=None, sample_weight_mode=None,
-                     tf_optimizer=True):
+                     tf_optimizer=True, label_smoothing=0.):
         """
             Sets a new optimizer for the CNN model.
             :param nesterov:
@@ -691,6 +816,9 @@ class Model_Wrapper(object):
             :param clipnorm: gradients' clip norm
             :param optimizer: string identifying the type of optimizer used (default: SGD)
             :param sample_weight_mode: 'temporal' or None
+            :param label_smoothing: epsilon value for label smoothing. It is applied inside the loss to the outputs
+                                    trained with 'sparse_categorical_crossentropy'
+                                    (targets given as indices, e.g. dataset outputs of type 'dense-text').
         """
         # Pick default parameters
         if lr is None:
@@ -702,6 +830,16 @@ class Model_Wrapper(object):
         else:
             self.momentum = momentum
         self.loss = loss
+        self.label_smoothing = label_smoothing
+        if label_smoothing > 0.:
+            smoothed_loss = sparse_categorical_crossentropy_smoothed(label_smoothing)
+            if isinstance(loss, dict):
+                loss = dict((out, smoothed_loss if out_loss == 'sparse_categorical_crossentropy' else out_loss)
+                            for out, out_loss in iteritems(loss))
+            elif isinstance(loss, list):
+                loss = [smoothed_loss if out_loss == 'sparse_categorical_crossentropy' else out_loss for out_loss in loss]
+            elif loss == 'sparse_categorical_crossentropy':
+                loss = smoothed_loss
         if metrics is None:
             metrics = []
         if tf_optimizer and K.backend() == 'tensorflow':
@@ -887,6 +1025,8 @@ class Model_Wrapper(object):
             ####    Learning parameters
              * n_epochs: number of epochs that will be applied during training
              * batch_size: size of the batch (number of images) applied on each iteration by the SGD optimization
+             * max_tokens: if not None, the batches are made of samples of similar length, with up to max_tokens
+                           tokens per batch instead of batch_size samples (see Dataset.getBucketedBatches)
              * lr_decay: number of iterations passed for decreasing the learning rate
              * lr_gamma: proportion of learning rate kept at each decrease.
                          It can also be a set of rules defined by a list, e.g.
@@ -898,6 +1038,11 @@ class Model_Wrapper(object):
             ####    Data processing parameters
 
              * n_parallel_loaders: number of parallel data loaders allowed to work at the same time
+             * n_prefetch_batches: number of batches loaded in advance by a background thread
+                                   (only if n_parallel_loaders = 1)
+             * sequence_workers: if > 0, the batches are loaded by this number of Keras workers from a
+                                 Data_Batch_Sequence (Keras 2, not compatible with homogeneous_batches)
+             * use_multiprocessing: use processes instead of threads as Keras workers (with sequence_workers > 0)
              * normalize: boolean indicating if we want to normalize the image pixel values
              * mean_substraction: boolean indicating if we want to substract the training mean
              * data_augmentation: boolean indicating if we want to perform data augmentation
@@ -921,10 +1066,34 @@ class Model_Wrapper(object):
         if params['verbose'] > 0:
             logger.info("<<< Training model >>>")
 
+        self.__checkSparseTargets(ds)
         self.__train(ds, params)
 
         logger.info("<<< Finished training model >>>")
 
+    def __checkSparseTargets(self, ds):
+        """
+            Checks that the loss is consistent with the outputs of type 'dense-text' (sparse targets) of the dataset.
+            :param ds: Dataset with the training data
+        """
+        types_outputs = ds.types_outputs.get('train', [])
+        for out_model, out_ds in iteritems(self.outputsMapping):
+            if out_ds >= len(types_outputs) or types_outputs[out_ds] != 'dense-text':
+                continue
+            id_out = ds.ids_outputs[out_ds]
+            if isinstance(self.loss, dict):
+                out_loss = self.loss.get(out_model)
+            elif isinstance(self.loss, list):
+                out_loss = self.loss[out_model] if isinstance(out_model, int) and out_model < len(self.loss) else None
+            else:
+                out_loss = self.loss
+            if out_loss == 'categorical_crossentropy':
+                raise AssertionError('The output "' + id_out + '" is of type "dense-text" (sparse targets), '
+                                     'use loss="sparse_categorical_crossentropy" in setOptimizer().')
+            if ds.label_smoothing.get(id_out, dict()).get('train', 0.) > 0. and getattr(self, 'label_smoothing', 0.) == 0.:
+                logger.warning('Label smoothing is not applied by the Dataset on outputs of type "dense-text". '
+                               'Use setOptimizer(label_smoothing=...) for applying it in the loss.')
+
     def trainNetFromSamples(self, x, y, parameters=None, class_weight=None, sample_weight=None, out_name=None):
         """
             Trains the network on the given samples x, y.
@@ -1042,6 +1211,9 @@ class Model_Wrapper(object):
             callbacks.append(callback_tensorboard)
 
         # Prepare data generators
+        use_bucketing = params['max_tokens'] is not None and not params['homogeneous_batches']
+        use_sequence = params['sequence_workers'] > 0 and not params['homogeneous_batches'] and not use_bucketing and \
+            int(keras.__version__.split('.')[0]) > 1
         if params['homogeneous_batches']:
             train_gen = Homogeneous_Data_Batch_Generator('train',
                                                          self,
@@ -1056,6 +1228,34 @@ class Model_Wrapper(object):
                                                          da_patch_type=params['da_patch_type'],
                                                          da_enhance_list=params['da_enhance_list'],
                                                          mean_substraction=params['mean_substraction']).generator()
+        elif use_bucketing:
+            train_gen_instance = Bucketed_Data_Batch_Generator('train',
+                                                               self,
+                                                               ds,
+                                                               params['max_tokens'],
+                                                               normalization=params['normalize'],
+                                                               normalization_type=params['normalization_type'],
+                                                               data_augmentation=params['data_augmentation'],
+                                                               wo_da_patch_type=params['wo_da_patch_type'],
+                                                               da_patch_type=params['da_patch_type'],
+                                                               da_enhance_list=params['da_enhance_list'],
+                                                               mean_substraction=params['mean_substraction'],
+                                                               shuffle=params['shuffle'])
+            state['n_iterations_per_epoch'] = train_gen_instance.num_iterations
+            train_gen = train_gen_instance.generator()
+        elif use_sequence:
+            train_gen = Data_Batch_Sequence('train',
+                                            self,
+                                            ds,
+                                            batch_size=params['batch_size'],
+                                            normalization=params['normalize'],
+                                            normalization_type=params['normalization_type'],
+                                            data_augmentation=params['data_augmentation'],
+                                            wo_da_patch_type=params['wo_da_patch_type'],
+                                            da_patch_type=params['da_patch_type'],
+                                            da_enhance_list=params['da_enhance_list'],
+                                            mean_substraction=params['mean_substraction'],
+                                            shuffle=params['shuffle'])
         elif params['n_parallel_loaders'] > 1:
             train_gen = Parallel_Data_Batch_Generator('train',
                                                       self,
@@ -1085,6 +1285,9 @@ class Model_Wrapper(object):
                                              da_enhance_list=params['da_enhance_list'],
                                              mean_substraction=params['mean_substraction'],
                                              shuffle=params['shuffle']).generator()
+        if params['n_prefetch_batches'] > 0 and (params['homogeneous_batches'] or use_bucketing or
+                                                 (params['n_parallel_loaders'] <= 1 and not use_sequence)):
+            train_gen = Prefetch_Batch_Generator(train_gen, params['n_prefetch_batches']).generator()
 
         # Are we going to validate on 'val' data?
         if False:  # TODO: loss calculation on val set is deactivated
@@ -1148,8 +1351,10 @@ class Model_Wrapper(object):
                                          validation_data=val_gen,
                                          validation_steps=n_valid_samples,
                                          class_weight=class_weight,
-                                         max_queue_size=params['n_parallel_loaders'],
-                                         workers=1,
+                                         max_queue_size=max(params['n_parallel_loaders'], params['sequence_workers']),
+                                         workers=params['sequence_workers'] if use_sequence else 1,
+                                         use_multiprocessing=use_sequence and params['use_multiprocessing'],
+                                         shuffle=False,
                                          initial_epoch=params['epoch_offset'])
 
     def __train_from_samples(self, x, y, params, class_weight=None, sample_weight=None):
@@ -1611,6 +1816,28 @@ class Model_Wrapper(object):
                         raise AssertionError('PosUnk is not supported with non-optimized beam search methods')
 
                 params['pad_on_batch'] = ds.pad_on_batch[params['dataset_inputs'][params['state_below_index']]]
+                # Bucketing is not applied to random samples, temporally-linked models or sources read from the batches
+                use_bucketing = params['max_tokens'] is not None and params['n_samples'] < 1 and \
+                    not params['temporally_linked'] and \
+                    not (params['pos_unk'] and not eval('ds.loaded_raw_' + s + '[0]'))
+                # Text inputs padded to the longest sample of each batch. Their padding is removed before the search, so
+                # that each sample is searched as if it was loaded alone (as without bucketing)
+                batch_padded_inputs = dict()
+                if use_bucketing:
+                    for pos, (dataset_input, model_input) in enumerate(zip(params['dataset_inputs'],
+                                                                           params['model_inputs'])):
+                        if pos == params['state_below_index'] or dataset_input not in ds.ids_inputs:
+                            continue
+                        type_input = ds.types_inputs[s][ds.ids_inputs.index(dataset_input)]
+                        if type_input not in ['text', 'text-features'] or not ds.pad_on_batch[dataset_input]:
+                            continue
+                        if type_input == 'text' and ds.fill_text[dataset_input] == 'end' and \
+                                ds.text_offset[dataset_input] == 0 and not ds.words_so_far[dataset_input]:
+                            batch_padded_inputs[model_input] = dataset_input
+                        else:  # The padding of this input cannot be removed
+                            use_bucketing = False
+                # The batches are made of samples of similar length in these inputs
+                bucketing_data_ids = list(batch_padded_inputs.values()) or None
 
                 if params['temporally_linked']:
                     previous_outputs = {}  # variable for storing previous outputs if using a temporally-linked model
@@ -1628,7 +1855,22 @@ class Model_Wrapper(object):
                     num_iterations = int(math.ceil(float(n_samples)))  # / params['max_batch_size']))
                     n_samples = min(eval("ds.len_" + s), num_iterations)  # * params['batch_size'])
                     # Prepare data generator: We won't use an Homogeneous_Data_Batch_Generator here
-                    if params['n_parallel_loaders'] > 1:
+                    if use_bucketing:
+                        # Batches of samples of similar length (the predictions are sorted back at the end)
+                        data_gen_instance = Bucketed_Data_Batch_Generator(s,
+                                                                          self,
+                                                                          ds,
+                                                                          params['max_tokens'],
+                                                                          max_batch_size=params['max_batch_size'],
+                                                                          normalization=params['normalize'],
+                                                                          normalization_type=params['normalization_type'],
+                                                                          data_augmentation=False,
+                                                                          mean_substraction=params['mean_substraction'],
+                                                                          predict=True,
+                                                                          n_samples=n_samples,
+                                                                          data_ids=bucketing_data_ids)
+                        num_iterations = data_gen_instance.num_iterations
+                    elif params['n_parallel_loaders'] > 1:
                         data_gen_instance = Parallel_Data_Batch_Generator(s,
                                                                           self,
                                                                           ds,
@@ -1679,6 +1921,8 @@ class Model_Wrapper(object):
                                                                  random_samples=n_samples,
                                                                  temporally_linked=params['temporally_linked'])
                     data_gen = data_gen_instance.generator()
+                if params['n_prefetch_batches'] > 0 and (params['n_parallel_loaders'] <= 1 or use_bucketing):
+                    data_gen = Prefetch_Batch_Generator(data_gen, params['n_prefetch_batches']).generator()
 
                 if params['n_samples'] > 0:
                     references = []
@@ -1741,6 +1985,9 @@ class Model_Wrapper(object):
                                                           pad_on_batch=ds.pad_on_batch[input_id],
                                                           words_so_far=ds.words_so_far[input_id],
                                                           loading_X=True)[0]
+                            elif use_bucketing and input_id in batch_padded_inputs:
+                                x[input_id] = np.asarray([remove_batch_padding(X[input_id][i],
+                                                                               ds.extra_words['<pad>'])])
                             else:
                                 x[input_id] = np.asarray([X[input_id][i]])
                         samples, scores, alphas = beam_search(self,
@@ -1799,6 +2046,12 @@ class Model_Wrapper(object):
                                 previous_outputs[input_id][first_idx + sampled - 1] = best_sample[:sum(
                                     [int(elem > 0) for elem in best_sample])]
 
+                if use_bucketing:
+                    order = np.argsort(np.concatenate(data_gen_instance.batches), kind='mergesort')
+                    best_samples = [best_samples[i] for i in order]
+                    if params['pos_unk']:
+                        best_alphas = [best_alphas[i] for i in order]
+
                 sys.stdout.write('\n Total cost of the translations: %f \t Average cost of the translations: %f\n' % (total_cost, total_cost / n_samples))
                 sys.stdout.write('The sampling took: %f secs (Speed: %f sec/sample)\n' % ((time.time() - start_time), (time.time() - start_time) / n_samples))
 
@@ -1838,6 +2091,9 @@ class Model_Wrapper(object):
         params = checkParameters(parameters, self.default_predict_params)
 
         model_predict = getattr(self, params['model_name'])  # recover model for prediction
+        # Random samples (n_samples) and post-processed predictions are read from a generator
+        use_sequence = params['sequence_workers'] > 0 and params['n_samples'] is None and postprocess_fun is None and \
+            int(keras.__version__.split('.')[0]) > 1
         predictions = dict()
         for s in params['predict_on_sets']:
             predictions[s] = []
@@ -1856,7 +2112,20 @@ class Model_Wrapper(object):
                 n_samples = min(eval("ds.len_" + s), num_iterations * params['batch_size'])
 
                 # Prepare data generator
-                if params['n_parallel_loaders'] > 1:
+                if use_sequence:
+                    data_gen = Data_Batch_Sequence(s,
+                                                   self,
+                                                   ds,
+                                                   batch_size=params['batch_size'],
+                                                   normalization=params['normalize'],
+                                                   normalization_type=params['normalization_type'],
+                                                   data_augmentation=False,
+                                                   wo_da_patch_type=params['wo_da_patch_type'],
+                                                   mean_substraction=params['mean_substraction'],
+                                                   predict=True,
+                                                   init_sample=params['init_sample'],
+                                                   final_sample=params['final_sample'])
+                elif params['n_parallel_loaders'] > 1:
                     data_gen = Parallel_Data_Batch_Generator(s,
                                                              self,
                                                              ds,
@@ -1918,6 +2187,8 @@ class Model_Wrapper(object):
                                                     mean_substraction=params['mean_substraction'],
                                                     predict=True,
                                                     random_samples=n_samples).generator()
+            if params['n_prefetch_batches'] > 0 and params['n_parallel_loaders'] <= 1 and not use_sequence:
+                data_gen = Prefetch_Batch_Generator(data_gen, params['n_prefetch_batches']).generator()
             # Predict on model
             if postprocess_fun is None:
                 if int(keras.__version__.split('.')[0]) == 1:
@@ -1931,8 +2202,11 @@ class Model_Wrapper(object):
                     # Keras version 2.x
                     out = model_predict.predict_generator(data_gen,
                                                           num_iterations,
-                                                          max_queue_size=params['n_parallel_loaders'],
-                                                          workers=1,  # params['n_parallel_loaders'],
+                                                          max_queue_size=max(params['n_parallel_loaders'],
+                                                                             params['sequence_workers']),
+                                                          workers=params['sequence_workers'] if use_sequence else 1,
+                                                          use_multiprocessing=use_sequence and
+                                                          params['use_multiprocessing'],
                                                           verbose=params['verbose'])
                 predictions[s] = out
             else:
@@ -2,15 +2,24 @@
 from __future__ import print_function
 
 import ast
+import atexit
+import bisect
 import copy
 import fnmatch
+import hashlib
+import itertools
 import logging
 import ntpath
 import os
 import random
+import shutil
 import sys
+import tempfile
+import threading
+import traceback
 from functools import reduce
-from six import iteritems
+from six import iteritems, reraise, string_types, text_type
+from six.moves import queue
 
 if sys.version_info.major == 3:
     import _pickle as pk
@@ -18,14 +27,13 @@ else:
     import cPickle as pk
     from itertools import izip as zip
 import codecs
-from collections import Counter, defaultdict
-from operator import add
+from collections import Counter, OrderedDict, defaultdict, deque
 import numpy as np
 from keras_wrapper.extra.read_write import create_dir_if_not_exists
 from keras_wrapper.extra.tokenizers import *
-from .utils import bbox, to_categorical
-from .utils import MultiprocessQueue
+from .utils import bbox, to_categorical, resize_maps, resize_image, build_index2word, RaggedArray, LRUArrayCache
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
@@ -36,20 +44,169 @@ logger = logging.getLogger(__name__)
 # ------------------------------------------------------- #
 
 
-def saveDataset(dataset, store_path):
+COLUMNAR_METADATA_FILE = 'metadata.pkl'
+COLUMNAR_SPLIT_ATTRIBUTES = ['X_train', 'X_val', 'X_test', 'Y_train', 'Y_val', 'Y_test']
+# Version of the format of the entries of the text cache (see Dataset.setTextCache)
+TEXT_CACHE_VERSION = '2'
+
+
+class LazyColumn(object):
+    """
+    Reference to a column stored on disk by saveDataset with format='columnar'.
+    """
+
+    def __init__(self, path, column_format, as_list, fields=None):
+        """
+        :param path: Path to the file storing the column.
+        :param column_format: 'npy' (memory-mapped numpy array), 'ragged' (memory-mapped RaggedArray)
+                              or 'pkl' (pickled object).
+        :param as_list: Whether the column must be returned as a python list.
+        :param fields: Names of the per-row fields of a 'ragged' column.
+        """
+        self.path = path
+        self.column_format = column_format
+        self.as_list = as_list
+        self.fields = fields if fields is not None else []
+
+    def load(self):
+        """
+        Materializes the column.
+        :return: Column contents.
+        """
+        if self.column_format == 'npy':
+            column = np.load(self.path, mmap_mode='r')
+            if self.as_list:
+                column = column.tolist()
+        elif self.column_format == 'ragged':
+            column = RaggedArray(np.load(self.path + '.data.npy', mmap_mode='r'),
+                                 np.load(self.path + '.offsets.npy', mmap_mode='r'),
+                                 dict((name, np.load(self.path + '.' + name + '.npy', mmap_mode='r'))
+                                      for name in self.fields))
+        elif self.column_format == 'pkl':
+            with open(self.path, 'rb') as f:
+                if sys.version_info.major == 3:
+                    column = pk.load(f, encoding='utf-8')
+                else:
+                    column = pk.load(f)
+        else:
+            raise NotImplementedError('Column format "' + str(self.column_format) + '" is not implemented.')
+        return column
+
+
+class LazyColumnDict(dict):
+    """
+    Dictionary of samples (e.g. Dataset.X_train) whose columns are loaded from disk on first access.
+    Pickling a LazyColumnDict materializes all its columns, so the resulting object is a regular dict.
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, LazyColumn):
+            value = value.load()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def copy(self):
+        return dict(self.items())
+
+    def is_loaded(self, key):
+        """
+        Checks whether a column has already been materialized.
+        :param key: Column identifier.
+        :return: True if the column is in memory.
+        """
+        return not isinstance(dict.__getitem__(self, key), LazyColumn)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+
+def saveColumn(column, column_path):
+    """
+    Stores a column of samples in disk. Homogeneous numeric and string columns are stored as .npy files and
+    RaggedArrays as a set of .npy files (which will be memory-mapped when loaded), the rest of columns are pickled.
+
+    :param column: List, numpy array or RaggedArray of samples.
+    :param column_path: Path (without extension) where the column will be stored.
+    :return: Path to the stored file, storage format, whether the column was a list and ragged fields.
+    """
+    if isinstance(column, RaggedArray):
+        np.save(column_path + '.data.npy', column.data[column.offsets[0]:column.offsets[-1]])
+        np.save(column_path + '.offsets.npy', column.offsets - column.offsets[0])
+        for name, values in iteritems(column.fields):
+            np.save(column_path + '.' + name + '.npy', values)
+        return column_path, 'ragged', False, list(column.fields)
+    as_list = not isinstance(column, np.ndarray)
+    try:
+        array = np.asarray(column)
+    except ValueError:  # Ragged column
+        array = None
+    if array is not None and array.ndim > 0 and array.dtype.kind in 'biufcU':
+        column_path += '.npy'
+        np.save(column_path, array)
+        # Numeric columns are kept memory-mapped, strings must be python objects
+        return column_path, 'npy', as_list and array.dtype.kind == 'U', None
+    column_path += '.pkl'
+    with open(column_path, 'wb') as f:
+        pk.dump(column, f, protocol=-1)
+    return column_path, 'pkl', as_list, None
+
+
+def saveDataset(dataset, store_path, format='pickle'):
     """
     Saves a backup of the current Dataset object.
 
     :param dataset: Dataset object to save
     :param store_path: Saving path
+    :param format: Storage format:
+                    * 'pickle': The whole Dataset object is stored in a single .pkl file.
+                    * 'columnar': The Dataset is stored in a directory, with a file for each (split, id)
+                                  column and a metadata file (vocabularies, types, lengths, etc.).
+                                  Columns are lazily loaded (and memory-mapped when possible) by loadDataset.
     :return: None
     """
     create_dir_if_not_exists(store_path)
-    store_path = store_path + '/Dataset_' + dataset.name + '.pkl'
+    if format == 'pickle':
+        store_path = store_path + '/Dataset_' + dataset.name + '.pkl'
+    elif format == 'columnar':
+        store_path = store_path + '/Dataset_' + dataset.name
+    else:
+        raise NotImplementedError('Dataset format "' + str(format) + '" is not implemented. '
+                                  'Valid formats are "pickle" and "columnar".')
     if not dataset.silence:
         logger.info("<<< Saving Dataset instance to " + store_path + " ... >>>")
 
-    pk.dump(dataset, open(store_path, 'wb'), protocol=-1)
+    if format == 'pickle':
+        pk.dump(dataset, open(store_path, 'wb'), protocol=-1)
+    else:
+        create_dir_if_not_exists(store_path)
+        metadata = dataset.__getstate__().copy()
+        columns = dict()
+        for attr in COLUMNAR_SPLIT_ATTRIBUTES:
+            columns[attr] = dict()
+            for i, (data_id, column) in list(enumerate(metadata.pop(attr).items())):
+                column_file, column_format, as_list, fields = saveColumn(column, store_path + '/' + attr + '_' + str(i))
+                columns[attr][data_id] = (os.path.basename(column_file), column_format, as_list, fields)
+        metadata['_columns'] = columns
+        pk.dump(metadata, open(store_path + '/' + COLUMNAR_METADATA_FILE, 'wb'), protocol=-1)
 
     if not dataset.silence:
         logger.info("<<< Dataset instance saved >>>")
@@ -58,13 +215,29 @@ def saveDataset(dataset, store_path):
 def loadDataset(dataset_path):
     """
     Loads a previously saved Dataset object.
+    The storage format ('pickle' file or 'columnar' directory) is automatically detected.
 
     :param dataset_path: Path to the stored Dataset to load
     :return: Loaded Dataset object
     """
 
     logger.info("<<< Loading Dataset instance from " + dataset_path + " ... >>>")
-    if sys.version_info.major == 3:
+    if os.path.isdir(dataset_path):
+        with open(os.path.join(dataset_path, COLUMNAR_METADATA_FILE), 'rb') as f:
+            if sys.version_info.major == 3:
+                metadata = pk.load(f, encoding='utf-8')
+            else:
+                metadata = pk.load(f)
+        columns = metadata.pop('_columns')
+        for attr in COLUMNAR_SPLIT_ATTRIBUTES:
+            metadata[attr] = LazyColumnDict()
+            for data_id, (column_file, column_format, as_list, fields) in iteritems(columns[attr]):
+                dict.__setitem__(metadata[attr], data_id,
+                                 LazyColumn(os.path.join(dataset_path, column_file), column_format, as_list,
+                                            fields=fields))
+        dataset = Dataset.__new__(Dataset)
+        dataset.__setstate__(metadata)
+    elif sys.version_info.major == 3:
         dataset = pk.load(open(dataset_path, 'rb'), encoding='utf-8')
     else:
         dataset = pk.load(open(dataset_path, 'rb'))
@@ -75,71 +248,455 @@ def loadDataset(dataset_path):
         dataset.unk_symbol = '<unk>'
     if not hasattr(dataset, 'null_symbol'):
         dataset.null_symbol = '<null>'
+    if not hasattr(dataset, 'image_cache'):
+        dataset.image_cache = None
+    if not hasattr(dataset, 'image_shards'):
+        dataset.image_shards = dict()
+    if not hasattr(dataset, 'dtypes'):
+        dataset.dtypes = dict()
+    if not hasattr(dataset, 'train_std'):
+        dataset.train_std = dict()
+    if not hasattr(dataset, 'feature_stores'):
+        dataset.feature_stores = dict()
+        dataset.frames_offsets = dict()
+    if not hasattr(dataset, 'resolved_paths'):
+        dataset.resolved_paths = dict()
+    if not hasattr(dataset, 'text_processing_workers'):
+        dataset.text_processing_workers = 1
+        dataset.text_processing_chunk_size = 10000
+    if not hasattr(dataset, 'text_cache_path'):
+        dataset.text_cache_path = None
+    if not hasattr(dataset, 'image_decoding_threads'):
+        dataset.image_decoding_threads = 1
+        dataset.image_decoding_draft = False
+    if not hasattr(dataset, 'repeat_indices'):
+        dataset.repeat_indices = dict()
+        dataset.indices_train = None
+        dataset.indices_val = None
+        dataset.indices_test = None
+    if not hasattr(dataset, 'text_lengths'):
+        dataset.text_lengths = dict()
+    if not hasattr(dataset, 'BPE_config'):
+        dataset.BPE_config = None
 
     logger.info("<<< Dataset instance loaded >>>")
     return dataset
 
 
+class ImageShard(object):
+    """
+    Set of images, resized to a fixed size, packed into a single uint8 array stored as a .npy file
+    (<path>.npy, with shape (n_images, height, width[, channels])) and an index with the name of the image stored in
+    each row (<path>.txt, one name per line). See utils/build_image_shard.py.
+    The array is memory-mapped on first access.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the shard files (without extension).
+        """
+        self.path = path
+        self.data = None
+        self.rows = None
+
+    def load(self):
+        """
+        Memory-maps the array and reads the index of the shard.
+        """
+        if self.data is None:
+            self.data = np.load(self.path + '.npy', mmap_mode='r')
+            with codecs.open(self.path + '.txt', 'r', encoding='utf-8') as f:
+                self.rows = dict((line.rstrip('\n'), i) for i, line in enumerate(f))
+
+    @property
+    def shape(self):
+        self.load()
+        return self.data.shape
+
+    def getRows(self, images):
+        """
+        Finds the rows storing a set of images.
+        :param images: List of image names (as stored in the Dataset).
+        :return: Numpy array of rows.
+        """
+        self.load()
+        try:
+            return np.array([self.rows[image] for image in images], dtype='int64')
+        except KeyError as e:
+            raise Exception('The sample ' + str(e) + ' is not stored in ' + self.path)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+class FeatureStore(ImageShard):
+    """
+    Set of feature vectors ('image-features' or 'video-features' frames) packed into a single array stored as a .npy
+    file (<path>.npy, with shape (n_features, feat_len)) and an index with the name (path of the .npy file, as stored
+    in the Dataset) of the feature stored in each row (<path>.txt, one name per line).
+    See utils/build_feature_store.py.
+    The array is memory-mapped on first access.
+    """
+    pass
+
+
+def _initImagesStatistics(dataset):
+    """
+    Initializes a worker process of Dataset.calculateTrainMean.
+    """
+    global _statistics_dataset
+    _statistics_dataset = dataset
+
+
+def _imagesStatistics(task):
+    """
+    Computes the partial statistics of a batch of images in a worker process of Dataset.calculateTrainMean.
+    :param task: (images, data_id)
+    """
+    return _statistics_dataset.getImagesStatistics(*task)
+
+
+def _countWords(sentences, do_split, split_symbol):
+    """
+    Counts the words of a chunk of sentences (see Dataset.build_vocabulary).
+    :param sentences: List of sentences.
+    :param do_split: Split sentence by words or use the full sentence as a word.
+    :param split_symbol: Symbol used for separating the words in each sentence.
+    :return: [Counter, number of sentences]
+    """
+    counter = Counter()
+    if do_split:
+        for line in sentences:
+            counter.update(line.strip().split(split_symbol))
+    else:
+        counter.update(sentences)
+    return [counter, len(sentences)]
+
+
+def _initTokenizer(tokenization, tokenizer_config):
+    """
+    Builds the tokenizer of a text processing worker (see Dataset.setTextProcessing).
+    The tokenizer (e.g. the BPE codes or the Moses tokenizer) is only built once for each worker.
+    :param tokenization: Name of the tokenization method of the Dataset.
+    :param tokenizer_config: Configuration of the tokenizer of the Dataset (see Dataset.getTokenizerConfig).
+    """
+    global _tokenizer
+    dataset = Dataset('tokenizer', '.', silence=True)
+    if 'bpe' in tokenizer_config:
+        dataset.build_bpe(**tokenizer_config['bpe'])
+    if 'moses_language' in tokenizer_config:
+        dataset.build_moses_tokenizer(language=tokenizer_config['moses_language'])
+    _tokenizer = getattr(dataset, tokenization)
+
+
+def _tokenizeSentences(sentences):
+    """
+    Tokenizes a chunk of sentences with the tokenizer of the worker (see _initTokenizer).
+    :param sentences: List of sentences.
+    :return: List of tokenized sentences.
+    """
+    return [_tokenizer(sentence) for sentence in sentences]
+
+
 # ------------------------------------------------------- #
 #       DATA BATCH GENERATOR CLASS
 # ------------------------------------------------------- #
 
-def dataLoad(process_name, net, dataset, max_queue_len, queues):
+def _packBatch(data, arrays):
+    """
+    Replaces the (non-object) numpy arrays of a nested batch (lists, tuples and dicts of arrays) by their position in
+    the list 'arrays', where they are appended.
+    :param data: Batch structure.
+    :param arrays: List where the arrays are stored.
+    :return: Skeleton of the batch.
     """
-    Parallel data loader. Risky and untested!
-    :param process_name:
-    :param net:
-    :param dataset:
-    :param max_queue_len:
-    :param queues:
+    if isinstance(data, np.ndarray) and not data.dtype.hasobject:
+        arrays.append(data)
+        return _SharedArray(len(arrays) - 1)
+    if isinstance(data, (list, tuple)):
+        return type(data)([_packBatch(d, arrays) for d in data])
+    if isinstance(data, dict):
+        return dict([(key, _packBatch(d, arrays)) for key, d in iteritems(data)])
+    return data
+
+
+def _unpackBatch(skeleton, arrays):
+    """
+    Inverse of _packBatch: builds the batch from its skeleton and the list of arrays.
+    """
+    if isinstance(skeleton, _SharedArray):
+        return arrays[skeleton.position]
+    if isinstance(skeleton, (list, tuple)):
+        return type(skeleton)([_unpackBatch(s, arrays) for s in skeleton])
+    if isinstance(skeleton, dict):
+        return dict([(key, _unpackBatch(s, arrays)) for key, s in iteritems(skeleton)])
+    return skeleton
+
+
+class _SharedArray(object):
+    """
+    Placeholder of an array of a batch stored in a shared-memory slot.
+    """
+
+    def __init__(self, position):
+        self.position = position
+
+
+def dataLoad(process_name, net, dataset, shm_dir, queues):
+    """
+    Worker of a BatchWorkerPool. Receives queries (indices of the samples of a batch) from the tasks queue, loads the
+    batch and writes its arrays into the shared-memory slot of the query. Only the description of the batch (shapes,
+    dtypes and offsets in the slot) is sent back through the results queue.
+    :param process_name: Name of the worker.
+    :param net: Model_Wrapper which prepares the data (net.prepareData).
+    :param dataset: Dataset instance (inherited by the worker when it is created).
+    :param shm_dir: Directory of the shared-memory slots.
+    :param queues: [tasks queue, results queue].
     :return:
     """
     logger.info("Starting " + process_name + "...")
     in_queue, out_queue = queues
+    # The parent resolves the views (shuffling, selection) of the sets, the worker reads stored positions
+    for set_name in ['train', 'val', 'test']:
+        setattr(dataset, 'indices_' + set_name, None)
+    slots = OrderedDict()
 
     while True:
-        while out_queue.qsize() > max_queue_len:
-            pass
-
-        # available modes are 'indices' and 'consecutive'
-        data_queue = in_queue.get()
+        query = in_queue.get()
+        if query is None:
+            break
+        run_id, seq, slot, slot_file, capacity, seed, [mode, predict, set_split, ind, params] = query
+        try:
+            if seed is not None:
+                np.random.seed(seed)
+                random.seed(seed)
+            load_params = dict(normalization=params['normalization'],
+                               normalization_type=params['normalization_type'],
+                               meanSubstraction=params['mean_substraction'],
+                               dataAugmentation=params['data_augmentation'],
+                               wo_da_patch_type=params['wo_da_patch_type'],
+                               da_patch_type=params['da_patch_type'],
+                               da_enhance_list=params['da_enhance_list'])
+            # Recovers a batch of data
+            if predict:
+                if mode == 'indices':
+                    X_batch = dataset.getX_FromIndices(set_split, ind, **load_params)
+                elif mode == 'consecutive':
+                    X_batch = dataset.getX(set_split, ind[0], ind[1], **load_params)
+                else:
+                    raise NotImplementedError("Data retrieval mode '" + mode + "' is not implemented.")
+                data = net.prepareData(X_batch, None)[0]
+            else:
+                X_batch, Y_batch = dataset.getXY_FromIndices(set_split, ind, **load_params)
+                data = net.prepareData(X_batch, Y_batch)
+
+            # Writes the arrays of the batch into the slot (which is replaced by a bigger one if needed)
+            arrays = []
+            skeleton = _packBatch(data, arrays)
+            specs = []
+            offset = 0
+            for array in arrays:
+                specs.append((offset, array.shape, array.dtype.str))
+                offset += (array.nbytes + 63) // 64 * 64
+            if offset > capacity:
+                capacity = offset + offset // 4
+                fd, slot_file = tempfile.mkstemp(dir=shm_dir, suffix='.slot')
+                with os.fdopen(fd, 'wb') as f:
+                    f.truncate(capacity)
+            # Keeps the mapping of the last used slots (the slots of finished runs are not used again)
+            stored_file, buf = slots.pop(slot, (None, None))
+            if stored_file != slot_file:
+                buf = np.memmap(slot_file, dtype='uint8', mode='r+', shape=(capacity,))
+            slots[slot] = (slot_file, buf)
+            if len(slots) > 16:
+                slots.popitem(last=False)
+            for array, (array_offset, shape, dtype) in zip(arrays, specs):
+                np.ndarray(shape, dtype=dtype, buffer=buf, offset=array_offset)[...] = array
+            out_queue.put((run_id, seq, slot_file, capacity, skeleton, specs, None))
+        except Exception:
+            out_queue.put((run_id, seq, slot_file, capacity, None, None,
+                           process_name + ' failed:\n' + traceback.format_exc()))
+
+
+class BatchWorkerPool(object):
+    """
+    Persistent pool of data loading processes (see dataLoad). The workers receive the Dataset and the Model_Wrapper only
+    once, when they are created, and then only the indices of the samples of each batch. Batches are written by the
+    workers into shared-memory slots (files in /dev/shm) and are delivered in the order of the queries.
+    A pool can be used by several runs (e.g. the training generator and the evaluation callbacks) at the same time.
+    """
 
-        [mode, predict, set_split, ind, normalization, normalization_type, mean_substraction, data_augmentation] = data_queue
+    def __init__(self, net, dataset, n_workers):
+        """
+        Creates the pool and starts its workers.
+        :param net: Model_Wrapper which prepares the data.
+        :param dataset: Dataset instance.
+        :param n_workers: Number of worker processes.
+        """
+        self.n_workers = n_workers
+        self.pid = os.getpid()
+        self.shm_dir = tempfile.mkdtemp(prefix='batch_worker_pool_',
+                                        dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.condition = threading.Condition()
+        self.reading = False
+        self.runs = dict()  # run id -> {seq: result}
+        self.slots = dict()  # slot -> (file, memmap)
+        self.n_runs = 0
+        self.n_slots = 0
+        self.closed = False
+        self.workers = []
+        for i in range(n_workers):
+            worker = multiprocessing.Process(target=dataLoad,
+                                             args=('dataLoad_process_' + str(i), net, dataset, self.shm_dir,
+                                                   [self.tasks, self.results]))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Stops the workers and removes the shared-memory slots.
+        """
+        if self.closed or self.pid != os.getpid():
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(1.)
+            if worker.is_alive():
+                worker.terminate()
+        self.slots = dict()
+        shutil.rmtree(self.shm_dir, ignore_errors=True)
+
+    def run(self, queries, n_ahead, n_delivered, seeds=None):
+        """
+        Generator which sends the queries to the workers and yields their batches in the order of the queries.
+        The arrays of a yielded batch are views of its shared-memory slot, which is reused once n_delivered more batches
+        have been yielded.
+        :param queries: Iterable of queries [mode, predict, set_split, indices, params] (see dataLoad).
+        :param n_ahead: Maximum number of queries being processed by the workers.
+        :param n_delivered: Number of yielded batches whose slots are kept.
+        :param seeds: Optional iterable of random seeds of the queries (for the data augmentation).
+        :return: Generator of batches.
+        """
+        if self.closed:
+            raise Exception('The pool of data loaders has been closed.')
+        with self.condition:
+            run_id = self.n_runs
+            self.n_runs += 1
+            free_slots = list(range(self.n_slots, self.n_slots + n_ahead + n_delivered))
+            self.n_slots += n_ahead + n_delivered
+            self.runs[run_id] = dict()
+        queries = iter(queries)
+        seeds = iter(seeds) if seeds is not None else None
+        pending = deque()
+        delivered = deque()
+        seq = 0
+        finished = False
+        try:
+            while True:
+                while not finished and len(pending) < n_ahead and free_slots:
+                    try:
+                        query = next(queries)
+                    except StopIteration:
+                        finished = True
+                        break
+                    slot = free_slots.pop()
+                    with self.condition:
+                        slot_file, capacity = self.slots.get(slot, (None, 0, None))[:2]
+                    seed = next(seeds) if seeds is not None else None
+                    self.tasks.put((run_id, seq, slot, slot_file, capacity, seed, query))
+                    pending.append((seq, slot))
+                    seq += 1
+                if not pending:
+                    break
+                slot_seq, slot = pending.popleft()
+                data = self.__getBatch(run_id, slot_seq, slot)
+                delivered.append(slot)
+                if len(delivered) > n_delivered:
+                    free_slots.append(delivered.popleft())
+                yield data
+        finally:
+            self.__closeRun(run_id, [s for _, s in pending] + list(delivered) + free_slots)
+
+    def __getBatch(self, run_id, seq, slot):
+        """
+        Waits for the batch seq of a run (reading and routing the results of any run meanwhile).
+        """
+        with self.condition:
+            while seq not in self.runs[run_id]:
+                if self.reading:
+                    self.condition.wait()
+                    continue
+                self.reading = True
+                self.condition.release()
+                try:
+                    result = self.__readResult()
+                finally:
+                    self.condition.acquire()
+                    self.reading = False
+                    self.condition.notify_all()
+                if result[0] in self.runs:
+                    self.runs[result[0]][result[1]] = result
+                elif result[2] is not None and not any(result[2] == f for f, _, _ in self.slots.values()):
+                    # Slot created for a closed run
+                    self.__removeFile(result[2])
+            _, _, slot_file, capacity, skeleton, specs, error = self.runs[run_id].pop(seq)
+            if error is not None:
+                raise Exception(error)
+            stored_file = self.slots.get(slot, (None, None, None))[0]
+            if stored_file != slot_file:
+                self.slots[slot] = (slot_file, capacity, np.memmap(slot_file, dtype='uint8', mode='r+',
+                                                                   shape=(capacity,)))
+                if stored_file is not None:
+                    # Mapped arrays of previous batches remain valid
+                    self.__removeFile(stored_file)
+            buf = self.slots[slot][2]
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset) for offset, shape, dtype in specs]
+        return _unpackBatch(skeleton, arrays)
+
+    def __readResult(self):
+        """
+        Blocks until a worker sends a result, checking that the workers are still alive.
+        """
+        while True:
+            try:
+                return self.results.get(timeout=1.)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise Exception('A data loader process died unexpectedly.')
 
-        # Recovers a batch of data
-        if predict:
-            if mode == 'indices':
-                X_batch = dataset.getX_FromIndices(set_split,
-                                                   ind[0],
-                                                   normalization=normalization,
-                                                   normalization_type=normalization_type,
-                                                   meanSubstraction=mean_substraction,
-                                                   dataAugmentation=data_augmentation)
-            elif mode == 'consecutive':
-                X_batch = dataset.getX(set_split,
-                                       ind[0], ind[1],
-                                       normalization=normalization,
-                                       normalization_type=normalization_type,
-                                       meanSubstraction=mean_substraction,
-                                       dataAugmentation=data_augmentation)
-            else:
-                raise NotImplementedError("Data retrieval mode '" + mode + "' is not implemented.")
-            data = net.prepareData(X_batch, None)[0]
-        else:
-            X_batch, Y_batch = dataset.getXY_FromIndices(set_split,
-                                                         ind[0],
-                                                         normalization=normalization,
-                                                         normalization_type=normalization_type,
-                                                         meanSubstraction=mean_substraction,
-                                                         dataAugmentation=data_augmentation)
-            data = net.prepareData(X_batch, Y_batch)
+    def __closeRun(self, run_id, slots):
+        """
+        Discards the pending results of a run and removes its slots.
+        """
+        with self.condition:
+            self.runs.pop(run_id, None)
+            for slot in slots:
+                slot_file = self.slots.pop(slot, (None, None, None))[0]
+                if slot_file is not None:
+                    self.__removeFile(slot_file)
 
-        out_queue.put(data)
+    @staticmethod
+    def __removeFile(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
 
 class Parallel_Data_Batch_Generator(object):
     """
-    Batch generator class. Retrieves batches of data.
+    Batch generator class. Retrieves batches of data, which are loaded by a pool of processes (see BatchWorkerPool).
+    The pool is kept by the dataset and reused by the next generators with the same net and number of loaders.
+    Batches are yielded in the same order as with Data_Batch_Generator.
     """
 
     def __init__(self,
@@ -191,7 +748,6 @@ class Parallel_Data_Batch_Generator(object):
         self.init_sample = init_sample
         self.final_sample = final_sample
         self.next_idx = None
-        self.thread_list = []
 
         # Several parameters
         self.params = {'batch_size': batch_size,
@@ -207,39 +763,68 @@ class Parallel_Data_Batch_Generator(object):
                        'shuffle': shuffle,
                        'n_parallel_loaders': n_parallel_loaders}
 
-    def __del__(self):
-        self.terminateThreads()
-
     def terminateThreads(self):
-        for t in self.thread_list:
-            t.terminate()
+        """
+        Stops the pool of data loaders of the dataset. It must be called if the data of the dataset is modified,
+        since the loaders work on a copy of the dataset made when they were started.
+        """
+        pool = getattr(self.dataset, '_batch_worker_pool', (None, None))[1]
+        if pool is not None:
+            pool.close()
+            del self.dataset._batch_worker_pool
+
+    def getPool(self):
+        """
+        Gets the pool of data loaders of the dataset, which is created if it does not exist (or if it was created with
+        another net or number of loaders).
+        :return: BatchWorkerPool instance.
+        """
+        key = (os.getpid(), id(self.net), self.params['n_parallel_loaders'],
+               tuple(self.dataset.ids_inputs), tuple(self.dataset.ids_outputs))
+        pool_key, pool = getattr(self.dataset, '_batch_worker_pool', (None, None))
+        if pool_key != key or pool.closed:
+            if pool is not None and pool_key[0] == os.getpid():
+                pool.close()
+            pool = BatchWorkerPool(self.net, self.dataset, self.params['n_parallel_loaders'])
+            self.dataset._batch_worker_pool = (key, pool)
+        return pool
 
     def generator(self):
         """
         Gets and processes the data
         :return: generator with the data
         """
+        n_workers = self.params['n_parallel_loaders']
+        # Keeps the slots of the batches that may be queued by Keras (max_queue_size=n_parallel_loaders)
+        return self.getPool().run(self.__queries(), n_ahead=2 * n_workers, n_delivered=n_workers + 2,
+                                  seeds=self.__seeds() if self.__dataAugmentation() else None)
 
-        self.terminateThreads()
+    def __dataAugmentation(self):
+        return self.params['data_augmentation'] if self.set_split == 'train' and not self.predict else False
 
-        if self.set_split == 'train' and not self.predict:
-            data_augmentation = self.params['data_augmentation']
-        else:
-            data_augmentation = False
+    @staticmethod
+    def __seeds():
+        """
+        Random seeds of the queries, so that the data augmentation does not depend on the worker that loads the batch.
+        """
+        while True:
+            yield np.random.randint(0, 2 ** 31 - 1)
 
-        # Initialize list of parallel data loaders
-        thread_mngr = multiprocessing.Manager()
-        in_queue = MultiprocessQueue(thread_mngr, multiprocess_type='Queue')  # if self.params['n_parallel_loaders'] > 1 else 'Pipe')
-        out_queue = MultiprocessQueue(thread_mngr, multiprocess_type='Queue')  # if self.params['n_parallel_loaders'] > 1 else 'Pipe')
-        # Create a queue per function
-        for i in range(self.params['n_parallel_loaders']):
-            # create process
-            new_process = multiprocessing.Process(target=dataLoad,
-                                                  args=('dataLoad_process_' + str(i),
-                                                        self.net, self.dataset, int(self.params['n_parallel_loaders'] * 1.5), [in_queue, out_queue]))
-            self.thread_list.append(new_process)  # store processes for terminating later
-            new_process.start()
+    def __positions(self, indices):
+        """
+        Stored positions of the samples in the current view of the set split.
+        """
+        view = getattr(self.dataset, 'indices_' + self.set_split)
+        if view is None:
+            return list(indices)
+        return list(view[np.asarray(indices, dtype='int64')])
 
+    def __queries(self):
+        """
+        Generates the queries for the data loaders: the positions of the samples of each batch.
+        """
+        params = dict(self.params)
+        params['data_augmentation'] = self.__dataAugmentation()
         it = 0
         while True:
             if self.set_split == 'train' and it % self.params['num_iterations'] == 0 and \
@@ -258,7 +843,6 @@ class Parallel_Data_Batch_Generator(object):
             n_samples_split = getattr(self.dataset, "len_" + self.set_split)
             if final_sample >= n_samples_split:
                 final_sample = n_samples_split
-                # batch_size = final_sample - init_sample
                 it = 0
 
             # Recovers a batch of data
@@ -274,39 +858,78 @@ class Parallel_Data_Batch_Generator(object):
                 else:
                     indices = np.random.randint(0, n_samples_split, num_retrieve)
                 self.params['random_samples'] -= num_retrieve
-
-                # Prepare query data for parallel data loaders
-                query_data = ['indices', self.predict, self.set_split, [indices],
-                              self.params['normalization'], self.params['normalization_type'],
-                              self.params['mean_substraction'], data_augmentation]
+                query = ['indices', self.predict, self.set_split, self.__positions(indices), params]
 
             # specific data selection
             elif self.init_sample > -1 and self.final_sample > -1:
                 indices = range(self.init_sample, self.final_sample)
-
-                # Prepare query data for parallel data loaders
-                query_data = ['indices', self.predict, self.set_split, [indices],
-                              self.params['normalization'], self.params['normalization_type'],
-                              self.params['mean_substraction'], data_augmentation]
+                query = ['indices', self.predict, self.set_split, self.__positions(indices), params]
 
             # consecutive data selection
+            elif self.predict and getattr(self.dataset, 'indices_' + self.set_split) is None:
+                query = ['consecutive', self.predict, self.set_split, [init_sample, final_sample], params]
             else:
-                if self.predict:
-                    query_data = ['consecutive', self.predict, self.set_split, [init_sample, final_sample],
-                                  self.params['normalization'], self.params['normalization_type'],
-                                  self.params['mean_substraction'], data_augmentation]
-                else:
-                    query_data = ['consecutive', self.predict, self.set_split, [range(init_sample, final_sample)],
-                                  self.params['normalization'], self.params['normalization_type'],
-                                  self.params['mean_substraction'], data_augmentation]
+                indices = range(init_sample, final_sample)
+                query = ['indices', self.predict, self.set_split, self.__positions(indices), params]
+            yield query
+
+
+class Prefetch_Batch_Generator(object):
+    """
+    Batch generator class. Runs another batch generator in a background thread, which loads up to n_prefetch batches
+    in advance, so that the loading of the next batches overlaps with the processing of the current one.
+    """
+
+    def __init__(self, batch_generator, n_prefetch=1):
+        """
+        Initializes the Prefetch_Batch_Generator
+        :param batch_generator: Generator of batches (e.g. Data_Batch_Generator(...).generator())
+        :param n_prefetch: Maximum number of batches loaded in advance
+        """
+        self.batch_generator = batch_generator
+        self.n_prefetch = n_prefetch
 
-            # Insert data in queue
-            in_queue.put(query_data)
+    def generator(self):
+        """
+        Gets the data loaded by the background thread
+        :return: generator with the data
+        """
+        batches = queue.Queue(maxsize=self.n_prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=1.)
+                    return True
+                except queue.Full:
+                    pass
+            return False
 
-            # Check if there is processed data in queue
-            while out_queue.qsize() > 0:
-                data = out_queue.get()
-                yield (data)
+        def load():
+            try:
+                for data in self.batch_generator:
+                    if not put((True, data)):
+                        return
+                put((False, None))
+            except Exception:
+                put((False, sys.exc_info()))
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                loaded, data = batches.get()
+                if loaded:
+                    yield data
+                elif data is None:
+                    return
+                else:
+                    reraise(*data)
+        finally:
+            # Stops the background thread once the current batch is loaded
+            stop.set()
 
 
 class Data_Batch_Generator(object):
@@ -651,6 +1274,104 @@ class Homogeneous_Data_Batch_Generator(object):
             yield (data)
 
 
+class Bucketed_Data_Batch_Generator(object):
+    """
+    Batch generator class. Retrieves batches of samples of similar length, with a maximum number of tokens per batch
+    (see Dataset.getBucketedBatches). The batches of each epoch are computed from the lengths of the samples, which are
+    stored in the dataset, so only the samples of each batch are loaded.
+    """
+
+    def __init__(self,
+                 set_split,
+                 net,
+                 dataset,
+                 max_tokens,
+                 max_batch_size=None,
+                 normalization=False,
+                 normalization_type=None,
+                 data_augmentation=True,
+                 wo_da_patch_type='whole',
+                 da_patch_type='resize_and_rndcrop',
+                 da_enhance_list=None,
+                 mean_substraction=False,
+                 predict=False,
+                 shuffle=True,
+                 n_samples=None,
+                 data_ids=None):
+        """
+        Initializes the Bucketed_Data_Batch_Generator
+        :param set_split: Split (train, val, test) to retrieve data
+        :param net: Net which use the data
+        :param dataset: Dataset instance
+        :param max_tokens: Maximum number of tokens of each batch
+        :param max_batch_size: Maximum number of samples of each batch
+        :param normalization: Switches on/off the normalization of images
+        :param data_augmentation: Switches on/off the data augmentation of the input
+        :param mean_substraction: Switches on/off the mean substraction for images
+        :param predict: Whether we are predicting (only inputs) or training
+        :param shuffle: Shuffle the batches of each epoch (only on training)
+        :param n_samples: Only the first n_samples samples of the set are used
+        :param data_ids: Text inputs and outputs which define the length of the samples
+        """
+        if da_enhance_list is None:
+            da_enhance_list = []
+        self.set_split = set_split
+        self.net = net
+        self.dataset = dataset
+        self.predict = predict
+        self.shuffle = shuffle and set_split == 'train' and not predict
+        self.params = {'max_tokens': max_tokens,
+                       'max_batch_size': max_batch_size,
+                       'n_samples': n_samples,
+                       'data_ids': data_ids,
+                       'normalization': normalization,
+                       'normalization_type': normalization_type,
+                       'mean_substraction': mean_substraction,
+                       'data_augmentation': data_augmentation if set_split == 'train' and not predict else False,
+                       'wo_da_patch_type': wo_da_patch_type,
+                       'da_patch_type': da_patch_type,
+                       'da_enhance_list': da_enhance_list}
+        self.batches = self.getBatches()
+        # The number of batches does not depend on the shuffling
+        self.num_iterations = len(self.batches)
+
+    def getBatches(self):
+        """
+        Computes the batches of an epoch
+        :return: List of arrays with the positions of the samples of each batch
+        """
+        return self.dataset.getBucketedBatches(self.set_split,
+                                               self.params['max_tokens'],
+                                               max_batch_size=self.params['max_batch_size'],
+                                               shuffle=self.shuffle,
+                                               n_samples=self.params['n_samples'],
+                                               data_ids=self.params['data_ids'])
+
+    def generator(self):
+        """
+        Gets and processes the data
+        :return: generator with the data
+        """
+        load_params = dict(normalization=self.params['normalization'],
+                           normalization_type=self.params['normalization_type'],
+                           meanSubstraction=self.params['mean_substraction'],
+                           dataAugmentation=self.params['data_augmentation'],
+                           wo_da_patch_type=self.params['wo_da_patch_type'],
+                           da_patch_type=self.params['da_patch_type'],
+                           da_enhance_list=self.params['da_enhance_list'])
+        while True:
+            for batch in self.batches:
+                if self.predict:
+                    X_batch = self.dataset.getX_FromIndices(self.set_split, batch, **load_params)
+                    data = self.net.prepareData(X_batch, None)[0]
+                else:
+                    X_batch, Y_batch = self.dataset.getXY_FromIndices(self.set_split, batch, **load_params)
+                    data = self.net.prepareData(X_batch, Y_batch)
+                yield data
+            if self.shuffle:
+                self.batches = self.getBatches()
+
+
 # ------------------------------------------------------- #
 #       MAIN CLASS
 # ------------------------------------------------------- #
@@ -715,6 +1436,17 @@ class Dataset(object):
         self.Y_raw_val = dict()
         self.Y_raw_test = dict()
 
+        # Views of the samples of each split: positions of the stored samples that form the split (in order).
+        # If None, the split is formed by all the stored samples. Shuffling and filtering only modify these indices.
+        self.indices_train = None
+        self.indices_val = None
+        self.indices_test = None
+        # Positions of the stored samples of each input/output (e.g. self.repeat_indices['X_train'][id]) when
+        # they are repeated (see repeat_set in setInput/setOutput).
+        self.repeat_indices = dict()
+        # Number of tokens of each stored sample of the text inputs/outputs (e.g. self.text_lengths['X_train'][id])
+        self.text_lengths = dict()
+
         #################################################
 
         # Parameters for managing all the inputs and outputs
@@ -744,6 +1476,9 @@ class Dataset(object):
         #    inputs/outputs with type 'id' are only used for storing external identifiers for your data
         #    they will not be used in any way. IDs must be stored in text files with a single id per line
 
+        # Data type of the arrays returned for each input ('float64' if not set, see setDtype)
+        self.dtypes = dict()
+
         # List of implemented input normalization functions
         self.__available_norm_im_vid = ['0-1', '(-1)-1', 'inception']  # 'image' and 'video' only
         self.__available_norm_feat = ['L2']  # 'image-features' and 'video-features' only
@@ -754,7 +1489,7 @@ class Dataset(object):
 
         # Parameters used for inputs/outputs of type 'text'
         self.extra_words = {self.pad_symbol: 0, self.unk_symbol: 1, self.null_symbol: 2}  # extra words introduced in all vocabularies
-        self.vocabulary = dict()  # vocabularies (words2idx and idx2words)
+        self.vocabulary = dict()  # vocabularies (words2idx dictionary and idx2words utils.IndexToWords)
         self.max_text_len = dict()  # number of words accepted in a 'text' sample
         self.vocabulary_len = dict()  # number of words in the vocabulary
         self.text_offset = dict()  # number of timesteps that the text is shifted (to the right)
@@ -769,20 +1504,30 @@ class Dataset(object):
         self.BPE = None  # Byte Pair Encoding instance
         self.BPE_separator = '@@'
         self.BPE_built = False
+        self.BPE_config = None  # Arguments of build_bpe
         self.moses_tokenizer = None
         self.moses_detokenizer = False
         self.moses_tokenizer_built = None
         self.moses_detokenizer_built = False
+        # Number of worker processes and sentences per chunk used for processing the corpora (see setTextProcessing)
+        self.text_processing_workers = 1
+        self.text_processing_chunk_size = 10000
+        # Directory of the on-disk cache of tokenized sentences (see setTextCache)
+        self.text_cache_path = None
         #################################################
 
         # Parameters used for inputs of type 'video' or 'video-features'
         self.counts_frames = dict()
         self.paths_frames = dict()
+        # Position of the first frame of each video in paths_frames (prefix sums of counts_frames)
+        self.frames_offsets = dict()
         self.max_video_len = dict()
         #################################################
 
         # Parameters used for inputs of type 'image-features' or 'video-features'
         self.features_lengths = dict()
+        # Stores of packed features (see setFeatureStore)
+        self.feature_stores = dict()
         #################################################
 
         # Parameters used for inputs of type 'raw-image'
@@ -792,8 +1537,20 @@ class Dataset(object):
         self.img_size_crop = dict()
         # Training mean image
         self.train_mean = dict()
+        # Standard deviation of each channel of the training images (see calculateTrainMean)
+        self.train_std = dict()
         # Whether they are RGB images (or grayscale)
         self.use_RGB = dict()
+        # Files of the image paths without extension ('raw-image' inputs and '3DSemanticLabel' outputs)
+        self.resolved_paths = dict()
+        # Cache of decoded and resized images (see setImageCache)
+        self.image_cache = None
+        # Shards of pre-resized images (see setImageShard)
+        self.image_shards = dict()
+        # Number of threads used for decoding images and whether JPEGs are decoded at reduced resolution
+        # (see setImageDecoding)
+        self.image_decoding_threads = 1
+        self.image_decoding_draft = False
         #################################################
 
         # Parameters used for outputs of type 'categorical', '3DLabels' or '3DSemanticLabel'
@@ -826,16 +1583,9 @@ class Dataset(object):
         if not self.silence:
             logger.info("Shuffling training samples.")
 
-        # Shuffle
-        num = self.len_train
-        shuffled_order = random.sample([i for i in range(num)], num)
-
-        # Process each input sample
-        for sample_id in list(self.X_train):
-            self.X_train[sample_id] = [self.X_train[sample_id][s] for s in shuffled_order]
-        # Process each output sample
-        for sample_id in list(self.Y_train):
-            self.Y_train[sample_id] = [self.Y_train[sample_id][s] for s in shuffled_order]
+        # Shuffle the view of the training samples
+        indices = self.indices_train if self.indices_train is not None else np.arange(self.len_train)
+        self.indices_train = indices[np.random.permutation(self.len_train)]
 
         if not self.silence:
             logger.info("Shuffling training done.")
@@ -843,6 +1593,8 @@ class Dataset(object):
     def keepTopOutputs(self, set_name, id_out, n_top):
         """
         Keep the most frequent outputs from a set_name.
+        Only the view of the set is modified: the stored samples are kept, but if new data is loaded into this
+        set the view (and therefore the selection) is reset.
         :param set_name: Set name to modify.
         :param id_out: Id.
         :param n_top: Number of elements to keep.
@@ -857,35 +1609,104 @@ class Dataset(object):
         logger.info('Keeping top ' + str(n_top) + ' outputs from the ' + set_name + ' set and removing the rest.')
 
         # Sort outputs by number of occurrences
-        samples = None
-        samples = getattr(self, 'Y_' + set_name)
-        count = Counter(samples[id_out])
+        samples = self.__getSamples(set_name, id_out, 'Y', slice(0, getattr(self, 'len_' + set_name)))
+        count = Counter(samples)
         most_frequent = sorted(list(iteritems(count)), key=lambda x: x[1], reverse=True)[:n_top]
-        most_frequent = [m[0] for m in most_frequent]
+        most_frequent = set([m[0] for m in most_frequent])
 
         # Select top samples
-        kept = []
-        for i, s in list(enumerate(samples[id_out])):
-            if s in most_frequent:
-                kept.append(i)
-
-        # Remove non-top samples
-        # Inputs
-        ids = None
-        ids = list(getattr(self, 'X_' + set_name))
-        for sample_id in ids:
-            setattr(self, 'X_' + set_name + '[' + sample_id + ']', [getattr(self, 'X_' + set_name + '[' + sample_id + '][' + k + ']') for k in kept])
-        # Outputs
-        ids = list(getattr(self, 'Y_' + set_name))
-        for sample_id in ids:
-            setattr(self, 'Y_' + set_name + '[' + sample_id + ']', [getattr(self, 'Y_' + set_name + '[' + sample_id + '][' + k + ']') for k in kept])
-
-        new_len = len(samples[id_out])
+        kept = [i for i, s in list(enumerate(samples)) if s in most_frequent]
+
+        # Remove non-top samples from the view of the set
+        indices = getattr(self, 'indices_' + set_name)
+        if indices is None:
+            indices = np.arange(getattr(self, 'len_' + set_name))
+        setattr(self, 'indices_' + set_name, indices[kept])
+
+        new_len = len(kept)
         setattr(self, 'len_' + set_name, new_len)
-        self.__checkLengthSet(set_name)
 
         logger.info(str(new_len) + ' samples remaining after removal.')
 
+    def getTextLengths(self, set_name, data_id, kind='X'):
+        """
+        Number of tokens of each sample of a text input or output of a set split (taking into account the view and the
+        repetition of the samples). The lengths are computed when the data is loaded.
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_id: Input or output identifier.
+        :param kind: 'X' (input) or 'Y' (output).
+        :return: Array with the length of each sample.
+        """
+        attr = kind + '_' + set_name
+        lengths = self.text_lengths.get(attr, dict()).get(data_id)
+        if lengths is None:
+            lengths = self.__computeTextLengths(getattr(self, attr)[data_id])
+            self.text_lengths.setdefault(attr, dict())[data_id] = lengths
+        split_indices = getattr(self, 'indices_' + set_name)
+        repeat_indices = self.repeat_indices.get(attr, dict()).get(data_id)
+        if split_indices is None and repeat_indices is None:
+            return lengths[:getattr(self, 'len_' + set_name)]
+        k = split_indices if split_indices is not None else np.arange(getattr(self, 'len_' + set_name))
+        if repeat_indices is not None:
+            k = repeat_indices[k]
+        return lengths[k]
+
+    def getSampleLengths(self, set_name, data_ids=None):
+        """
+        Length of each sample of a set split: the maximum number of tokens of its text inputs and outputs.
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_ids: Text inputs and outputs considered. By default, all the ones loaded in the set split.
+        :return: Array with the length of each sample.
+        """
+        if data_ids is None:
+            data_ids = [(id_in, 'X') for id_in, type_in in zip(self.ids_inputs, self.types_inputs.get(set_name, []))
+                        if type_in in ['text', 'text-features'] and id_in in getattr(self, 'X_' + set_name)]
+            data_ids += [(id_out, 'Y') for id_out, type_out in zip(self.ids_outputs,
+                                                                   self.types_outputs.get(set_name, []))
+                         if type_out in ['text', 'dense-text', 'text-features'] and
+                         id_out in getattr(self, 'Y_' + set_name)]
+        else:
+            data_ids = [(data_id, 'X' if data_id in self.ids_inputs else 'Y') for data_id in data_ids]
+        if not data_ids:
+            raise Exception('The "' + set_name + '" set does not contain text inputs or outputs.')
+        return reduce(np.maximum, [self.getTextLengths(set_name, data_id, kind) for data_id, kind in data_ids])
+
+    def getBucketedBatches(self, set_name, max_tokens, max_batch_size=None, shuffle=False, n_samples=None,
+                           data_ids=None):
+        """
+        Groups the samples of a set split into batches of samples of similar length (see getSampleLengths), so that the
+        number of tokens of each padded batch (number of samples x maximum length) does not exceed max_tokens.
+        :param set_name: 'train', 'val' or 'test'.
+        :param max_tokens: Maximum number of tokens of each batch. Longer samples are returned in batches of 1 sample.
+        :param max_batch_size: Maximum number of samples of each batch.
+        :param shuffle: Shuffle the samples of the same length and the order of the batches.
+        :param n_samples: Only the first n_samples samples of the set are batched.
+        :param data_ids: Text inputs and outputs which define the length of the samples.
+        :return: List of arrays with the positions of the samples of each batch.
+        """
+        lengths = np.maximum(self.getSampleLengths(set_name, data_ids=data_ids)[:n_samples], 1)
+        if shuffle:
+            positions = np.random.permutation(len(lengths))
+            positions = positions[np.argsort(lengths[positions], kind='mergesort')]
+        else:
+            positions = np.argsort(lengths, kind='mergesort')
+        sorted_lengths = lengths[positions]
+
+        batches = []
+        init = 0
+        while init < len(positions):
+            # The lengths are sorted, so the size of a batch is given by the length of its last sample
+            max_size = max(max_tokens // sorted_lengths[init], 1)
+            if max_batch_size is not None:
+                max_size = min(max_size, max_batch_size)
+            window = sorted_lengths[init:init + max_size]
+            size = max(np.searchsorted(np.arange(1, len(window) + 1) * window, max_tokens, side='right'), 1)
+            batches.append(positions[init:init + size])
+            init += size
+        if shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        return batches
+
     # ------------------------------------------------------- #
     #       GENERAL SETTERS
     #           classes list, train, val and test set, etc.
@@ -961,7 +1782,7 @@ class Dataset(object):
                  # 'raw-image' / 'video'   (height, width, depth)
                  max_text_len=35, tokenization='tokenize_none', offset=0, fill='end', min_occ=0,  # 'text'
                  pad_on_batch=True, build_vocabulary=False, max_words=0, words_so_far=False,  # 'text'
-                 bpe_codes=None, separator='@@', use_unk_class=False,  # 'text'
+                 bpe_codes=None, separator='@@', use_unk_class=False, encode_text=False, n_workers=None,  # 'text'
                  feat_len=1024,  # 'image-features' / 'video-features'
                  max_video_len=26,  # 'video'
                  sparse=False,  # 'binary'
@@ -1018,6 +1839,11 @@ class Dataset(object):
                             defined by the timestep dimension (e.g. t=0 'a', t=1 'a dog', t=2 'a dog is', etc.)
         :param bpe_codes: Codes used for applying BPE encoding.
         :param separator: BPE encoding separator.
+        :param encode_text: if True, the sentences are converted into word indices when loading them, and stored as a
+                            RaggedArray. This avoids the string processing at each batch. The vocabulary must be
+                            already defined and must not be modified afterwards.
+        :param n_workers: number of worker processes tokenizing the sentences and building the vocabulary.
+                          If None, the number set with setTextProcessing is used.
 
         # 'image-features' and 'video-features'- related parameters
 
@@ -1064,13 +1890,15 @@ class Dataset(object):
                 self.max_text_len[id] = dict()
             data = self.preprocessText(path_list, id, set_name, tokenization, build_vocabulary, max_text_len,
                                        max_words, offset, fill, min_occ, pad_on_batch, words_so_far,
-                                       bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class)
+                                       bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class,
+                                       encode_text=encode_text, n_workers=n_workers)
         elif type == 'text-features':
             if self.max_text_len.get(id) is None:
                 self.max_text_len[id] = dict()
             data = self.preprocessTextFeatures(path_list, id, set_name, tokenization, build_vocabulary, max_text_len,
                                                max_words, offset, fill, min_occ, pad_on_batch, words_so_far,
-                                               bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class)
+                                               bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class,
+                                               n_workers=n_workers)
         elif type == 'image-features':
             data = self.preprocessFeatures(path_list, id, set_name, feat_len)
         elif type == 'video-features':
@@ -1096,21 +1924,29 @@ class Dataset(object):
         elif type == 'ghost':
             data = []
 
+        repeat_indices = None
         if isinstance(repeat_set, (np.ndarray, np.generic, list)) or repeat_set > 1:
-            data = list(np.repeat(data, repeat_set))
+            repeat_indices = np.repeat(np.arange(len(data)), repeat_set)
 
-        self.__setInput(data, set_name, type, id, overwrite_split, add_additional)
+        self.__setInput(data, set_name, type, id, overwrite_split, add_additional, repeat_indices=repeat_indices)
 
-    def __setInput(self, set_data, set_name, data_type, data_id, overwrite_split, add_additional):
+    def __setInput(self, set_data, set_name, data_type, data_id, overwrite_split, add_additional, repeat_indices=None):
         if add_additional:
             aux_dict = getattr(self, 'X_' + set_name)
-            aux_dict[data_id] += set_data
+            self.__addRepeatIndices('X_' + set_name, data_id, len(aux_dict[data_id]), len(set_data), repeat_indices)
+            if isinstance(set_data, RaggedArray):
+                aux_dict[data_id] = RaggedArray.concatenate([aux_dict[data_id], set_data])
+            else:
+                aux_dict[data_id] = list(aux_dict[data_id]) + list(set_data)
             setattr(self, 'X_' + set_name, aux_dict)
         else:
             aux_dict = getattr(self, 'X_' + set_name)
             aux_dict[data_id] = set_data
             setattr(self, 'X_' + set_name, aux_dict)
+            self.__setRepeatIndices('X_' + set_name, data_id, repeat_indices)
         del aux_dict
+        self.__setTextLengths('X_' + set_name, data_id, data_type, set_data, add_additional)
+        self.__resetView(set_name)
 
         aux_list = getattr(self, 'loaded_' + set_name)
         aux_list[0] = True
@@ -1118,7 +1954,7 @@ class Dataset(object):
         del aux_list
 
         if data_id not in self.optional_inputs:
-            setattr(self, 'len_' + set_name, len(getattr(self, 'X_' + set_name)[data_id]))
+            setattr(self, 'len_' + set_name, self.__getNumSamples(set_name, data_id, 'X'))
             if not overwrite_split and not add_additional:
                 self.__checkLengthSet(set_name)
 
@@ -1211,7 +2047,7 @@ class Dataset(object):
                   add_additional=False, sample_weights=False, label_smoothing=0.,
                   tokenization='tokenize_none', max_text_len=0, offset=0, fill='end', min_occ=0,  # 'text'
                   pad_on_batch=True, words_so_far=False, build_vocabulary=False, max_words=0,  # 'text'
-                  bpe_codes=None, separator='@@', use_unk_class=False,  # 'text'
+                  bpe_codes=None, separator='@@', use_unk_class=False, encode_text=False, n_workers=None,  # 'text'
                   associated_id_in=None, num_poolings=None,  # '3DLabel' or '3DSemanticLabel'
                   sparse=False,  # 'binary'
                   ):
@@ -1232,6 +2068,8 @@ class Dataset(object):
         :param add_additional: adds additional data to an already existent output ID
         :param sample_weights: switch on/off sample weights usage for the current output
         :param label_smoothing: epsilon value for label smoothing. See arxiv.org/abs/1512.00567.
+                                For outputs of type 'dense-text' (sparse targets) it must be applied in the loss
+                                (see Model_Wrapper.setOptimizer).
             # 'text'-related parameters
 
         :param tokenization: type of tokenization applied (must be declared as a method of this class)
@@ -1253,6 +2091,10 @@ class Dataset(object):
                              defined by the timestep dimension (e.g. t=0 'a', t=1 'a dog', t=2 'a dog is', etc.)
         :param bpe_codes: Codes used for applying BPE encoding.
         :param separator: BPE encoding separator.
+        :param encode_text: if True, the sentences are converted into word indices when loading them, and stored as a
+                            RaggedArray. The vocabulary must be already defined and must not be modified afterwards.
+        :param n_workers: number of worker processes tokenizing the sentences and building the vocabulary.
+                          If None, the number set with setTextProcessing is used.
 
             # '3DLabel' or '3DSemanticLabel'-related parameters
 
@@ -1299,13 +2141,15 @@ class Dataset(object):
                 self.max_text_len[id] = dict()
             data = self.preprocessText(path_list, id, set_name, tokenization, build_vocabulary, max_text_len,
                                        max_words, offset, fill, min_occ, pad_on_batch, words_so_far,
-                                       bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class)
+                                       bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class,
+                                       encode_text=encode_text, n_workers=n_workers)
         elif type == 'text-features':
             if self.max_text_len.get(id) is None:
                 self.max_text_len[id] = dict()
             data = self.preprocessTextFeatures(path_list, id, set_name, tokenization, build_vocabulary, max_text_len,
                                                max_words, offset, fill, min_occ, pad_on_batch, words_so_far,
-                                               bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class)
+                                               bpe_codes=bpe_codes, separator=separator, use_unk_class=use_unk_class,
+                                               n_workers=n_workers)
         elif type == 'binary':
             data = self.preprocessBinary(path_list, id, sparse)
         elif type == 'real':
@@ -1313,32 +2157,41 @@ class Dataset(object):
         elif type == 'id':
             data = self.preprocessIDs(path_list, id, set_name)
         elif type == '3DLabel':
-            data = self.preprocess3DLabel(path_list, id, associated_id_in, num_poolings)
+            # The bounding boxes are parsed once, when they are loaded
+            data = self.parse3DLabels(self.preprocess3DLabel(path_list, id, associated_id_in, num_poolings))
         elif type == '3DSemanticLabel':
             data = self.preprocess3DSemanticLabel(path_list, id, associated_id_in, num_poolings)
 
+        repeat_indices = None
         if isinstance(repeat_set, (np.ndarray, np.generic, list)) or repeat_set > 1:
-            data = list(np.repeat(data, repeat_set))
+            repeat_indices = np.repeat(np.arange(len(data)), repeat_set)
         if self.sample_weights.get(id) is None:
             self.sample_weights[id] = dict()
         self.sample_weights[id][set_name] = sample_weights
-        self.__setOutput(data, set_name, type, id, overwrite_split, add_additional)
+        self.__setOutput(data, set_name, type, id, overwrite_split, add_additional, repeat_indices=repeat_indices)
 
-    def __setOutput(self, labels, set_name, data_type, data_id, overwrite_split, add_additional):
+    def __setOutput(self, labels, set_name, data_type, data_id, overwrite_split, add_additional, repeat_indices=None):
         if add_additional:
             aux_dict = getattr(self, 'Y_' + set_name)
-            aux_dict[data_id] += labels
+            self.__addRepeatIndices('Y_' + set_name, data_id, len(aux_dict[data_id]), len(labels), repeat_indices)
+            if isinstance(labels, RaggedArray):
+                aux_dict[data_id] = RaggedArray.concatenate([aux_dict[data_id], labels])
+            else:
+                aux_dict[data_id] = list(aux_dict[data_id]) + list(labels)
             setattr(self, 'Y_' + set_name, aux_dict)
         else:
             aux_dict = getattr(self, 'Y_' + set_name)
             aux_dict[data_id] = labels
             setattr(self, 'Y_' + set_name, aux_dict)
+            self.__setRepeatIndices('Y_' + set_name, data_id, repeat_indices)
         del aux_dict
+        self.__setTextLengths('Y_' + set_name, data_id, data_type, labels, add_additional)
+        self.__resetView(set_name)
 
         aux_list = getattr(self, 'loaded_' + set_name)
         aux_list[1] = True
         del aux_list
-        setattr(self, 'len_' + set_name, len(getattr(self, 'Y_' + set_name)[data_id]))
+        setattr(self, 'len_' + set_name, self.__getNumSamples(set_name, data_id, 'Y'))
         if not overwrite_split and not add_additional:
             self.__checkLengthSet(set_name)
 
@@ -1578,7 +2431,7 @@ class Dataset(object):
         return data
 
     def loadFeatures(self, X, feat_len, normalization_type='L2', normalization=False, loaded=False, external=False,
-                     data_augmentation=True):
+                     data_augmentation=True, data_id=None):
         """
         Loads and normalizes features.
 
@@ -1589,6 +2442,7 @@ class Dataset(object):
         :param loaded: Flag that indicates if these features have been already loaded.
         :param external: Boolean indicating if the paths provided in 'X' are absolute paths to external images
         :param data_augmentation: Perform data augmentation (with mean=0.0, std_dev=0.01)
+        :param data_id: Identifier of the input (which defines the data type of the features, see setDtype).
 
         :return: Loaded features as numpy array
         """
@@ -1597,36 +2451,253 @@ class Dataset(object):
                 'The chosen normalization type ' + normalization_type +
                 ' is not implemented for the type "image-features" and "video-features".')
 
-        n_batch = len(X)
-        features = np.zeros(tuple([n_batch] + feat_len))
-
-        for i, feat in list(enumerate(X)):
-            if not external:
-                feat = self.path + '/' + feat
-
-            feat = np.load(feat)
+        dtype = self.getDtype(data_id)
+        if data_id in self.feature_stores:
+            store = self.feature_stores[data_id]
+            features = store.data[store.getRows(X)].astype(dtype)
+        else:
+            features = np.zeros(tuple([len(X)] + feat_len), dtype=dtype)
+            for i, feat in list(enumerate(X)):
+                if not external:
+                    feat = self.path + '/' + feat
+                features[i] = np.load(feat)
 
-            if data_augmentation:
-                noise_mean = 0.0
-                noise_dev = 0.01
-                noise = np.random.normal(noise_mean, noise_dev, feat.shape)
-                feat += noise
+        return self.__processFeatures(features, normalization_type, normalization, data_augmentation)
 
-            if normalization:
-                if normalization_type == 'L2':
-                    feat /= np.linalg.norm(feat, ord=2)
+    def __processFeatures(self, features, normalization_type, normalization, data_augmentation):
+        """
+        Applies the data augmentation (gaussian noise) and the normalization to a batch of features (in place).
+        :param features: Array of features (one per row).
+        :return: Processed features.
+        """
+        if data_augmentation:
+            noise_mean = 0.0
+            noise_dev = 0.01
+            features += np.random.normal(noise_mean, noise_dev, features.shape).astype(features.dtype)
 
-            features[i] = feat
+        if normalization:
+            if normalization_type == 'L2':
+                if features.ndim == 2:
+                    features /= np.linalg.norm(features, ord=2, axis=1, keepdims=True)
+                else:
+                    for feat in features:
+                        feat /= np.linalg.norm(feat, ord=2)
 
-        return np.array(features)
+        return features
 
     # ------------------------------------------------------- #
     #       TYPE 'text' SPECIFIC FUNCTIONS
     # ------------------------------------------------------- #
 
+    def setTextProcessing(self, n_workers=1, chunk_size=10000):
+        """
+        Sets how the corpora of 'text' inputs and outputs are processed when they are loaded.
+        The corpora are processed in chunks of sentences, which are shared among a pool of worker processes.
+        The results are merged in the order of the chunks, so they do not depend on the number of workers.
+
+        :param n_workers: Number of worker processes. If 1, the chunks are processed in the current process.
+        :param chunk_size: Number of sentences of each chunk.
+        """
+        self.text_processing_workers = n_workers
+        self.text_processing_chunk_size = chunk_size
+        if not self.silence:
+            logger.info('Processing the text corpora with ' + str(n_workers) + ' workers (chunks of ' +
+                        str(chunk_size) + ' sentences).')
+
+    def __mapTextChunks(self, function, chunks, args=(), n_workers=None, initializer=None, initargs=()):
+        """
+        Applies a function to a set of chunks of sentences, in the pool of text processing workers (see
+        setTextProcessing). At most 2 * n_workers chunks are pending at a time, so the chunks can be read while
+        they are processed.
+
+        :param function: Module-level function applied to each chunk (as function(chunk, *args)).
+        :param chunks: Iterable of chunks of sentences.
+        :param args: Additional arguments of the function.
+        :param n_workers: Number of worker processes. If None, self.text_processing_workers.
+        :param initializer: Function called by each worker process when it starts (as initializer(*initargs)).
+        :param initargs: Arguments of the initializer.
+        :return: Generator of the results of each chunk, in the order of the chunks.
+        """
+        if n_workers is None:
+            n_workers = self.text_processing_workers
+        if n_workers <= 1:
+            for chunk in chunks:
+                yield function(chunk, *args)
+            return
+        pool = multiprocessing.Pool(n_workers, initializer, initargs)
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(function, (chunk,) + tuple(args)))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __textChunks(self, sentences):
+        """
+        Splits a corpus into chunks of self.text_processing_chunk_size sentences.
+
+        :param sentences: List of sentences or path to a text file with a sentence in each line (which is read
+                          chunk by chunk).
+        :return: Generator of lists of sentences.
+        """
+        chunk_size = self.text_processing_chunk_size
+        if isinstance(sentences, string_types):
+            with codecs.open(sentences, 'r', encoding='utf-8') as list_:
+                while True:
+                    chunk = [line.rstrip('\n') for line in itertools.islice(list_, chunk_size)]
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            for init in range(0, len(sentences), chunk_size):
+                yield list(sentences[init:init + chunk_size])
+
+    def setTextCache(self, cache_path=None):
+        """
+        Caches the tokenized sentences of the 'text' inputs and outputs on disk, so that building again a Dataset with
+        the same corpora and tokenization does not tokenize them again. The entries are identified by a hash of the
+        sentences, the tokenization method, the BPE codes file contents and the BPE separator, so any change in them
+        leads to a new entry. The tokenized sentences are stored as a RaggedArray of indices into the list of tokens
+        of the corpus.
+
+        :param cache_path: Directory of the cache. It is kept across runs and shared by all the Datasets pointing to it.
+                           If None, the cache is disabled.
+        """
+        self.text_cache_path = cache_path
+        if cache_path is not None:
+            create_dir_if_not_exists(cache_path)
+        if not self.silence:
+            logger.info('Text cache ' + ('disabled.' if cache_path is None else 'enabled (path: ' + cache_path + ').'))
+
+    @staticmethod
+    def __textCacheKey(sentences, tokenization, tokenizer_config):
+        """
+        Computes the identifier of the tokenized version of a corpus in the text cache (see setTextCache).
+
+        :param sentences: List of sentences.
+        :param tokenization: Name of the tokenization method.
+        :param tokenizer_config: Configuration of the tokenizer (see getTokenizerConfig).
+        :return: Hexadecimal digest.
+        """
+        key = hashlib.sha1(u'\n'.join([TEXT_CACHE_VERSION, tokenization]).encode('utf-8'))
+        if 'moses_language' in tokenizer_config:
+            key.update(b'\nmoses:' + tokenizer_config['moses_language'].encode('utf-8'))
+        if 'bpe' in tokenizer_config:
+            bpe_config = tokenizer_config['bpe']
+            vocabulary = bpe_config['vocabulary']
+            options = [bpe_config['merges'], bpe_config['separator'],
+                       None if vocabulary is None else sorted(vocabulary),
+                       list(bpe_config['glossaries'] or [])]
+            key.update(b'\nbpe:' + repr(options).encode('utf-8') + b'\n')
+            with open(bpe_config['codes'], 'rb') as codes:
+                for block in iter(lambda: codes.read(1 << 20), b''):
+                    key.update(block)
+        for sentence in sentences:
+            if isinstance(sentence, text_type):
+                sentence = sentence.encode('utf-8')
+            key.update(str(len(sentence)).encode('utf-8') + b':' + sentence)
+        return key.hexdigest()
+
+    def __loadTokenizedText(self, key):
+        """
+        Reads a tokenized corpus from the text cache (see setTextCache).
+
+        :param key: Identifier of the corpus (see __textCacheKey).
+        :return: List of tokenized sentences or None if the corpus is not cached.
+        """
+        entry_path = os.path.join(self.text_cache_path, key)
+        if not os.path.isdir(entry_path):
+            return None
+        with open(os.path.join(entry_path, 'tokens.pkl'), 'rb') as f:
+            tokens_list = pk.load(f)
+        tokens = np.empty(len(tokens_list), dtype=object)
+        tokens[:] = tokens_list
+        indices = LazyColumn(os.path.join(entry_path, 'sentences'), 'ragged', False).load()
+        words = tokens.take(indices.data).tolist()
+        offsets = indices.offsets.tolist()
+        return [u' '.join(words[offsets[i]:offsets[i + 1]]) for i in range(len(indices))]
+
+    def __storeTokenizedText(self, key, sentences):
+        """
+        Stores a tokenized corpus in the text cache (see setTextCache).
+
+        :param key: Identifier of the corpus (see __textCacheKey).
+        :param sentences: List of tokenized sentences.
+        """
+        token_indices = dict()
+        indices = [[token_indices.setdefault(token, len(token_indices)) for token in sentence.split(u' ')]
+                   for sentence in sentences]
+        tokens = [u''] * len(token_indices)
+        for token, idx in iteritems(token_indices):
+            tokens[idx] = token
+        # Write to a temporary directory first, so that concurrent readers never see partial entries
+        tmp_path = tempfile.mkdtemp(dir=self.text_cache_path)
+        with open(os.path.join(tmp_path, 'tokens.pkl'), 'wb') as f:
+            pk.dump(tokens, f, protocol=-1)
+        saveColumn(RaggedArray.from_sequences(indices, dtype='int32'), os.path.join(tmp_path, 'sentences'))
+        try:
+            os.rename(tmp_path, os.path.join(self.text_cache_path, key))
+        except OSError:  # Stored by another process in the meantime
+            shutil.rmtree(tmp_path)
+
+    def __tokenizeSentences(self, sentences, tokenization, bpe_codes=None, separator='@@', n_workers=None):
+        """
+        Applies a tokenization method to a list of sentences.
+        With several workers, the sentences are tokenized in chunks by a pool of processes (see setTextProcessing),
+        each of them with its own tokenizer. The order of the sentences is kept.
+        If the text cache is enabled (see setTextCache), the tokenized sentences are read from it when available.
+
+        :param sentences: List of sentences.
+        :param tokenization: Name of the tokenization method.
+        :param bpe_codes: Codes used for applying BPE encoding.
+        :param separator: BPE encoding separator.
+        :param n_workers: Number of worker processes. If None, self.text_processing_workers.
+        :return: List of tokenized sentences.
+        """
+        # Check if tokenization method exists
+        if not hasattr(self, tokenization):
+            raise Exception('Tokenization procedure "' + tokenization + '" is not implemented.')
+        if 'bpe' in tokenization.lower():
+            if bpe_codes is None:
+                raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+            # An encoder built from the same codes keeps its options (e.g. vocabulary and glossaries)
+            if not self.BPE_built or self.BPE_config is None or \
+                    (self.BPE_config['codes'], self.BPE_config['separator']) != (bpe_codes, separator):
+                self.build_bpe(bpe_codes, separator=separator)
+        tokenizer_config = self.getTokenizerConfig(tokenization)
+        if self.text_cache_path is not None:
+            cache_key = self.__textCacheKey(sentences, tokenization, tokenizer_config)
+            tokenized = self.__loadTokenizedText(cache_key)
+            if tokenized is not None:
+                if not self.silence:
+                    logger.info('\tReading the sentences tokenized with "' + tokenization + '" from the text cache.')
+                return tokenized
+        if not self.silence:
+            logger.info('\tApplying tokenization function: "' + tokenization + '".')
+
+        if n_workers is None:
+            n_workers = self.text_processing_workers
+        if n_workers <= 1:
+            tokfun = getattr(self, tokenization)
+            tokenized = [tokfun(sentence) for sentence in sentences]
+        else:
+            tokenized = []
+            for chunk in self.__mapTextChunks(_tokenizeSentences, self.__textChunks(sentences), n_workers=n_workers,
+                                              initializer=_initTokenizer,
+                                              initargs=(tokenization, tokenizer_config)):
+                tokenized += chunk
+        if self.text_cache_path is not None:
+            self.__storeTokenizedText(cache_key, tokenized)
+        return tokenized
+
     def preprocessText(self, annotations_list, data_id, set_name, tokenization, build_vocabulary, max_text_len,
                        max_words, offset, fill, min_occ, pad_on_batch, words_so_far,
-                       bpe_codes=None, separator='@@', use_unk_class=False):
+                       bpe_codes=None, separator='@@', use_unk_class=False, encode_text=False, n_workers=None):
         """
         Preprocess 'text' data type: Builds vocabulary (if necessary) and preprocesses the sentences.
         Also sets Dataset parameters.
@@ -1647,6 +2718,8 @@ class Dataset(object):
         :param bpe_codes: Codes used for applying BPE encoding.
         :param separator: BPE encoding separator.
         :param use_unk_class: Add a special class for the unknown word when maxt_text_len == 0.
+        :param encode_text: Convert the sentences into a RaggedArray of word indices.
+        :param n_workers: Number of worker processes tokenizing the sentences and building the vocabulary.
 
         :return: Preprocessed sentences.
         """
@@ -1665,22 +2738,8 @@ class Dataset(object):
 
         # Tokenize sentences
         if max_text_len != 0:  # will only tokenize if we are not using the whole sentence as a class
-            # Check if tokenization method exists
-            if hasattr(self, tokenization):
-                if 'bpe' in tokenization.lower():
-                    if bpe_codes is None:
-                        raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
-                    self.build_bpe(bpe_codes, separator=separator)
-                tokfun = eval('self.' + tokenization)
-                if not self.silence:
-                    logger.info('\tApplying tokenization function: "' + tokenization + '".')
-            else:
-                raise Exception('Tokenization procedure "' + tokenization + '" is not implemented.')
-
-            for i, sentence in enumerate(sentences):
-                sentences[i] = tokfun(sentence)
-        else:
-            tokfun = None
+            sentences = self.__tokenizeSentences(sentences, tokenization, bpe_codes=bpe_codes, separator=separator,
+                                                 n_workers=n_workers)
 
         # Build vocabulary
         if isinstance(build_vocabulary, str):
@@ -1705,7 +2764,8 @@ class Dataset(object):
                                   min_occ=min_occ,
                                   n_words=max_words,
                                   use_extra_words=(max_text_len != 0),
-                                  use_unk_class=use_unk_class)
+                                  use_unk_class=use_unk_class,
+                                  n_workers=n_workers)
 
         if data_id not in self.vocabulary:
             raise Exception('The dataset must include a vocabulary with data_id "' + data_id +
@@ -1718,10 +2778,16 @@ class Dataset(object):
         self.pad_on_batch[data_id] = pad_on_batch
         self.words_so_far[data_id] = words_so_far
 
+        if encode_text and max_text_len != 0:
+            if not self.silence:
+                logger.info('\tEncoding sentences into word indices.')
+            sentences = self.encodeText(sentences, self.vocabulary[data_id]['words2idx'])
+
         return sentences
 
     def preprocessTextFeatures(self, annotations_list, data_id, set_name, tokenization, build_vocabulary, max_text_len,
-                               max_words, offset, fill, min_occ, pad_on_batch, words_so_far, bpe_codes=None, separator='@@', use_unk_class=False):
+                               max_words, offset, fill, min_occ, pad_on_batch, words_so_far, bpe_codes=None, separator='@@', use_unk_class=False,
+                               n_workers=None):
         """
         Preprocess 'text' data type: Builds vocabulary (if necessary) and preprocesses the sentences.
         Also sets Dataset parameters.
@@ -1741,6 +2807,7 @@ class Dataset(object):
         :param words_so_far: Experimental feature. Should be ignored.
         :param bpe_codes: Codes used for applying BPE encoding.
         :param separator: BPE encoding separator.
+        :param n_workers: Number of worker processes tokenizing the sentences and building the vocabulary.
 
         :return: Preprocessed sentences.
         """
@@ -1759,22 +2826,8 @@ class Dataset(object):
 
         # Tokenize sentences
         if max_text_len != 0:  # will only tokenize if we are not using the whole sentence as a class
-            # Check if tokenization method exists
-            if hasattr(self, tokenization):
-                if 'bpe' in tokenization.lower():
-                    if bpe_codes is None:
-                        raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
-                    self.build_bpe(bpe_codes, separator=separator)
-                tokfun = eval('self.' + tokenization)
-                if not self.silence:
-                    logger.info('\tApplying tokenization function: "' + tokenization + '".')
-            else:
-                raise Exception('Tokenization procedure "' + tokenization + '" is not implemented.')
-
-            for sentence_idx, sentence in enumerate(sentences):
-                sentences[sentence_idx] = tokfun(sentence)
-        else:
-            tokfun = None
+            sentences = self.__tokenizeSentences(sentences, tokenization, bpe_codes=bpe_codes, separator=separator,
+                                                 n_workers=n_workers)
 
         # Build vocabulary
         if build_vocabulary:
@@ -1782,7 +2835,8 @@ class Dataset(object):
                                   min_occ=min_occ,
                                   n_words=max_words,
                                   use_extra_words=(max_text_len != 0),
-                                  use_unk_class=use_unk_class)
+                                  use_unk_class=use_unk_class,
+                                  n_workers=n_workers)
         elif isinstance(build_vocabulary, str):
             if build_vocabulary in self.vocabulary:
                 self.vocabulary[data_id] = self.vocabulary[build_vocabulary]
@@ -1845,44 +2899,42 @@ class Dataset(object):
         return sentence_features
 
     def build_vocabulary(self, captions, data_id, do_split=True, min_occ=0, n_words=0, split_symbol=' ',
-                         use_extra_words=True, use_unk_class=False, is_val=False):
+                         use_extra_words=True, use_unk_class=False, is_val=False, n_workers=None):
         """
-        Vocabulary builder for data of type 'text'
+        Vocabulary builder for data of type 'text'.
+        The words are counted in chunks of sentences, which can be shared among several worker processes (see
+        setTextProcessing). The minimum number of occurrences and the maximum number of words are applied to the
+        merged counts.
 
         :param use_extra_words:
-        :param captions: Corpus sentences
+        :param captions: Corpus sentences (list of sentences or path to a text file with a sentence in each line,
+                         which is read chunk by chunk)
         :param data_id: Dataset id of the text
         :param do_split: Split sentence by words or use the full sentence as a class.
         :param split_symbol: symbol used for separating the elements in each sentence
         :param min_occ: Minimum occurrences of each word to be included in the dictionary.
         :param n_words: Maximum number of words to include in the dictionary.
         :param is_val: Set to True if the input 'captions' are values and we want to keep them sorted
+        :param n_workers: Number of worker processes counting the words. If None, self.text_processing_workers.
         :return: None.
         """
         if not self.silence:
             logger.info("Creating vocabulary for data with data_id '" + data_id + "'.")
 
-        counters = []
-        sentence_counts = []
-        counter = Counter()
+        # Partial counts are merged in the order of the chunks (ties of most_common keep the order of appearance)
+        combined_counter = Counter()
         sentence_count = 0
-        for line in captions:
-            if do_split:
-                words = line.strip().split(split_symbol)
-                counter.update(words)
-            else:
-                counter.update([line])
-            sentence_count += 1
+        for counter, chunk_sentences in self.__mapTextChunks(_countWords, self.__textChunks(captions),
+                                                             (do_split, split_symbol), n_workers):
+            combined_counter.update(counter)
+            sentence_count += chunk_sentences
 
         if not do_split and not self.silence:
             logger.info('Using whole sentence as a single word.')
 
-        counters.append(counter)
-        sentence_counts.append(sentence_count)
-        combined_counter = reduce(add, counters)
         if not self.silence:
             logger.info("\t Total: %d unique words in %d sentences with a total of %d words." %
-                        (len(combined_counter), sum(sentence_counts), sum(list(combined_counter.values()))))
+                        (len(combined_counter), sentence_count, sum(list(combined_counter.values()))))
 
         # keep only words with less than 'min_occ' occurrences
         if min_occ > 1:
@@ -1907,7 +2959,7 @@ class Dataset(object):
         else:
             if not self.silence:
                 logger.info("Creating dictionary of all words")
-            vocab_count = counter.most_common()
+            vocab_count = combined_counter.most_common()
 
         dictionary = {}
         for i, (word, count) in list(enumerate(vocab_count)):
@@ -1933,8 +2985,7 @@ class Dataset(object):
         if data_id not in self.vocabulary:
             self.vocabulary[data_id] = dict()
             self.vocabulary[data_id]['words2idx'] = dictionary
-            inv_dictionary = {v: k for k, v in list(iteritems(dictionary))}
-            self.vocabulary[data_id]['idx2words'] = inv_dictionary
+            self.vocabulary[data_id]['idx2words'] = build_index2word(dictionary)
 
             self.vocabulary_len[data_id] = len(vocab_count)
             if use_extra_words:
@@ -1943,17 +2994,15 @@ class Dataset(object):
                 self.vocabulary_len[data_id] += 1
 
         else:
-            old_keys = list(self.vocabulary[data_id]['words2idx'])
-            new_keys = list(dictionary)
+            old_keys = self.vocabulary[data_id]['words2idx']
             added = 0
-            for key in new_keys:
+            for key in list(dictionary):
                 if key not in old_keys:
                     self.vocabulary[data_id]['words2idx'][key] = self.vocabulary_len[data_id]
                     self.vocabulary_len[data_id] += 1
                     added += 1
 
-            inv_dictionary = {v: k for k, v in list(iteritems(self.vocabulary[data_id]['words2idx']))}
-            self.vocabulary[data_id]['idx2words'] = inv_dictionary
+            self.vocabulary[data_id]['idx2words'] = build_index2word(self.vocabulary[data_id]['words2idx'])
 
             if not self.silence:
                 logger.info('Appending ' + str(added) + ' words to dictionary with data_id "' + data_id + '".')
@@ -1980,14 +3029,13 @@ class Dataset(object):
             current_data_id = ids[i]
             vocab = self.vocabulary[current_data_id]['words2idx']
             for w in list(vocab):
-                if w not in list(vocab_ref):
+                if w not in vocab_ref:
                     vocab_ref[w] = next_idx
                     next_idx += 1
 
         # Also build idx2words
         self.vocabulary[ids[0]]['words2idx'] = vocab_ref
-        inv_dictionary = {v: k for k, v in list(iteritems(vocab_ref))}
-        self.vocabulary[ids[0]]['idx2words'] = inv_dictionary
+        self.vocabulary[ids[0]]['idx2words'] = build_index2word(vocab_ref)
         self.vocabulary_len[ids[0]] = len(list(self.vocabulary[ids[0]]['words2idx']))
 
         # Insert in all ids
@@ -2014,8 +3062,31 @@ class Dataset(object):
         with codecs.open(codes, 'rb', encoding='utf-8') as cods:
             self.BPE = BPE(cods, merges=merges, separator=separator, vocab=vocabulary, glossaries=glossaries)
         self.BPE_separator = separator
+        self.BPE_config = {'codes': codes, 'merges': merges, 'separator': separator, 'vocabulary': vocabulary,
+                           'glossaries': glossaries}
         self.BPE_built = True
 
+    def getTokenizerConfig(self, tokenization):
+        """
+        Configuration of the tokenizer used by a tokenization method, which allows to build the same tokenizer
+        in another Dataset (e.g. in the text processing workers, see setTextProcessing).
+        The Moses tokenizer is built (for English) if it was not built yet.
+
+        :param tokenization: Name of the tokenization method.
+        :return: Dictionary with the arguments of build_bpe ('bpe') and the language of the Moses tokenizer
+                 ('moses_language'), if the tokenization method uses them.
+        """
+        tokenizer_config = dict()
+        if 'bpe' in tokenization.lower():
+            if not self.BPE_built or self.BPE_config is None:
+                raise Exception('Prior to use the "' + tokenization + '" method, you should invoke "build_bpe"')
+            tokenizer_config['bpe'] = dict(self.BPE_config)
+        if 'moses' in tokenization.lower():
+            if not getattr(self, 'moses_tokenizer_built', False):
+                self.build_moses_tokenizer()
+            tokenizer_config['moses_language'] = self.moses_tokenizer.lang
+        return tokenizer_config
+
     def build_moses_tokenizer(self, language='en'):
         """
         Constructs a Moses tokenizer instance.
@@ -2060,7 +3131,7 @@ class Dataset(object):
         """
         Loads a set of outputs of the type 3DLabel (used for detection)
 
-        :param bbox_list: list of bboxes, labels and original sizes
+        :param bbox_list: list of bboxes, labels and original sizes (or RaggedArray of parsed bboxes, see parse3DLabels)
         :param nClasses: number of different classes to be detected
         :param dataAugmentation: are we applying data augmentation?
         :param daRandomParams: random parameters applied on data augmentation (vflip, hflip and random crop)
@@ -2069,67 +3140,41 @@ class Dataset(object):
         :param image_list: list of input images used as identifiers to 'daRandomParams'
         :return: 3DLabels with shape (batch_size, width*height, classes)
         """
-        from scipy import misc
-
         n_samples = len(bbox_list)
         h, w, d = img_size
         h_crop, w_crop, d_crop = size_crop
         labels = np.zeros((n_samples, nClasses, h_crop, w_crop), dtype=np.float32)
+        if not isinstance(bbox_list, RaggedArray):
+            bbox_list = Dataset.parse3DLabels(bbox_list)
+        original_sizes = bbox_list.fields['original_size']
 
         for i in range(n_samples):
-            line = bbox_list[i]
-            arrayLine = line.split(';')
-            arrayBndBox = arrayLine[:-1]
-            w_original, h_original, d_original = eval(arrayLine[-1])
-
-            label3D = np.zeros((nClasses, h_original, w_original), dtype=np.float32)
-
-            for array in arrayBndBox:
-                bndbox = eval(array)[0]
-                idxclass = eval(array)[1]
-
-                # bndbox_ones = np.ones((bndbox[3] - bndbox[1] + 1, bndbox[2] - bndbox[0] + 1))
-                # label3D[idxclass, bndbox[1] - 1:bndbox[3], bndbox[0] - 1:bndbox[2]] = bndbox_ones
-
-                bndbox_ones = np.ones((bndbox[2] - bndbox[0] + 1, bndbox[3] - bndbox[1] + 1))
-                label3D[idxclass, bndbox[0] - 1:bndbox[2], bndbox[1] - 1:bndbox[3]] = bndbox_ones
+            w_original, h_original, d_original = original_sizes[i]
+            label3D = Dataset.rasterize3DLabel(bbox_list[i], nClasses, h_original, w_original)
 
             if not dataAugmentation or daRandomParams is None:
-                # Resize 3DLabel to crop size.
-                for j in range(nClasses):
-                    label2D = misc.imresize(label3D[j], (h_crop, w_crop))
-                    maxval = np.max(label2D)
-                    if maxval > 0:
-                        label2D /= maxval
-                    labels[i, j] = label2D
+                # Resize 3DLabel to crop size (all the classes at once).
+                labels[i] = Dataset.__normalizeLabelMaps(resize_maps(label3D, (h_crop, w_crop)))
             else:
-                label3D_rs = np.zeros((nClasses, h_crop, w_crop), dtype=np.float32)
-                # Crop the labels (random crop)
-                for j in range(nClasses):
-                    label2D = misc.imresize(label3D[j], (h, w))
-                    maxval = np.max(label2D)
-                    if maxval > 0:
-                        label2D /= maxval
-                    randomParams = daRandomParams[image_list[i]]
-                    # Take random crop
-                    left = randomParams["left"]
-                    right = np.add(left, size_crop[0:2])
+                label3D = Dataset.__normalizeLabelMaps(resize_maps(label3D, (h, w)))
+                randomParams = daRandomParams[image_list[i]]
+                # Take random crop
+                left = randomParams["left"]
+                right = np.add(left, size_crop[0:2])
 
-                    label2D = label2D[left[0]:right[0], left[1]:right[1]]
+                label3D = label3D[:, left[0]:right[0], left[1]:right[1]]
 
-                    # Randomly flip (with a certain probability)
-                    flip = randomParams["hflip"]
-                    prob_flip_horizontal = randomParams["prob_flip_horizontal"]
-                    if flip < prob_flip_horizontal:  # horizontal flip
-                        label2D = np.fliplr(label2D)
-                    flip = randomParams["vflip"]
-                    prob_flip_vertical = randomParams["prob_flip_vertical"]
-                    if flip < prob_flip_vertical:  # vertical flip
-                        label2D = np.flipud(label2D)
+                # Randomly flip (with a certain probability)
+                flip = randomParams["hflip"]
+                prob_flip_horizontal = randomParams["prob_flip_horizontal"]
+                if flip < prob_flip_horizontal:  # horizontal flip
+                    label3D = label3D[:, :, ::-1]
+                flip = randomParams["vflip"]
+                prob_flip_vertical = randomParams["prob_flip_vertical"]
+                if flip < prob_flip_vertical:  # vertical flip
+                    label3D = label3D[:, ::-1]
 
-                    label3D_rs[j] = label2D
-
-                labels[i] = label3D_rs
+                labels[i] = label3D
 
         # Reshape labels to (batch_size, width*height, classes) before returning
         labels = np.reshape(labels, (n_samples, nClasses, w_crop * h_crop))
@@ -2152,102 +3197,125 @@ class Dataset(object):
         :param image_list: list of input images used as identifiers to 'daRandomParams'
         :return: 3DSemanticLabels with shape (batch_size, width*height, classes)
         """
-        from PIL import Image as pilimage
-        from scipy import misc
-
         n_samples = len(labeled_images_list)
         h, w, d = img_size
         h_crop, w_crop, d_crop = size_crop
-        labels = np.zeros((n_samples, nClasses, h_crop, w_crop), dtype=np.float32)
 
-        for i in range(n_samples):
-            line = labeled_images_list[i].rstrip('\n')
+        if not dataAugmentation or daRandomParams is None:
+            # Resize 3DLabel to crop size.
+            labels = self.__loadSemanticLabelMaps(labeled_images_list, nClasses, classes_to_colour, h, w,
+                                                  (h_crop, w_crop))
+        else:
+            label3D = self.__loadSemanticLabelMaps(labeled_images_list, nClasses, classes_to_colour, h, w)
+            labels = np.zeros((n_samples, nClasses, h_crop, w_crop), dtype=np.float32)
+            # Crop the labels (random crop)
+            for i in range(n_samples):
+                randomParams = daRandomParams[image_list[i]]
+                # Take random crop
+                left = randomParams["left"]
+                right = np.add(left, size_crop[0:2])
+
+                label3D_rs = label3D[i, :, left[0]:right[0], left[1]:right[1]]
+
+                # Randomly flip (with a certain probability)
+                flip = randomParams["hflip"]
+                prob_flip_horizontal = randomParams["prob_flip_horizontal"]
+                if flip < prob_flip_horizontal:  # horizontal flip
+                    label3D_rs = label3D_rs[:, :, ::-1]
+                flip = randomParams["vflip"]
+                prob_flip_vertical = randomParams["prob_flip_vertical"]
+                if flip < prob_flip_vertical:  # vertical flip
+                    label3D_rs = label3D_rs[:, ::-1]
+
+                labels[i] = label3D_rs
+
+        # Reshape labels to (batch_size, width*height, classes) before returning
+        labels = np.reshape(labels, (n_samples, nClasses, w_crop * h_crop))
+        labels = np.transpose(labels, (0, 2, 1))
+
+        return labels
 
+    def __loadSemanticLabelMaps(self, labeled_images_list, nClasses, classes_to_colour, h, w, size=None):
+        """
+        Reads a set of labeled images (storing the class id of each pixel), resizes them to (h, w) and converts them
+        into one-hot label maps. Optionally, the label maps are then resized to 'size' (all the classes at once) and
+        normalized.
+
+        :param labeled_images_list: list of labeled images
+        :param nClasses: number of different classes
+        :param classes_to_colour: dictionary relating each class id to their corresponding colour in the labeled image
+        :param h: height of the label maps
+        :param w: width of the label maps
+        :param size: (height, width) of the returned label maps. If None, (h, w).
+        :return: label maps with shape (batch_size, classes, height, width)
+        """
+        from PIL import Image as pilimage
+
+        class_ids = np.array(sorted(classes_to_colour), dtype='int64')
+        labels = np.zeros((len(labeled_images_list), nClasses) + tuple(size or (h, w)), dtype=np.float32)
+        label3D = np.zeros((nClasses, h, w), dtype=np.float32)
+        for i, line in list(enumerate(labeled_images_list)):
             # Load labeled GT image
-            labeled_im = self.path + '/' + line
-            # Check if the filename includes the extension
-            [path, filename] = ntpath.split(labeled_im)
-            [filename, ext] = os.path.splitext(filename)
-            # If it doesn't then we find it
-            if not ext:
-                filename = fnmatch.filter(os.listdir(path), filename + '*')
-                if not filename:
-                    raise Exception('Non existent image ' + labeled_im)
-                else:
-                    labeled_im = path + '/' + filename[0]
+            labeled_im = self.__getImagePath(line.rstrip('\n'))
             # Read image
             try:
                 logging.disable(logging.CRITICAL)
-                labeled_im = pilimage.open(labeled_im)
-                labeled_im = np.asarray(labeled_im)
-                logging.disable(logging.NOTSET)
-                labeled_im = misc.imresize(labeled_im, (h, w))
+                labeled_im = np.asarray(pilimage.open(labeled_im))
+                labeled_im = resize_maps(labeled_im, (h, w), interpolation='nearest')
             except Exception:
-                logger.info(labeled_im)
                 logger.warning("WARNING!")
-                logger.warning("Can't load image " + labeled_im)
+                logger.warning("Can't load image " + str(labeled_im))
                 labeled_im = np.zeros((h, w))
-
-            label3D = np.zeros((nClasses, h, w), dtype=np.float32)
+            finally:
+                logging.disable(logging.NOTSET)
 
             # Insert 1s in the corresponding positions for each class
-            for class_id, colour in iteritems(classes_to_colour):
-                # indices = np.where(np.all(labeled_im == colour, axis=-1))
-                indices = np.where(labeled_im == class_id)
-                num_vals = len(indices[0])
-                if num_vals > 0:
-                    for idx_pos in range(num_vals):
-                        x, y = indices[0][idx_pos], indices[1][idx_pos]
-                        label3D[class_id, x, y] = 1.
-
-            if not dataAugmentation or daRandomParams is None:
-                # Resize 3DLabel to crop size.
-                for j in range(nClasses):
-                    label2D = misc.imresize(label3D[j], (h_crop, w_crop))
-                    maxval = np.max(label2D)
-                    if maxval > 0:
-                        label2D /= maxval
-                    labels[i, j] = label2D
+            label3D[class_ids] = labeled_im == class_ids[:, None, None]
+            if size is None:
+                labels[i] = label3D
             else:
-                label3D_rs = np.zeros((nClasses, h_crop, w_crop), dtype=np.float32)
-                # Crop the labels (random crop)
-                for j in range(nClasses):
-                    label2D = misc.imresize(label3D[j], (h, w))
-                    maxval = np.max(label2D)
-                    if maxval > 0:
-                        label2D /= maxval
-                    randomParams = daRandomParams[image_list[i]]
-                    # Take random crop
-                    left = randomParams["left"]
-                    right = np.add(left, size_crop[0:2])
-
-                    label2D = label2D[left[0]:right[0], left[1]:right[1]]
-
-                    # Randomly flip (with a certain probability)
-                    flip = randomParams["hflip"]
-                    prob_flip_horizontal = randomParams["prob_flip_horizontal"]
-                    if flip < prob_flip_horizontal:  # horizontal flip
-                        label2D = np.fliplr(label2D)
-                    flip = randomParams["vflip"]
-                    prob_flip_vertical = randomParams["prob_flip_vertical"]
-                    if flip < prob_flip_vertical:  # vertical flip
-                        label2D = np.flipud(label2D)
+                labels[i] = self.__normalizeLabelMaps(resize_maps(label3D, size))
 
-                    label3D_rs[j] = label2D
+        return labels
 
-                labels[i] = label3D_rs
+    @staticmethod
+    def __normalizeLabelMaps(label3D):
+        """
+        Divides each label map by its maximum value (in place).
+        :param label3D: label maps with shape (..., h, w)
+        :return: normalized label maps
+        """
+        maxval = label3D.max(axis=(-2, -1), keepdims=True)
+        np.divide(label3D, maxval, out=label3D, where=maxval > 0)
+        return label3D
 
-        # Reshape labels to (batch_size, width*height, classes) before returning
-        labels = np.reshape(labels, (n_samples, nClasses, w_crop * h_crop))
-        labels = np.transpose(labels, (0, 2, 1))
+    def encodeText(self, sentences, vocab):
+        """
+        Converts a list of (tokenized) sentences into word indices.
 
-        return labels
+        :param sentences: List of sentences. Words are separated by blank spaces.
+        :param vocab: Mapping word -> index
+        :return: RaggedArray with the word indices of each sentence. The field 'split_lengths' stores the number of
+                 elements of each sentence split by spaces (without stripping), used when padding on batch.
+        """
+        unk_idx = vocab.get(self.unk_symbol)
+        encoded_sentences = []
+        split_lengths = []
+        for sentence in sentences:
+            split_lengths.append(len(sentence.split(' ')))
+            words = sentence.strip().split(' ')
+            if unk_idx is None:
+                encoded_sentences.append([vocab[word] for word in words])
+            else:
+                encoded_sentences.append([vocab.get(word, unk_idx) for word in words])
+        return RaggedArray.from_sequences(encoded_sentences, dtype='int32',
+                                          fields={'split_lengths': np.asarray(split_lengths, dtype='int32')})
 
     def loadText(self, X, vocabularies, max_len, offset, fill, pad_on_batch, words_so_far, loading_X=False):
         """
         Text encoder: Transforms samples from a text representation into a numerical one. It also masks the text.
 
-        :param X: Text to encode.
+        :param X: Text to encode. List of sentences or RaggedArray of word indices (see encodeText).
         :param vocabularies: Mapping word -> index
         :param max_len: Maximum length of the text.
         :param offset: Shifts the text to the right, adding null symbol at the start
@@ -2267,7 +3335,7 @@ class Dataset(object):
         # uint8.max: 255
         # uint16.max: 65535
         # uint32.max: 4294967295
-        vocabulary_size = len(list(vocab))
+        vocabulary_size = len(vocab)
 
         if vocabulary_size < 255:
             dtype_text = 'uint8'
@@ -2277,18 +3345,22 @@ class Dataset(object):
             dtype_text = 'uint32'
 
         if max_len == 0:  # use whole sentence as class
-            X_out = np.zeros(n_batch).astype(dtype_text)
-            for sentence_idx in range(n_batch):
-                word = X[sentence_idx]
-                if self.unk_symbol in vocab:
-                    X_out[sentence_idx] = vocab.get(word, vocab[self.unk_symbol])
-                else:
-                    X_out[sentence_idx] = vocab[word]
+            if self.unk_symbol in vocab:
+                unk_idx = vocab[self.unk_symbol]
+                X_out = np.asarray([vocab.get(word, unk_idx) for word in X], dtype=dtype_text)
+            else:
+                X_out = np.asarray([vocab[word] for word in X], dtype=dtype_text)
             if loading_X:
                 X_out = (X_out, None)  # This None simulates a mask
         else:  # process text as a sequence of words
+            if not isinstance(X, RaggedArray):
+                if n_batch > 0 and isinstance(X[0], np.ndarray):
+                    X = RaggedArray.from_sequences(X)
+                else:
+                    X = self.encodeText(X, vocab)
+            split_lengths = X.fields.get('split_lengths', X.lengths)
             if pad_on_batch:
-                max_len_batch = min(max([len(words.split(' ')) for words in X]) + 1, max_len)
+                max_len_batch = min(int(max(split_lengths)) + 1, max_len)
             else:
                 max_len_batch = max_len
 
@@ -2305,46 +3377,55 @@ class Dataset(object):
 
             max_len_batch -= 1  # always leave space for <eos> symbol
 
-            # fills text vectors with each word (fills with 0s or removes remaining words w.r.t. max_len)
-            for sentence_idx in range(n_batch):
-                words = X[sentence_idx].strip().split(' ')
-                len_j = len(words)
-                if fill == 'start':
-                    offset_j = max_len_batch - len_j - 1
-                elif fill == 'center':
-                    offset_j = (max_len_batch - len_j) / 2
-                    len_j += offset_j
-                else:
-                    offset_j = 0
-                    len_j = min(len_j, max_len_batch)
-                if offset_j < 0:
-                    len_j += offset_j
-                    offset_j = 0
-
-                if words_so_far:
-                    for word_idx, word in list(zip(range(len_j), words[:len_j])):
-                        next_w = vocab.get(word, next_w=vocab[self.unk_symbol])
+            # Position (offset_j) and number of words (len_j) of each sentence
+            # (fills with 0s or removes remaining words w.r.t. max_len)
+            lengths = X.lengths
+            if fill == 'start':
+                offsets_j = max_len_batch - lengths - 1
+                lens_j = lengths.copy()
+            elif fill == 'center':
+                offsets_j = (max_len_batch - lengths) // 2
+                lens_j = lengths + offsets_j
+            else:
+                offsets_j = np.zeros(n_batch, dtype='int64')
+                lens_j = np.minimum(lengths, max_len_batch)
+            lens_j = np.where(offsets_j < 0, lens_j + offsets_j, lens_j)
+            offsets_j = np.maximum(offsets_j, 0)
+
+            if words_so_far:
+                for sentence_idx in range(n_batch):
+                    words = X[sentence_idx]
+                    len_j = int(lens_j[sentence_idx])
+                    offset_j = int(offsets_j[sentence_idx])
+                    for word_idx, next_w in list(zip(range(len_j), words[:len_j])):
                         for k in range(word_idx, len_j):
                             X_out[sentence_idx, k + offset_j, word_idx + offset_j] = next_w
                             X_mask[sentence_idx, k + offset_j, word_idx + offset_j] = 1  # fill mask
                         X_mask[sentence_idx, word_idx + offset_j, word_idx + 1 + offset_j] = 1  # add additional 1 for the <eos> symbol
 
-                else:
-                    for word_idx, word in list(zip(range(len_j), words[:len_j])):
-                        X_out[sentence_idx, word_idx + offset_j] = vocab.get(word, vocab[self.unk_symbol])
-                        X_mask[sentence_idx, word_idx + offset_j] = 1  # fill mask
-                    X_mask[sentence_idx, len_j + offset_j] = 1  # add additional 1 for the <eos> symbol
-
-                if offset > 0:  # Move the text to the right -> null symbol
-                    if words_so_far:
+                    if offset > 0:  # Move the text to the right -> null symbol
                         for k in range(len_j):
                             X_out[sentence_idx, k] = np.append([vocab[self.null_symbol]] * offset, X_out[sentence_idx, k, :-offset])
                             X_mask[sentence_idx, k] = np.append([0] * offset, X_mask[sentence_idx, k, :-offset])
                         X_out[sentence_idx] = np.append(null_row, X_out[sentence_idx, :-offset], axis=0)
                         X_mask[sentence_idx] = np.append(zero_row, X_mask[sentence_idx, :-offset], axis=0)
-                    else:
-                        X_out[sentence_idx] = np.append([vocab[self.null_symbol]] * offset, X_out[sentence_idx, :-offset])
-                        X_mask[sentence_idx] = np.append([1] * offset, X_mask[sentence_idx, :-offset])
+            else:
+                # Scatter the first n_words_j indices of each sentence into [offset_j, offset_j + n_words_j)
+                n_words_j = np.maximum(np.minimum(lens_j, lengths), 0)
+                cum_n_words = np.zeros(n_batch + 1, dtype='int64')
+                np.cumsum(n_words_j, out=cum_n_words[1:])
+                word_positions = np.arange(cum_n_words[-1]) - np.repeat(cum_n_words[:-1], n_words_j)
+                rows = np.repeat(np.arange(n_batch), n_words_j)
+                columns = np.repeat(offsets_j, n_words_j) + word_positions
+                X_out[rows, columns] = X.data[np.repeat(X.offsets[:-1], n_words_j) + word_positions]
+                X_mask[rows, columns] = 1  # fill mask
+                X_mask[np.arange(n_batch), lens_j + offsets_j] = 1  # add additional 1 for the <eos> symbol
+
+                if offset > 0:  # Move the text to the right -> null symbol
+                    X_out[:, offset:] = X_out[:, :-offset].copy()
+                    X_out[:, :offset] = vocab[self.null_symbol]
+                    X_mask[:, offset:] = X_mask[:, :-offset].copy()
+                    X_mask[:, :offset] = 1
             X_out = (np.asarray(X_out, dtype=dtype_text), np.asarray(X_mask, dtype='int8'))
 
         return X_out
@@ -2392,9 +3473,8 @@ class Dataset(object):
                 y_aux_type = np.float32
             else:
                 y_aux_type = np.uint8
-            y_aux = np.zeros(list(y[0].shape) + [vocabulary_len]).astype(y_aux_type)
-            for idx in range(y[0].shape[0]):
-                y_aux[idx] = to_categorical(y[0][idx], vocabulary_len).astype(y_aux_type)
+            y_aux = np.zeros(list(y[0].shape) + [vocabulary_len], dtype=y_aux_type)
+            y_aux.reshape(-1, vocabulary_len)[np.arange(y[0].size), y[0].ravel()] = 1
             if label_smoothing > 0.:
                 y_aux = self.apply_label_smoothing(y_aux, label_smoothing, vocabulary_len)
             if sample_weights:
@@ -2459,9 +3539,8 @@ class Dataset(object):
                 y_aux_type = np.float32
             else:
                 y_aux_type = np.uint8
-            y_aux = np.zeros(list(y[0].shape) + [vocabulary_len]).astype(y_aux_type)
-            for idx in range(y[0].shape[0]):
-                y_aux[idx] = to_categorical(y[0][idx], vocabulary_len).astype(y_aux_type)
+            y_aux = np.zeros(list(y[0].shape) + [vocabulary_len], dtype=y_aux_type)
+            y_aux.reshape(-1, vocabulary_len)[np.arange(y[0].size), y[0].ravel()] = 1
             if label_smoothing > 0.:
                 y_aux = self.apply_label_smoothing(y_aux, label_smoothing, vocabulary_len)
             if sample_weights:
@@ -2733,6 +3812,8 @@ class Dataset(object):
             if data_id not in self.paths_frames:
                 self.paths_frames[data_id] = dict()
             self.paths_frames[data_id][set_name] = data
+            self.counts_frames.setdefault(data_id, dict())[set_name] = counts_frames
+            self.frames_offsets.setdefault(data_id, dict())[set_name] = self.__framesOffsets(counts_frames)
             self.max_video_len[data_id] = max_video_len
             self.img_size[data_id] = img_size
             self.img_size_crop[data_id] = img_size_crop
@@ -2795,6 +3876,8 @@ class Dataset(object):
 
             self.paths_frames[data_id][set_name] = paths_frames
             self.counts_frames[data_id][set_name] = counts_frames
+            self.frames_offsets.setdefault(data_id, dict())[set_name] = self.__framesOffsets(counts_frames)
+            self._frames_rows = dict()
             self.max_video_len[data_id] = max_video_len
             self.img_size[data_id] = img_size
             self.img_size_crop[data_id] = img_size_crop
@@ -2815,11 +3898,12 @@ class Dataset(object):
     def loadVideos(self, n_frames, data_id, last, set_name, max_len, normalization_type, normalization, meanSubstraction,
                    dataAugmentation):
         """
-         Loads a set of videos from disk. (Untested!)
+         Loads a set of consecutive videos from disk.
 
         :param n_frames: Number of frames per video
         :param data_id: Id to load
-        :param last: Last video loaded
+        :param last: Position of the first video to load in the set split (the following ones are loaded consecutively,
+                     starting again from the first position of the set after the last one)
         :param set_name:  'train', 'val', 'test'
         :param max_len: Maximum length of videos
         :param normalization_type:  Type of normalization applied
@@ -2827,38 +3911,9 @@ class Dataset(object):
         :param meanSubstraction:  Whether we are removing the training mean
         :param dataAugmentation:  Whether we are applying dataAugmentatino (random cropping and horizontal flip)
         """
-
-        n_videos = len(n_frames)
-        V = np.zeros((n_videos, max_len * 3, self.img_size_crop[data_id][0], self.img_size_crop[data_id][1]))
-
-        idx = [0 for i in range(n_videos)]
-        # recover all indices from image's paths of all videos
-        for v in range(n_videos):
-            this_last = last + v
-            if this_last >= n_videos:
-                v = this_last % n_videos
-                this_last = v
-            idx[v] = int(sum(getattr(self, 'Y_' + set_name)[data_id][:this_last]))
-
-        # load images from each video
-        for enum, (n, i) in list(enumerate(zip(n_frames, idx))):
-            paths = self.paths_frames[data_id][set_name][i:i + n]
-            daRandomParams = None
-            if dataAugmentation:
-                daRandomParams = self.getDataAugmentationRandomParams(paths, data_id)
-            # returns numpy array with dimensions (batch, channels, height, width)
-            images = self.loadImages(paths, data_id, normalization_type, normalization, meanSubstraction, dataAugmentation,
-                                     daRandomParams)
-            # fills video matrix with each frame (fills with 0s or removes remaining frames w.r.t. max_len)
-            len_j = images.shape[0]
-            offset_j = max_len - len_j
-            if offset_j < 0:
-                len_j = len_j + offset_j
-                offset_j = 0
-            for j in range(len_j):
-                V[enum, (j + offset_j) * 3:(j + offset_j + 1) * 3] = images[j]
-
-        return V
+        indices = (last + np.arange(len(n_frames))) % getattr(self, 'len_' + set_name)
+        return self.loadVideosByIndex(n_frames, data_id, indices, set_name, max_len, normalization_type, normalization,
+                                      meanSubstraction, dataAugmentation)
 
     def loadVideoFeatures(self, idx_videos, data_id, set_name, max_len, normalization_type, normalization, feat_len,
                           external=False, data_augmentation=True):
@@ -2879,78 +3934,139 @@ class Dataset(object):
         n_videos = len(idx_videos)
         if isinstance(feat_len, list):
             feat_len = feat_len[0]
-        features = np.zeros((n_videos, max_len, feat_len))
+        dtype = self.getDtype(data_id)
+        features = np.zeros((n_videos, max_len, feat_len), dtype=dtype)
 
-        selected_frames = self.getFramesPaths(idx_videos, data_id, set_name, max_len, data_augmentation)
+        selected_positions = self.__getFramesPositions(idx_videos, data_id, set_name, max_len, data_augmentation)
         data_augmentation_types = self.inputs_data_augmentation_types[data_id]
 
-        # load features from selected paths
-        for i, vid_paths in list(enumerate(selected_frames)):
-            for j, feat in list(enumerate(vid_paths)):
+        # (video, frame) position in 'features' of each selected frame
+        n_selected = [len(positions) for positions in selected_positions]
+        videos = np.repeat(np.arange(n_videos), n_selected)
+        frames = np.concatenate([np.arange(n, dtype='int64') for n in n_selected] + [np.zeros(0, dtype='int64')])
+        positions = np.concatenate(selected_positions + [np.zeros(0, dtype='int64')])
+
+        # load features from selected frames
+        if data_id in self.feature_stores:
+            loaded = self.feature_stores[data_id].data[self.__getFramesRows(data_id, set_name)[positions]]
+            loaded = loaded.astype(dtype)
+        else:
+            paths_frames = self.paths_frames[data_id][set_name]
+            loaded = np.zeros((len(positions), feat_len), dtype=dtype)
+            for k, position in list(enumerate(positions)):
+                feat = paths_frames[position]
                 if not external:
                     feat = self.path + '/' + feat
+                loaded[k] = np.load(feat)
 
-                # Check if the filename includes the extension
-                feat = np.load(feat)
-
-                if data_augmentation:
-                    if data_augmentation_types is not None and 'noise' in data_augmentation_types:
-                        noise_mean = 0.0
-                        noise_dev = 0.01
-                        noise = np.random.normal(noise_mean, noise_dev, feat.shape)
-                        feat += noise
+        add_noise = data_augmentation and data_augmentation_types is not None and 'noise' in data_augmentation_types
+        features[videos, frames] = self.__processFeatures(loaded, normalization_type, normalization, add_noise)
 
-                if normalization:
-                    if normalization_type == 'L2':
-                        feat /= np.linalg.norm(feat, ord=2)
-
-                features[i, j] = feat
-
-        return np.array(features)
+        return features
 
     def getFramesPaths(self, idx_videos, data_id, set_name, max_len, data_augmentation):
         """
         Recovers the paths from the selected video frames.
         """
+        paths_frames = self.paths_frames[data_id][set_name]
+        return [[paths_frames[position] for position in positions]
+                for positions in self.__getFramesPositions(idx_videos, data_id, set_name, max_len, data_augmentation)]
+
+    def __getFramesPositions(self, idx_videos, data_id, set_name, max_len, data_augmentation):
+        """
+        Selects (at most) max_len frames from each video.
+
+        :return: List with an array for each video with the positions of its selected frames in
+                 self.paths_frames[data_id][set_name].
+        """
 
         # recover chosen data augmentation types
         data_augmentation_types = self.inputs_data_augmentation_types[data_id]
         if data_augmentation_types is None:
             data_augmentation_types = []
 
-        n_frames = [self.counts_frames[data_id][set_name][i_idx_vid] for i_idx_vid in idx_videos]
-
-        n_videos = len(idx_videos)
-        idx = [0 for i_nvid in range(n_videos)]
         # recover all initial indices from image's paths of all videos
-        for v in range(n_videos):
-            last_idx = idx_videos[v]
-            idx[v] = int(sum(self.counts_frames[data_id][set_name][:last_idx]))
+        offsets = self.__getFramesOffsets(data_id, set_name)
+        idx = offsets[idx_videos]
+        n_frames = offsets[np.asarray(idx_videos) + 1] - idx
 
         # select subset of max_len from n_frames[i]
-        selected_frames = [0 for i_nvid in range(n_videos)]
+        selected_positions = [0 for i_nvid in range(len(idx_videos))]
         for enum, (n, i) in list(enumerate(zip(n_frames, idx))):
-            paths = self.paths_frames[data_id][set_name][i:i + n]
-
+            n = int(n)
             if data_augmentation and 'random_selection' in data_augmentation_types:  # apply random frames selection
-                selected_idx = sorted(random.sample(range(n), min(max_len, n)))
+                selected_idx = np.array(sorted(random.sample(range(n), min(max_len, n))), dtype='int64')
             else:  # apply equidistant frames selection
-                selected_idx = np.round(np.linspace(0, n - 1, min(max_len, n)))
+                selected_idx = np.round(np.linspace(0, n - 1, min(max_len, n))).astype('int64')
                 # splits = np.array_split(range(n), min(max_len, n))
                 # selected_idx = [s[0] for s in splits]
 
-            selected_paths = [paths[int(idx)] for idx in selected_idx]
-            selected_frames[enum] = selected_paths
+            selected_positions[enum] = i + selected_idx
+
+        return selected_positions
+
+    @staticmethod
+    def __framesOffsets(counts_frames):
+        """
+        Computes the position of the first frame of each video in the list of frames (and, as last element, the
+        total number of frames).
+        :param counts_frames: Number of frames of each video.
+        :return: Array of len(counts_frames) + 1 offsets.
+        """
+        return np.concatenate([[0], np.cumsum(np.asarray(counts_frames, dtype='int64'))]).astype('int64')
+
+    def __getFramesOffsets(self, data_id, set_name):
+        """
+        Returns the frames offsets of a video input (see __framesOffsets), computing them if they are not available
+        (e.g. datasets built before they were stored).
+        """
+        counts_frames = self.counts_frames.get(data_id, dict()).get(set_name)
+        if counts_frames is None:  # 'video' inputs store the number of frames of each video as samples
+            counts_frames = getattr(self, 'X_' + set_name)[data_id]
+        offsets = self.frames_offsets.setdefault(data_id, dict()).get(set_name)
+        if offsets is None or len(offsets) != len(counts_frames) + 1:
+            offsets = self.__framesOffsets(counts_frames)
+            self.frames_offsets[data_id][set_name] = offsets
+        return offsets
+
+    def __getFramesRows(self, data_id, set_name):
+        """
+        Returns the row of the feature store of 'data_id' where each frame of self.paths_frames[data_id][set_name]
+        is stored.
+        """
+        if not hasattr(self, '_frames_rows'):
+            self._frames_rows = dict()
+        if (data_id, set_name) not in self._frames_rows:
+            self._frames_rows[(data_id, set_name)] = \
+                self.feature_stores[data_id].getRows(self.paths_frames[data_id][set_name])
+        return self._frames_rows[(data_id, set_name)]
 
-        return selected_frames
+    def getVideosFramesPaths(self, indices, data_id, set_name, max_len):
+        """
+        Paths of the frames loaded for a set of videos of a 'video' input: the first max_len frames of each video.
+        :param indices: Positions of the videos in the set split (read through the view of the split and the
+                        repetition of the samples, see __getSamples).
+        :param data_id: Identifier of the 'video' input.
+        :param set_name: 'train', 'val' or 'test'.
+        :param max_len: Maximum length of each video.
+        :return: List with the list of frame paths of each video.
+        """
+        # recover all initial indices from image's paths of all videos
+        offsets = self.__getFramesOffsets(data_id, set_name)
+        videos = self.__getStoredIndices(set_name, data_id, 'X', indices)
+        # only the first max_len frames of each video are used (the remaining ones are removed)
+        lengths = np.minimum(offsets[videos + 1] - offsets[videos], max_len)
+        paths_frames = self.paths_frames[data_id][set_name]
+        return [[paths_frames[k] for k in range(i, i + n)] for i, n in zip(offsets[videos], lengths)]
 
     def loadVideosByIndex(self, n_frames, data_id, indices, set_name, max_len, normalization_type, normalization,
                           meanSubstraction, dataAugmentation):
         """
         Get videos by indices.
-        :param n_frames: Indices of the frames to load from each video.
+        :param n_frames: Number of frames of each video to load (as read from the set split, see getVideosFramesPaths).
         :param data_id: Data id to be processed.
-        :param indices: Indices of the videos to load.
+        :param indices: Positions of the videos to load in the set split (read through the view of the split and the
+                        repetition of the samples, see __getSamples).
         :param set_name: Set name to be processed.
         :param max_len: Maximum length of each video.
         :param normalization_type: Normalization type applied to the frames.
@@ -2960,30 +4076,27 @@ class Dataset(object):
         :return:
         """
         n_videos = len(indices)
-        V = np.zeros((n_videos, max_len * 3, self.img_size_crop[data_id][0], self.img_size_crop[data_id][1]))
-
-        idx = [0 for i in range(n_videos)]
-        # recover all indices from image's paths of all videos
-        for v in range(n_videos):
-            idx[v] = int(sum(eval('self.X_' + set_name + '[data_id][indices[v]]')))
-
-        # load images from each video
-        for enum, (n, i) in list(enumerate(zip(n_frames, idx))):
-            paths = self.paths_frames[data_id][set_name][i:i + n]
-            daRandomParams = None
-            if dataAugmentation:
-                daRandomParams = self.getDataAugmentationRandomParams(paths, data_id)
-            # returns numpy array with dimensions (batch, channels, height, width)
-            images = self.loadImages(paths, data_id, normalization_type, normalization, meanSubstraction, dataAugmentation,
-                                     daRandomParams)
-            # fills video matrix with each frame (fills with 0s or removes remaining frames w.r.t. max_len)
-            len_j = images.shape[0]
+        V = np.zeros((n_videos, max_len * 3, self.img_size_crop[data_id][0], self.img_size_crop[data_id][1]),
+                     dtype=self.getDtype(data_id))
+
+        videos_paths = self.getVideosFramesPaths(indices, data_id, set_name, max_len)
+        lengths = [len(video_paths) for video_paths in videos_paths]
+        paths = [path for video_paths in videos_paths for path in video_paths]
+
+        # load the frames of all the videos at once
+        daRandomParams = None
+        if dataAugmentation:
+            daRandomParams = self.getDataAugmentationRandomParams(paths, data_id)
+        # returns numpy array with dimensions (batch, channels, height, width)
+        images = self.loadImages(paths, data_id, normalization_type, normalization, meanSubstraction, dataAugmentation,
+                                 daRandomParams)
+
+        # fills video matrix with each frame (fills with 0s at the beginning w.r.t. max_len)
+        first = 0
+        for enum, len_j in list(enumerate(lengths)):
             offset_j = max_len - len_j
-            if offset_j < 0:
-                len_j = len_j + offset_j
-                offset_j = 0
-            for j in range(len_j):
-                V[enum, (j + offset_j) * 3:(j + offset_j + 1) * 3] = images[j]
+            V[enum, offset_j * 3:max_len * 3] = images[first:first + len_j].reshape((len_j * 3,) + V.shape[2:])
+            first += len_j
 
         return V
 
@@ -3030,13 +4143,13 @@ class Dataset(object):
 
         # prepare the segmented image
         pred_labels = np.reshape(img, (h_crop, w_crop, n_classes))
-        # out_img = np.zeros((h_crop, w_crop, d_crop))
-        out_img = np.zeros((h_crop, w_crop, 3))  # predictions saved as RGB images (3 channels)
+        # colour of each class (predictions saved as RGB images, 3 channels)
+        colours = np.zeros((n_classes, 3))
+        for class_id, colour in iteritems(self.semantic_classes[output_id]):
+            if class_id < n_classes:
+                colours[class_id] = colour
 
-        for ih in range(h_crop):
-            for iw in range(w_crop):
-                lab = np.argmax(pred_labels[ih, iw])
-                out_img[ih, iw, :] = self.semantic_classes[output_id][lab]
+        out_img = colours[np.argmax(pred_labels, axis=-1)]
 
         return out_img
 
@@ -3044,7 +4157,9 @@ class Dataset(object):
         """
         Preprocess 3D Semantic labels
         """
-        return self.preprocess3DLabel(path_list, data_id, associated_id_in, num_poolings)
+        path_list_3DLabel = self.preprocess3DLabel(path_list, data_id, associated_id_in, num_poolings)
+        self.__resolvePaths(path_list_3DLabel)
+        return path_list_3DLabel
 
     def setSemanticClasses(self, path_classes, data_id):
         """
@@ -3088,11 +4203,6 @@ class Dataset(object):
         :param data_id: id of the input/output we are processing
         :return: out_list: containing a list of label images reshaped as an Nx1 array
         """
-        from PIL import Image as pilimage
-        from scipy import misc
-
-        out_list = []
-
         assoc_id_in = self.id_in_3DLabel[data_id]
         classes_to_colour = self.semantic_classes[data_id]
         nClasses = len(list(classes_to_colour))
@@ -3100,7 +4210,6 @@ class Dataset(object):
         size_crop = self.img_size_crop[assoc_id_in]
         num_poolings = self.num_poolings_model[data_id]
 
-        n_samples = len(gt)
         h, w, d = img_size
         h_crop, w_crop, d_crop = size_crop
 
@@ -3109,69 +4218,19 @@ class Dataset(object):
             h_crop = int(np.floor(h_crop / np.power(2, num_poolings)))
             w_crop = int(np.floor(w_crop / np.power(2, num_poolings)))
 
-        for i in range(n_samples):
-            pre_labels = np.zeros((nClasses, h_crop, w_crop), dtype=np.float32)
-            # labels = np.zeros((h_crop, w_crop), dtype=np.uint8)
-            line = gt[i]
-
-            # Load labeled GT image
-            labeled_im = self.path + '/' + line
-            # Check if the filename includes the extension
-            [path, filename] = ntpath.split(labeled_im)
-            [filename, ext] = os.path.splitext(filename)
-            # If it doesn't then we find it
-            if not ext:
-                filename = fnmatch.filter(os.listdir(path), filename + '*')
-                if not filename:
-                    raise Exception('Non existent image ' + labeled_im)
-                else:
-                    labeled_im = path + '/' + filename[0]
-            # Read image
-            try:
-                logging.disable(logging.CRITICAL)
-                labeled_im = pilimage.open(labeled_im)
-                labeled_im = np.asarray(labeled_im)
-                logging.disable(logging.NOTSET)
-                labeled_im = misc.imresize(labeled_im, (h, w))
-            except Exception:
-                logger.warning("WARNING!")
-                logger.warning("Can't load image " + labeled_im)
-                labeled_im = np.zeros((h, w))
-
-            label3D = np.zeros((nClasses, h, w), dtype=np.float32)
-
-            # Insert 1s in the corresponding positions for each class
-            for class_id, colour in iteritems(classes_to_colour):
-                # indices = np.where(np.all(labeled_im == colour, axis=-1))
-                indices = np.where(labeled_im == class_id)
-                num_vals = len(indices[0])
-                if num_vals > 0:
-                    for idx_pos in range(num_vals):
-                        x, y = indices[0][idx_pos], indices[1][idx_pos]
-                        label3D[class_id, x, y] = 1.
-
-            # Resize 3DLabel to crop size.
-            for j in range(nClasses):
-                label2D = misc.imresize(label3D[j], (h_crop, w_crop))
-                maxval = np.max(label2D)
-                if maxval > 0:
-                    label2D /= maxval
-                pre_labels[j] = label2D
-
-            # Convert to single matrix with class IDs
-            labels = np.argmax(pre_labels, axis=0)
-            labels = np.reshape(labels, (w_crop * h_crop))
+        # Resize 3DLabel to crop size.
+        pre_labels = self.__loadSemanticLabelMaps(gt, nClasses, classes_to_colour, h, w, (h_crop, w_crop))
 
-            out_list.append(labels)
+        # Convert to single matrix with class IDs
+        labels = np.argmax(pre_labels, axis=1)
+        labels = np.reshape(labels, (-1, w_crop * h_crop))
 
-        return out_list
+        return list(labels)
 
     def resize_semantic_output(self, predictions, ids_out):
         """
         Resize semantic output.
         """
-        from scipy import misc
-
         out_pred = []
 
         for pred, id_out in list(zip(predictions, ids_out)):
@@ -3179,14 +4238,12 @@ class Dataset(object):
             assoc_id_in = self.id_in_3DLabel[id_out]
             in_size = self.img_size_crop[assoc_id_in]
             out_size = self.img_size[assoc_id_in]
-            n_classes = len(self.classes[id_out])
 
             pred = np.transpose(pred, [1, 0])
             pred = np.reshape(pred, (-1, in_size[0], in_size[1]))
 
-            new_pred = np.zeros(tuple([n_classes] + out_size[0:2]))
-            for pos, p in list(enumerate(pred)):
-                new_pred[pos] = misc.imresize(p, tuple(out_size[0:2]))
+            # All the class channels are resized at once
+            new_pred = resize_maps(pred, tuple(out_size[0:2]))
 
             new_pred = np.reshape(new_pred, (-1, out_size[0] * out_size[1]))
             new_pred = np.transpose(new_pred, [1, 0])
@@ -3215,6 +4272,59 @@ class Dataset(object):
 
         return path_list_3DLabel
 
+    @staticmethod
+    def parse3DLabels(bbox_list):
+        """
+        Parses a list of 3DLabels, each of them with the format
+        '[bbox, class];[bbox, class];...;[width, height, depth]', where bbox is [x_min, y_min, x_max, y_max].
+
+        :param bbox_list: list of bboxes, labels and original sizes
+        :return: RaggedArray with a structured array (fields 'bbox' and 'class') with the bounding boxes of each
+                 sample. The field 'original_size' stores the original (width, height, depth) of each sample.
+        """
+        bboxes = []
+        lengths = []
+        original_sizes = []
+        for line in bbox_list:
+            arrayLine = line.strip().split(';')
+            original_sizes.append(ast.literal_eval(arrayLine[-1]))
+            arrayBndBox = [ast.literal_eval(array) for array in arrayLine[:-1]]
+            bboxes += [(tuple(array[0]), array[1]) for array in arrayBndBox]
+            lengths.append(len(arrayBndBox))
+        offsets = np.zeros(len(lengths) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.array(bboxes, dtype=[('bbox', 'int32', (4,)), ('class', 'int32')])
+        return RaggedArray(data, offsets, {'original_size': np.array(original_sizes, dtype='int32').reshape(-1, 3)})
+
+    @staticmethod
+    def rasterize3DLabel(bboxes, nClasses, height, width):
+        """
+        Builds the label maps of a sample from its bounding boxes: each box [x_min, y_min, x_max, y_max] (1-based,
+        inclusive) sets to 1 the region [x_min - 1:x_max, y_min - 1:y_max] of the map of its class.
+
+        :param bboxes: structured array with the bounding boxes of the sample (see parse3DLabels)
+        :param nClasses: number of different classes to be detected
+        :param height: height of the label maps (first coordinate of the boxes)
+        :param width: width of the label maps (second coordinate of the boxes)
+        :return: label maps with shape (nClasses, height, width)
+        """
+        # Difference array: +1/-1 at the corners of each box, accumulated along both axes
+        corners = np.zeros((nClasses, height + 1, width + 1), dtype=np.int32)
+        classes = bboxes['class']
+        x_min = np.clip(bboxes['bbox'][:, 0] - 1, 0, height)
+        x_max = np.clip(bboxes['bbox'][:, 2], 0, height)
+        y_min = np.clip(bboxes['bbox'][:, 1] - 1, 0, width)
+        y_max = np.clip(bboxes['bbox'][:, 3], 0, width)
+        valid = (x_max > x_min) & (y_max > y_min)
+        classes, x_min, x_max, y_min, y_max = [a[valid] for a in [classes, x_min, x_max, y_min, y_max]]
+        np.add.at(corners, (classes, x_min, y_min), 1)
+        np.add.at(corners, (classes, x_min, y_max), -1)
+        np.add.at(corners, (classes, x_max, y_min), -1)
+        np.add.at(corners, (classes, x_max, y_max), 1)
+        np.cumsum(corners, axis=1, out=corners)
+        np.cumsum(corners, axis=2, out=corners)
+        return (corners[:, :height, :width] > 0).astype(np.float32)
+
     def convert_3DLabels_to_bboxes(self, predictions, original_sizes, threshold=0.5, idx_3DLabel=0,
                                    size_restriction=0.001):
         """
@@ -3307,7 +4417,7 @@ class Dataset(object):
         """
         Converts a GT list of 3DLabels to a set of bboxes.
 
-        :param gt: list of Dataset output of type 3DLabels
+        :param gt: list of Dataset output of type 3DLabels (or RaggedArray of parsed bboxes, see parse3DLabels)
         :return: [out_list, original_sizes], where out_list contains a list of samples with the following info
                  [GT_bboxes, GT_Y], and original_sizes contains the original width and height for each image
         """
@@ -3315,27 +4425,11 @@ class Dataset(object):
         original_sizes = []
         # extra_vars[split]['references'] - list of samples with the following info [GT_bboxes, GT_Y]
 
-        n_samples = len(gt)
-        for i in range(n_samples):
-            bboxes = []
-            Y = []
-
-            line = gt[i]
-            arrayLine = line.split(';')
-            arrayBndBox = arrayLine[:-1]
-            w_original, h_original, d_original = eval(arrayLine[-1])
-            original_sizes.append([h_original, w_original])
-
-            for array in arrayBndBox:
-                bndbox = eval(array)[0]
-                # bndbox = [bndbox[1], bndbox[0], bndbox[3], bndbox[2]]
-                idxclass = eval(array)[1]
-                Y.append(idxclass)
-                bboxes.append(bndbox)
-                # bndbox_ones = np.ones((bndbox[2] - bndbox[0] + 1, bndbox[3] - bndbox[1] + 1))
-                # label3D[idxclass, bndbox[0] - 1:bndbox[2], bndbox[1] - 1:bndbox[3]] = bndbox_ones
-
-            out_list.append([bboxes, Y])
+        if not isinstance(gt, RaggedArray):
+            gt = Dataset.parse3DLabels(gt)
+        for bboxes, (w_original, h_original, d_original) in zip(gt, gt.fields['original_size']):
+            original_sizes.append([int(h_original), int(w_original)])
+            out_list.append([bboxes['bbox'].tolist(), bboxes['class'].tolist()])
 
         return [out_list, original_sizes]
 
@@ -3369,35 +4463,158 @@ class Dataset(object):
         self.img_size[data_id] = img_size
         self.img_size_crop[data_id] = img_size_crop
         self.use_RGB[data_id] = use_RGB
+        self.__resolvePaths(data)
 
         # Tries to load a train_mean file from the dataset folder if exists
-        mean_file_path = self.path + '/train_mean'
-        for s in range(len(self.img_size[data_id])):
-            mean_file_path += '_' + str(self.img_size[data_id][s])
-        mean_file_path += '_' + data_id + '_.jpg'
-        if os.path.isfile(mean_file_path):
-            self.setTrainMean(mean_file_path, data_id)
+        for extension in ['.npy', '.jpg']:
+            mean_file_path = self.__getTrainMeanPath(data_id, extension)
+            if os.path.isfile(mean_file_path):
+                self.setTrainMean(mean_file_path, data_id)
+                break
 
         return data
 
+    def setDtype(self, dtype, data_id):
+        """
+        Sets the data type of the arrays returned for an input of type 'raw-image', 'video', 'image-features' or
+        'video-features'. All the processing (normalization, mean subtraction, etc.) is applied with this data type.
+
+        :param dtype: 'float64' (default), 'float32' or 'float16'.
+        :param data_id: Identifier of the input.
+        """
+        dtype = np.dtype(dtype).name
+        if dtype not in ['float64', 'float32', 'float16']:
+            raise NotImplementedError('The data type ' + dtype + ' is not implemented for the inputs.')
+        self.dtypes[data_id] = dtype
+        if not self.silence:
+            logger.info('The input "' + data_id + '" will be loaded as ' + dtype + ' arrays.')
+
+    def getDtype(self, data_id):
+        """
+        :param data_id: Identifier of the input.
+        :return: Data type of the arrays returned for the input (see setDtype).
+        """
+        return np.dtype(self.dtypes.get(data_id, 'float64'))
+
+    def setImageCache(self, max_bytes=1024 ** 3, cache_path=None):
+        """
+        Caches the decoded and resized images loaded by loadImages (as uint8 arrays), so that each image file is only
+        decoded once. Random crops and flips are still applied to the cached images.
+        Images are only cached when they are resized to a fixed size before any other processing, i.e. with
+        wo_da_patch_type='whole' (no data augmentation) or da_patch_type='resize_and_rndcrop' (data augmentation).
+
+        :param max_bytes: Maximum number of bytes of images kept in memory (least recently used images are evicted).
+                          If 0 and no cache_path is given, the cache is disabled.
+        :param cache_path: Directory for an additional on-disk (memory-mapped) tier of the cache.
+                           It is kept across runs and shared by all the Datasets pointing to it.
+        """
+        if max_bytes == 0 and cache_path is None:
+            self.image_cache = None
+        else:
+            self.image_cache = LRUArrayCache(max_bytes=max_bytes, cache_path=cache_path)
+        if not self.silence:
+            logger.info('Image cache ' + ('disabled.' if self.image_cache is None else
+                                          'enabled (' + str(max_bytes) + ' bytes in memory, on-disk path: ' +
+                                          str(cache_path) + ').'))
+
+    def setImageDecoding(self, n_threads=1, draft=False):
+        """
+        Sets how loadImages decodes the image files of a batch.
+        Images are decoded and resized concurrently by a pool of threads (PIL releases the GIL while decoding and
+        resizing), so it can be used from a Data_Batch_Generator without spawning processes.
+        The threads are only used when the images are resized to a fixed size before any other processing, i.e. with
+        wo_da_patch_type='whole' (no data augmentation) or da_patch_type='resize_and_rndcrop' (data augmentation).
+
+        :param n_threads: Number of decoding threads.
+        :param draft: If True, JPEGs are decoded at the lowest reduced resolution (1/2, 1/4 or 1/8) that is not smaller
+                      than the size of the resized images (PIL's draft mode). Note that the decoded images slightly
+                      differ from the ones decoded at full resolution.
+        """
+        self.image_decoding_threads = n_threads
+        self.image_decoding_draft = draft
+        if not self.silence:
+            logger.info('Decoding images with ' + str(n_threads) + ' threads' +
+                        (' (reduced-resolution JPEG decoding).' if draft else '.'))
+
+    def __getDecodingPool(self, n_threads):
+        """
+        Gets a pool of n_threads decoding threads, which is kept (and not pickled) for the next batches.
+        """
+        pid, pool_threads, pool = getattr(self, '_decoding_pool', (None, None, None))
+        # Threads are not inherited by forked processes
+        if pid != os.getpid() or pool_threads != n_threads:
+            if pid == os.getpid():
+                pool.close()
+            pool = ThreadPool(n_threads)
+            self._decoding_pool = (os.getpid(), n_threads, pool)
+        return pool
+
+    def setImageShard(self, shard_path, data_id):
+        """
+        Reads the images of a 'raw-image' input (or the frames of a 'video' input) from a shard of pre-resized images
+        (see utils/build_image_shard.py) instead of reading and decoding each image file.
+        The shard is used when the images are resized to img_size before any other processing (i.e. with
+        da_patch_type='resize_and_rndcrop') or to img_size_crop (wo_da_patch_type='whole').
+        In the latter case, the images of the shard are resized to img_size_crop (if it differs from img_size).
+
+        :param shard_path: Path to the shard files (without extension). If None, the shard is removed.
+        :param data_id: Identifier of the 'raw-image' or 'video' input.
+        """
+        if shard_path is None:
+            self.image_shards.pop(data_id, None)
+            return
+        shard = ImageShard(shard_path)
+        if list(shard.shape[1:3]) != list(self.img_size[data_id][0:2]):
+            raise Exception('The images of the shard ' + shard_path + ' have size ' + str(shard.shape[1:3]) +
+                            ', but the input "' + data_id + '" has img_size ' + str(self.img_size[data_id]) + '.')
+        self.image_shards[data_id] = shard
+        if not self.silence:
+            logger.info('Loading the images of input "' + data_id + '" from the shard ' + shard_path +
+                        ' (' + str(shard.shape[0]) + ' images).')
+
+    def setFeatureStore(self, store_path, data_id):
+        """
+        Reads the features of an 'image-features' or 'video-features' input from a feature store (see
+        utils/build_feature_store.py) instead of loading a .npy file for each feature.
+
+        :param store_path: Path to the store files (without extension). If None, the store is removed.
+        :param data_id: Identifier of the input.
+        """
+        self._frames_rows = dict()
+        if store_path is None:
+            self.feature_stores.pop(data_id, None)
+            return
+        store = FeatureStore(store_path)
+        if list(store.shape[1:]) != list(self.features_lengths[data_id]):
+            raise Exception('The features of the store ' + store_path + ' have length ' + str(store.shape[1:]) +
+                            ', but the input "' + data_id + '" has feat_len ' + str(self.features_lengths[data_id]) +
+                            '.')
+        self.feature_stores[data_id] = store
+        if not self.silence:
+            logger.info('Loading the features of input "' + data_id + '" from the store ' + store_path +
+                        ' (' + str(store.shape[0]) + ' features).')
+
     def setTrainMean(self, mean_image, data_id, normalization=False):
         """
             Loads a pre-calculated training mean image, 'mean_image' can either be:
 
             - numpy.array (complete image)
             - list with a value per channel
-            - string with the path to the stored image.
+            - string with the path to the stored image (or .npy array).
 
         :param mean_image:
         :param normalization:
         :param data_id: identifier of the type of input whose train mean is being introduced.
         """
-        from scipy import misc
+        from PIL import Image as pilimage
 
         if isinstance(mean_image, str):
             if not self.silence:
                 logger.info("Loading train mean image from file.")
-            mean_image = misc.imread(mean_image)
+            if mean_image.endswith('.npy'):
+                mean_image = np.load(mean_image)
+            else:
+                mean_image = np.asarray(pilimage.open(mean_image))
         elif isinstance(mean_image, list):
             mean_image = np.array(mean_image, np.float64)
         self.train_mean[data_id] = mean_image.astype(np.float64)
@@ -3417,8 +4634,7 @@ class Dataset(object):
                 if not self.silence:
                     logger.info("Converting input train mean pixels into mean image.")
                 mean_image = np.zeros(tuple(self.img_size_crop[data_id]), np.float64)
-                for c in range(self.img_size_crop[data_id][2]):
-                    mean_image[:, :, c] = self.train_mean[data_id][c]
+                mean_image[:, :] = self.train_mean[data_id]
                 self.train_mean[data_id] = mean_image
             else:
                 logger.warning(
@@ -3426,16 +4642,27 @@ class Dataset(object):
                     "Change the images size with setImageSize(size) or "
                     "recalculate the training mean with calculateTrainMean().")
 
-    def calculateTrainMean(self, data_id):
+    def calculateTrainMean(self, data_id, per_channel=False, n_workers=1, batch_size=200):
         """
             Calculates the mean of the data belonging to the training set split in each channel.
-        """
-        from scipy import misc
-
+            The training images are decoded and resized to img_size_crop (as loadImages does without data
+            augmentation) and their partial sums are computed in batches, which can be shared among several worker
+            processes. The standard deviation of each channel is stored in self.train_std.
+
+        :param data_id: identifier of the 'raw-image' input.
+        :param per_channel: calculate the mean of each channel instead of the mean image.
+        :param n_workers: number of worker processes decoding and summing the images.
+        :param batch_size: number of images summed by each task.
+        :return: mean image (float32, with shape img_size_crop) or mean of each channel.
+        """
+        if per_channel:
+            mean_shape = (self.img_size_crop[data_id][2] if len(self.img_size_crop[data_id]) == 3 else 1,)
+        else:
+            mean_shape = tuple(self.img_size_crop[data_id])
         calculate = False
         if data_id not in self.train_mean or not isinstance(self.train_mean[data_id], np.ndarray):
             calculate = True
-        elif self.train_mean[data_id].shape != tuple(self.img_size[data_id]):
+        elif self.train_mean[data_id].shape != mean_shape:
             calculate = True
             if not self.silence:
                 logger.warning(
@@ -3445,47 +4672,73 @@ class Dataset(object):
             if not self.silence:
                 logger.info("Start training set mean calculation...")
 
-            I_sum = np.zeros(self.img_size_crop[data_id], dtype=np.float64)
+            images = self.__getSamples('train', data_id, 'X', slice(0, self.len_train))
+            tasks = [(images[init:init + batch_size], data_id) for init in range(0, len(images), batch_size)]
+            pool = None
+            if n_workers > 1:
+                pool = multiprocessing.Pool(n_workers, initializer=_initImagesStatistics, initargs=(self,))
+                partial_statistics = pool.imap_unordered(_imagesStatistics, tasks)
+            else:
+                partial_statistics = (self.getImagesStatistics(*task) for task in tasks)
 
-            # Load images in batches and sum all of them
-            init = 0
-            batch = 200
-            for current_image in range(batch, self.len_train, batch):
-                I = self.getX('train', init, current_image, meanSubstraction=False)[self.ids_inputs.index(data_id)]
-                for im in I:
-                    I_sum += im
-                if not self.silence:
-                    sys.stdout.write('\r')
-                    sys.stdout.write("Processed %d/%d images..." % (current_image, self.len_train))
-                    sys.stdout.flush()
-                init = current_image
-            I = self.getX('train', init, self.len_train, meanSubstraction=False)[self.ids_inputs.index(data_id)]
-            for im in I:
-                I_sum += im
-            if not self.silence:
-                sys.stdout.write('\r')
-                sys.stdout.write("Processed %d/%d images..." % (current_image, self.len_train))
-                sys.stdout.flush()
+            # Merge the partial sums of each batch
+            I_sum, squares_sum, n_images = 0., 0., 0
+            try:
+                for batch_sum, batch_squares_sum, batch_n_images in partial_statistics:
+                    I_sum += batch_sum
+                    squares_sum += batch_squares_sum
+                    n_images += batch_n_images
+                    if not self.silence:
+                        sys.stdout.write('\r')
+                        sys.stdout.write("Processed %d/%d images..." % (n_images, self.len_train))
+                        sys.stdout.flush()
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
 
             # Mean calculation
-            self.train_mean[data_id] = I_sum / self.len_train
-
-            # Store the calculated mean
-            mean_name = '/train_mean'
-            for s in range(len(self.img_size[data_id])):
-                mean_name += '_' + str(self.img_size[data_id][s])
-            mean_name += '_' + data_id + '_.jpg'
-            store_path = self.path + '/' + mean_name
-            misc.imsave(store_path, self.train_mean[data_id])
-
-            # self.train_mean[data_id] = self.train_mean[data_id].astype(np.float32)/255.0
+            n_pixels = float(n_images * I_sum.shape[0] * I_sum.shape[1])
+            channels_mean = I_sum.sum(axis=(0, 1)) / n_pixels
+            self.train_std[data_id] = np.sqrt(np.maximum(squares_sum / n_pixels - channels_mean ** 2, 0.))
+            if per_channel:
+                self.train_mean[data_id] = channels_mean
+            else:
+                self.train_mean[data_id] = (I_sum / n_images).astype(np.float32).reshape(mean_shape)
 
-            if not self.silence:
-                logger.info("Image mean stored in " + store_path)
+                # Store the calculated mean
+                store_path = self.__getTrainMeanPath(data_id)
+                np.save(store_path, self.train_mean[data_id])
+                if not self.silence:
+                    logger.info("Image mean stored in " + store_path)
 
         # Return the mean
         return self.train_mean[data_id]
 
+    def getImagesStatistics(self, images, data_id):
+        """
+        Partial statistics of a set of images of a 'raw-image' input, decoded and resized to img_size_crop
+        (see calculateTrainMean).
+
+        :param images: list of image names.
+        :param data_id: identifier of the 'raw-image' input.
+        :return: [sum of the images (with shape (height, width, channels)), sum of the squared values of each channel,
+                 number of images]
+        """
+        batch = self.__loadResizedImages(images, data_id, self.img_size_crop[data_id][0:2])
+        pixels = batch.reshape(-1, batch.shape[-1]).astype(np.float64)
+        return [batch.sum(axis=0, dtype=np.float64), np.einsum('ij,ij->j', pixels, pixels), len(images)]
+
+    def __getTrainMeanPath(self, data_id, extension='.npy'):
+        """
+        Path of the training mean image of an input stored in the dataset folder.
+        """
+        mean_name = '/train_mean'
+        for s in range(len(self.img_size[data_id])):
+            mean_name += '_' + str(self.img_size[data_id][s])
+        mean_name += '_' + data_id + '_' + extension
+        return self.path + mean_name
+
     def loadImages(self, images, data_id, normalization_type='(-1)-1',
                    normalization=False, meanSubstraction=False,
                    dataAugmentation=False, daRandomParams=None,
@@ -3493,7 +4746,7 @@ class Dataset(object):
                    da_patch_type='resize_and_rndcrop',
                    da_enhance_list=None,
                    useBGR=False,
-                   external=False, loaded=False):
+                   external=False, loaded=False, n_threads=None):
         """
         Loads a set of images from disk.
 
@@ -3508,10 +4761,11 @@ class Dataset(object):
         :param external : if True the images will be loaded from an external database, in this case the list of
                           images must be absolute paths
         :param loaded : set this option to True if images is a list of matricies instead of a list of strings
+        :param n_threads : number of threads decoding the images. If None, self.image_decoding_threads
+                           (see setImageDecoding)
         """
         # Check if the chosen normalization type exists
         from PIL import Image as pilimage
-        from scipy import misc
         import keras
 
         if normalization_type is None:
@@ -3524,33 +4778,11 @@ class Dataset(object):
             da_enhance_list = []
         # Prepare the training mean image
         if meanSubstraction:  # remove mean
-
-            if data_id not in self.train_mean:
-                raise Exception('Training mean is not loaded or calculated yet for the input with data_id "' + data_id + '".')
-            train_mean = copy.copy(self.train_mean[data_id])
-            train_mean = misc.imresize(train_mean, self.img_size_crop[data_id][0:2])
-            train_mean = train_mean.astype(np.float64)
-
-            # Transpose dimensions
-            if len(self.img_size[data_id]) == 3:  # if it is a 3D image
-                # Convert RGB to BGR
-                if useBGR:
-                    if self.img_size[data_id][2] == 3:  # if has 3 channels
-                        train_mean = train_mean[:, :, ::-1]
-                if keras.backend.image_data_format() == 'channels_first':
-                    train_mean = train_mean.transpose(2, 0, 1)
-
-            # Also normalize training mean image if we are applying normalization to images
-            if normalization:
-                if normalization_type == '0-1':
-                    train_mean /= 255.0
-                elif normalization_type == '(-1)-1':
-                    train_mean /= 127.5
-                    train_mean -= 1.
+            train_mean = self.__getTrainMean(data_id, normalization, normalization_type, useBGR)
 
         nImages = len(images)
 
-        type_imgs = np.float64
+        type_imgs = self.getDtype(data_id)
         if len(self.img_size[data_id]) == 3:
             if keras.backend.image_data_format() == 'channels_first':
                 I = np.zeros([nImages] + [self.img_size_crop[data_id][2]] + self.img_size_crop[data_id][0:2], dtype=type_imgs)
@@ -3559,37 +4791,58 @@ class Dataset(object):
         else:
             I = np.zeros([nImages] + self.img_size_crop[data_id], dtype=type_imgs)
 
-        # Process each image separately
-        for i in range(nImages):
-            im = images[i]
+        # Images resized to a fixed size before any other processing are processed as a batch
+        if nImages > 0 and not loaded and ((not dataAugmentation and wo_da_patch_type == 'whole') or
+                                           (dataAugmentation and da_patch_type == 'resize_and_rndcrop')):
+            if not dataAugmentation:
+                # Use whole image
+                im = self.__loadResizedImages(images, data_id, self.img_size_crop[data_id][0:2], external,
+                                              n_threads)
+            elif data_id in self.image_shards and not da_enhance_list:
+                # Only the random crops are read from the shard
+                rows = self.image_shards[data_id].getRows(images)
+                im = self.__cropAndFlipImages(self.image_shards[data_id].data, rows, images, data_id, daRandomParams)
+            else:
+                im = self.__loadResizedImages(images, data_id, self.img_size[data_id][0:2], external,
+                                              n_threads)
+                im = self.__enhanceImages(im, da_enhance_list)
+                im = self.__cropAndFlipImages(im, np.arange(nImages), images, data_id, daRandomParams)
+            im = im.astype(type_imgs)
 
-            if not loaded:
-                if not external:
-                    im = self.path + '/' + im
+            # Normalize
+            if normalization:
+                if normalization_type == '0-1':
+                    im /= 255.0
+                elif normalization_type == '(-1)-1':
+                    im /= 127.5
+                    im -= 1.
+                elif normalization_type == 'inception':
+                    im /= 255.
+                    im -= 0.5
+                    im *= 2.
 
-                # Check if the filename includes the extension
-                [path, filename] = ntpath.split(im)
-                [filename, ext] = os.path.splitext(filename)
+            # Permute dimensions
+            if len(self.img_size[data_id]) == 3:
+                # Convert RGB to BGR
+                if useBGR:
+                    if self.img_size[data_id][2] == 3:  # if has 3 channels
+                        im = im[:, :, :, ::-1]
+                if keras.backend.image_data_format() == 'channels_first':
+                    im = im.transpose(0, 3, 1, 2)
 
-                # If it doesn't then we find it
-                if not ext:
-                    filename = fnmatch.filter(os.listdir(path), filename + '*')
-                    if not filename:
-                        raise Exception('Non existent image ' + im)
-                    else:
-                        im = path + '/' + filename[0]
-                imname = im
+            # Substract training images mean
+            if meanSubstraction:  # remove mean
+                im = im - train_mean
 
-                # Read image
-                try:
-                    logging.disable(logging.CRITICAL)
-                    im = pilimage.open(im)
-                    logging.disable(logging.NOTSET)
+            I[:] = im.reshape(I.shape)
+            return I
 
-                except Exception:
-                    logger.warning("WARNING!")
-                    logger.warning("Can't load image " + im)
-                    im = np.zeros(tuple(self.img_size[data_id]))
+        # Process each image separately
+        for i in range(nImages):
+            im = images[i]
+
+            if not loaded:
+                im, imname, _ = self.__readImage(im, data_id, external)
 
             # Convert to RGB
             if not type(im).__module__ == np.__name__:
@@ -3617,7 +4870,7 @@ class Dataset(object):
                         im = im[centerw - halfw:centerw + halfw + 1, centerh - halfh:centerh + halfh + 1, :]
                 elif wo_da_patch_type == 'whole':
                     # Use whole image
-                    im = misc.imresize(im, (self.img_size_crop[data_id][0], self.img_size_crop[data_id][1]))
+                    im = resize_image(im, self.img_size_crop[data_id][0:2])
                     im = np.asarray(im, dtype=type_imgs)
 
                 if not self.use_RGB[data_id]:
@@ -3627,15 +4880,10 @@ class Dataset(object):
                 # TODO:
                 # da_patch_type: resize_and_rndcrop, rndcrop_and_resize, resizekp_and_rndcrop.
                 # da_enhance_list: brightness, color, sharpness, contrast.
-                min_value_enhance = 0.25
-                im = pilimage.fromarray(im.astype(np.uint8))
-                image_enhance_dict = {'brightness': 'ImageEnhance.Brightness(im)', 'color': 'ImageEnhance.Color(im)',
-                                      'sharpness': 'ImageEnhance.Sharpness(im)',
-                                      'contrast': 'ImageEnhance.Contrast(im)'}
-
-                for da_enhance in da_enhance_list:
-                    image_enhance = eval(image_enhance_dict[da_enhance])
-                    im = image_enhance.enhance((1 - min_value_enhance) + np.random.rand() * min_value_enhance * 2)
+                im = im.astype(np.uint8)
+                if da_enhance_list:
+                    im = self.__enhanceImages(im.reshape((1,) + im.shape[0:2] + (-1,)), da_enhance_list).reshape(im.shape)
+                im = pilimage.fromarray(im)
 
                 randomParams = daRandomParams[images[i]]
 
@@ -3696,7 +4944,7 @@ class Dataset(object):
                         im = im[iw:fw, ih:fh]
                 elif da_patch_type == 'resize_and_rndcrop':
                     # Resize
-                    im = misc.imresize(im, (self.img_size[data_id][0], self.img_size[data_id][1]))
+                    im = resize_image(im, self.img_size[data_id][0:2])
                     im = np.asarray(im, dtype=type_imgs)
                     if not self.use_RGB[data_id]:
                         im = np.expand_dims(im, 2)
@@ -3756,6 +5004,283 @@ class Dataset(object):
 
         return I
 
+    def __resolvePaths(self, names):
+        """
+        Finds the files of the image paths (relative to self.path) without extension, scanning each directory once.
+        The found files are stored in self.resolved_paths and used by the image loaders.
+
+        :param names: List of image paths.
+        """
+        stems = defaultdict(list)
+        for name in names:
+            im = self.path + '/' + name
+            [path, filename] = ntpath.split(im)
+            [filename, ext] = os.path.splitext(filename)
+            if not ext and im not in self.resolved_paths:
+                stems[path].append((im, filename))
+
+        for path, path_stems in iteritems(stems):
+            try:
+                files = os.listdir(path)
+            except OSError:
+                continue  # Missing directories are reported when loading the images
+            # Files sorted by name (to find the ones starting with each stem) and their position in the listing
+            order = sorted(range(len(files)), key=files.__getitem__)
+            sorted_files = [files[f] for f in order]
+            for im, filename in path_stems:
+                first = None
+                for f in range(bisect.bisect_left(sorted_files, filename), len(sorted_files)):
+                    if not sorted_files[f].startswith(filename):
+                        break
+                    if first is None or order[f] < first:
+                        first = order[f]
+                if first is not None:
+                    self.resolved_paths[im] = path + '/' + files[first]
+
+        if stems and not self.silence:
+            logger.info('Found the files of ' + str(len(self.resolved_paths)) + ' paths without extension.')
+
+    def __getImagePath(self, image, external=False):
+        """
+        Gets the path to the file of an image, finding its extension if it is not given
+        (see self.__resolvePaths, the directory is only scanned if the file was not found before).
+
+        :param image: Image path (relative to self.path, unless external).
+        :param external: Whether the image path is absolute.
+        :return: Path to the image file.
+        """
+        im = image if external else self.path + '/' + image
+
+        # Check if the filename includes the extension
+        [path, filename] = ntpath.split(im)
+        [filename, ext] = os.path.splitext(filename)
+        if ext:
+            return im
+
+        resolved = self.resolved_paths.get(im)
+        if resolved is None or not os.path.isfile(resolved):
+            # If it doesn't then we find it
+            filename = fnmatch.filter(os.listdir(path), filename + '*')
+            if not filename:
+                raise Exception('Non existent image ' + im)
+            resolved = path + '/' + filename[0]
+            self.resolved_paths[im] = resolved
+        return resolved
+
+    def __getTrainMean(self, data_id, normalization, normalization_type, useBGR):
+        """
+        Gets the training mean image of a 'raw-image' input, resized, permuted and normalized as the loaded images.
+        It is prepared once (for each configuration) and kept (not pickled) for the next batches.
+
+        :param data_id: Identifier of the 'raw-image' input.
+        :param normalization: Whether we normalize the images.
+        :param normalization_type: Normalization applied to the images.
+        :param useBGR: Whether the images are converted to BGR.
+        :return: Training mean image.
+        """
+        import keras
+
+        if data_id not in self.train_mean:
+            raise Exception('Training mean is not loaded or calculated yet for the input with data_id "' + data_id + '".')
+
+        key = (data_id, tuple(self.img_size[data_id]), tuple(self.img_size_crop[data_id]),
+               keras.backend.image_data_format(), normalization, normalization_type, useBGR, self.getDtype(data_id).name)
+        if not hasattr(self, '_train_mean_cache'):
+            self._train_mean_cache = dict()
+        source, train_mean = self._train_mean_cache.get(key, (None, None))
+        # The cached mean is only valid if it was prepared from the current training mean
+        if source is self.train_mean[data_id]:
+            return train_mean
+
+        train_mean = np.array(self.train_mean[data_id], dtype=np.float64)
+        if train_mean.ndim == 1:  # mean of each channel
+            train_mean = np.zeros(tuple(self.img_size_crop[data_id]), dtype=np.float64) + train_mean
+        if list(train_mean.shape[0:2]) != list(self.img_size_crop[data_id][0:2]):
+            if train_mean.ndim == 3:
+                train_mean = resize_maps(train_mean.transpose(2, 0, 1), self.img_size_crop[data_id][0:2])
+                train_mean = train_mean.transpose(1, 2, 0)
+            else:
+                train_mean = resize_maps(train_mean, self.img_size_crop[data_id][0:2])
+            train_mean = train_mean.astype(np.float64)
+
+        # Transpose dimensions
+        if len(self.img_size[data_id]) == 3:  # if it is a 3D image
+            # Convert RGB to BGR
+            if useBGR:
+                if self.img_size[data_id][2] == 3:  # if has 3 channels
+                    train_mean = train_mean[:, :, ::-1]
+            if keras.backend.image_data_format() == 'channels_first':
+                train_mean = train_mean.transpose(2, 0, 1)
+
+        # Also normalize training mean image if we are applying normalization to images
+        if normalization:
+            if normalization_type == '0-1':
+                train_mean /= 255.0
+            elif normalization_type == '(-1)-1':
+                train_mean /= 127.5
+                train_mean -= 1.
+
+        train_mean = np.ascontiguousarray(train_mean, dtype=self.getDtype(data_id))
+        self._train_mean_cache[key] = (self.train_mean[data_id], train_mean)
+        return train_mean
+
+    def __readImage(self, image, data_id, external=False, draft_size=None):
+        """
+        Reads an image file.
+
+        :param image: Image name (as stored in the Dataset) or absolute path (if external).
+        :param data_id: Identifier of the 'raw-image' input.
+        :param external: Whether the image name is an absolute path.
+        :param draft_size: If given, JPEGs are decoded at the lowest reduced resolution which is not smaller than
+                           draft_size (height, width).
+        :return: Tuple with the image (as a float64 array), its path and whether it was successfully read.
+        """
+        from PIL import Image as pilimage
+
+        im = self.__getImagePath(image, external)
+        imname = im
+
+        # Read image
+        try:
+            logging.disable(logging.CRITICAL)
+            im = pilimage.open(im)
+        except Exception:
+            logger.warning("WARNING!")
+            logger.warning("Can't load image " + im)
+            return np.zeros(tuple(self.img_size[data_id])), imname, False
+        finally:
+            logging.disable(logging.NOTSET)
+
+        if draft_size is not None:
+            im.draft('RGB' if self.use_RGB[data_id] else 'L', (draft_size[1], draft_size[0]))
+
+        # Convert to RGB
+        if self.use_RGB[data_id]:
+            im = im.convert('RGB')
+        else:
+            im = im.convert('L')
+        return np.asarray(im, dtype=np.float64), imname, True
+
+    def __loadResizedImages(self, images, data_id, size, external=False, n_threads=None):
+        """
+        Loads a batch of images resized to a fixed size. Images are read from the shard of the input (if any),
+        the image cache (if enabled) or the image files.
+
+        :param images: List of image names.
+        :param data_id: Identifier of the 'raw-image' input.
+        :param size: (height, width) of the resized images.
+        :param external: Whether the image names are absolute paths.
+        :param n_threads: Number of threads decoding the images. If None, self.image_decoding_threads.
+        :return: uint8 array with shape (n_images, height, width, channels)
+        """
+        size = list(size)
+        if n_threads is None:
+            n_threads = self.image_decoding_threads
+        draft_size = size if self.image_decoding_draft else None
+
+        def loadResizedImage(image):
+            im = None
+            if self.image_cache is not None:
+                cache_key = (image if external else self.path + '/' + image, tuple(size),
+                             self.use_RGB[data_id], self.image_decoding_draft)
+                im = self.image_cache.get(cache_key)
+            if im is None:
+                im, _, read = self.__readImage(image, data_id, external, draft_size)
+                im = resize_image(im, size)
+                if read and self.image_cache is not None:
+                    self.image_cache.put(cache_key, im)
+            return im
+
+        if data_id in self.image_shards:
+            rows = self.image_shards[data_id].getRows(images)
+            batch = self.image_shards[data_id].data[rows]
+            if list(batch.shape[1:3]) != size:
+                batch = np.asarray([resize_image(im, size) for im in batch], dtype=np.uint8)
+        elif n_threads > 1 and len(images) > 1:
+            batch = np.asarray(self.__getDecodingPool(n_threads).map(loadResizedImage, images), dtype=np.uint8)
+        else:
+            batch = np.asarray([loadResizedImage(image) for image in images], dtype=np.uint8)
+        if batch.ndim == 3:
+            batch = batch[:, :, :, None]
+        return batch
+
+    def __cropAndFlipImages(self, data, rows, images, data_id, daRandomParams):
+        """
+        Takes the random crops and flips of a batch of images (as da_patch_type='resize_and_rndcrop').
+        Crops and flips are applied by indexing, so only the cropped pixels are read
+        (e.g. from a memory-mapped image shard).
+
+        :param data: uint8 array of images with shape (n, height, width[, channels]), with height and width = img_size.
+        :param rows: Rows of data storing the images of the batch.
+        :param images: List of image names of the batch.
+        :param data_id: Identifier of the 'raw-image' input.
+        :param daRandomParams: dictionary with results of random data augmentation provided by
+                               self.getDataAugmentationRandomParams()
+        :return: uint8 array with shape (n_images, height_crop, width_crop, channels)
+        """
+        crop_size = self.img_size_crop[data_id][0:2]
+        # Row and column indices of each random crop (reversed if flipped)
+        left = np.array([daRandomParams[image]['left'] for image in images], dtype='int64')
+        ys = left[:, 0:1] + np.arange(crop_size[0])[None, :]
+        xs = left[:, 1:2] + np.arange(crop_size[1])[None, :]
+        hflip = np.array([daRandomParams[image]['hflip'] < daRandomParams[image]['prob_flip_horizontal']
+                          for image in images], dtype=bool)
+        vflip = np.array([daRandomParams[image]['vflip'] < daRandomParams[image]['prob_flip_vertical']
+                          for image in images], dtype=bool)
+        xs[hflip] = xs[hflip, ::-1]
+        ys[vflip] = ys[vflip, ::-1]
+        batch = data[np.asarray(rows)[:, None, None], ys[:, :, None], xs[:, None, :]]
+        if batch.ndim == 3:
+            batch = batch[:, :, :, None]
+        return batch
+
+    @staticmethod
+    def __enhanceImages(batch, da_enhance_list, min_value_enhance=0.25):
+        """
+        Randomly enhances a batch of images, as PIL.ImageEnhance does, with an enhancement factor in
+        [1 - min_value_enhance, 1 + min_value_enhance] for each image and enhancement.
+
+        :param batch: uint8 array with shape (n_images, height, width, channels)
+        :param da_enhance_list: Enhancements applied, in order: 'brightness', 'color', 'sharpness' or 'contrast'.
+        :param min_value_enhance: Maximum deviation of the enhancement factors.
+        :return: uint8 array with the enhanced images.
+        """
+        if not da_enhance_list:
+            return batch
+        factors = (1 - min_value_enhance) + np.random.rand(len(batch), len(da_enhance_list)) * min_value_enhance * 2
+        factors = factors.astype(np.float32).reshape(len(batch), len(da_enhance_list), 1, 1, 1)
+        for e, da_enhance in enumerate(da_enhance_list):
+            images = batch.astype(np.float32)
+            # Degenerate images, which are interpolated (or extrapolated) with the original ones
+            if da_enhance == 'brightness':
+                degenerate = np.zeros_like(images)
+            elif da_enhance in ['color', 'contrast']:
+                if batch.shape[3] == 3:
+                    # PIL's RGB to L conversion
+                    gray = (batch[:, :, :, 0].astype(np.int64) * 19595 + batch[:, :, :, 1].astype(np.int64) * 38470 +
+                            batch[:, :, :, 2].astype(np.int64) * 7471 + 0x8000) >> 16
+                else:
+                    gray = batch[:, :, :, 0].astype(np.int64)
+                if da_enhance == 'color':
+                    degenerate = gray[:, :, :, None].astype(np.float32)
+                else:
+                    degenerate = np.floor(gray.mean(axis=(1, 2)) + 0.5).astype(np.float32).reshape(-1, 1, 1, 1)
+            elif da_enhance == 'sharpness':
+                # Smoothed images (3x3 kernel, borders are kept)
+                degenerate = images.copy()
+                kernel = [[1, 1, 1], [1, 5, 1], [1, 1, 1]]
+                height, width = batch.shape[1:3]
+                smoothed = np.zeros_like(images[:, 1:-1, 1:-1])
+                for dy in range(3):
+                    for dx in range(3):
+                        smoothed += kernel[dy][dx] * images[:, dy:dy + height - 2, dx:dx + width - 2]
+                degenerate[:, 1:-1, 1:-1] = np.clip(np.floor(smoothed / 13. + 0.5), 0, 255)
+            else:
+                raise NotImplementedError('The enhancement "' + str(da_enhance) + '" is not implemented.')
+            images = degenerate + factors[:, e] * (images - degenerate)
+            batch = np.clip(images, 0, 255).astype(np.uint8)
+        return batch
+
     def getResizeImageWODistorsion(self, image, data_id):
         w, h = np.shape(image)[0:2]
         if w < h and (w < self.img_size_crop[data_id][0] or h > self.img_size[data_id][1]):
@@ -3788,28 +5313,19 @@ class Dataset(object):
 
     def getDataAugmentationRandomParams(self, images, data_id, prob_flip_horizontal=0.5, prob_flip_vertical=0.0):
         daRandomParams = dict()
+        margin = [self.img_size[data_id][0] - self.img_size_crop[data_id][0],
+                  self.img_size[data_id][1] - self.img_size_crop[data_id][1]]
+        # Randomly flip (with a certain probability)
+        flips = np.random.rand(len(images), 2)
         for i, image in enumerate(images):
             # Random crop
-            margin = [self.img_size[data_id][0] - self.img_size_crop[data_id][0],
-                      self.img_size[data_id][1] - self.img_size_crop[data_id][1]]
-
-            if margin[0] > 0:
-                left = random.sample([k_ for k_ in range(margin[0])], 1)
-            else:
-                left = [0]
-            if margin[1] > 0:
-                left += random.sample([k for k in range(margin[1])], 1)
-            else:
-                left += [0]
-
-            # Randomly flip (with a certain probability)
-            hflip = np.random.rand()
-            vflip = np.random.rand()
+            left = [random.randrange(margin[0]) if margin[0] > 0 else 0,
+                    random.randrange(margin[1]) if margin[1] > 0 else 0]
 
             randomParams = dict()
             randomParams["left"] = left
-            randomParams["hflip"] = hflip
-            randomParams["vflip"] = vflip
+            randomParams["hflip"] = flips[i, 0]
+            randomParams["vflip"] = flips[i, 1]
             randomParams["prob_flip_horizontal"] = prob_flip_horizontal
             randomParams["prob_flip_vertical"] = prob_flip_vertical
 
@@ -3828,6 +5344,17 @@ class Dataset(object):
     #           [X,Y] pairs or X only
     # ------------------------------------------------------- #
 
+    def getSplitSamples(self, set_name, data_id, kind='Y'):
+        """
+        Gets all the (unprocessed) samples of an input or output of the set split, as they are seen by the getters,
+        i.e. taking into account the shuffling, selection and repetition of the samples.
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_id: Input or output identifier.
+        :param kind: 'X' (input) or 'Y' (output).
+        :return: List (or RaggedArray) of samples.
+        """
+        return self.__getSamples(set_name, data_id, kind, slice(0, getattr(self, 'len_' + set_name)))
+
     def getX(self, set_name, init, final, normalization_type='(-1)-1',
              normalization=False, meanSubstraction=False,
              dataAugmentation=False,
@@ -3871,14 +5398,14 @@ class Dataset(object):
             ghost_x = False
             if id_in in self.optional_inputs:
                 try:
-                    x = getattr(self, 'X_' + set_name)[id_in][init:final]
+                    x = self.__getSamples(set_name, id_in, 'X', slice(init, final))
                     if len(x) != (final - init):
                         raise AssertionError('Retrieved a wrong number of samples.')
                 except Exception:
                     x = [[]] * (final - init)
                     ghost_x = True
             else:
-                x = getattr(self, 'X_' + set_name)[id_in][init:final]
+                x = self.__getSamples(set_name, id_in, 'X', slice(init, final))
 
             if not get_only_ids and not ghost_x:
                 if type_in == 'text-features':
@@ -3892,7 +5419,8 @@ class Dataset(object):
                                           self.features_lengths[id_in],
                                           normalization_type,
                                           normalization,
-                                          data_augmentation=dataAugmentation)
+                                          data_augmentation=dataAugmentation,
+                                          data_id=id_in)
                 elif type_in == 'video-features':
                     x = self.loadVideoFeatures(x,
                                                id_in,
@@ -3920,7 +5448,7 @@ class Dataset(object):
                 elif type_in == 'video':
                     x = self.loadVideos(x,
                                         id_in,
-                                        final,
+                                        init,
                                         set_name,
                                         self.max_video_len[id_in],
                                         normalization_type,
@@ -3972,7 +5500,7 @@ class Dataset(object):
         for id_out in list(self.ids_outputs):
             types_index = self.ids_outputs.index(id_out)
             type_out = self.types_outputs[set_name][types_index]
-            y = getattr(self, 'Y_' + set_name)[id_out][init:final]
+            y = self.__getSamples(set_name, id_out, 'Y', slice(init, final))
             # Pre-process outputs
             if not get_only_ids:
                 if type_out == 'categorical':
@@ -3985,7 +5513,7 @@ class Dataset(object):
                 elif type_out == '3DLabel':
                     nClasses = len(self.classes[id_out])
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = getattr(self, 'Y_' + set_name)[assoc_id_in][init:final]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', slice(init, final))
 
                     y = self.load3DLabels(y,
                                           nClasses,
@@ -3998,7 +5526,7 @@ class Dataset(object):
                     nClasses = len(self.classes[id_out])
                     classes_to_colour = self.semantic_classes[id_out]
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = getattr(self, 'Y_' + set_name)[assoc_id_in][init:final]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', slice(init, final))
                     y = self.load3DSemanticLabels(y,
                                                   nClasses,
                                                   classes_to_colour,
@@ -4074,6 +5602,10 @@ class Dataset(object):
             da_enhance_list = []
 
         [new_last, last, surpassed] = self.__getNextSamples(k, set_name)
+        if surpassed:
+            positions = list(range(last, getattr(self, 'len_' + set_name))) + list(range(0, new_last))
+        else:
+            positions = slice(last, new_last)
 
         # Recover input samples
         X = []
@@ -4083,17 +5615,11 @@ class Dataset(object):
             type_in = self.types_inputs[set_name][types_index]
             if id_in in self.optional_inputs:
                 try:
-                    if surpassed:
-                        x = getattr(self, 'X_' + set_name)[id_in][last:] + getattr(self, 'X_' + set_name)[id_in][0:new_last]
-                    else:
-                        x = getattr(self, 'X_' + set_name)[id_in][last:new_last]
+                    x = self.__getSamples(set_name, id_in, 'X', positions)
                 except Exception:
                     x = []
             else:
-                if surpassed:
-                    x = getattr(self, 'X_' + set_name)[id_in][last:] + getattr(self, 'X_' + set_name)[id_in][0:new_last]
-                else:
-                    x = getattr(self, 'X_' + set_name)[id_in][last:new_last]
+                x = self.__getSamples(set_name, id_in, 'X', positions)
 
             # Pre-process inputs
             if not get_only_ids:
@@ -4108,7 +5634,8 @@ class Dataset(object):
                                           self.features_lengths[id_in],
                                           normalization_type,
                                           normalization,
-                                          data_augmentation=dataAugmentation)
+                                          data_augmentation=dataAugmentation,
+                                          data_id=id_in)
                 elif type_in == 'video-features':
                     x = self.loadVideoFeatures(x,
                                                id_in,
@@ -4167,11 +5694,7 @@ class Dataset(object):
         for id_out in list(self.ids_outputs):
             types_index = self.ids_outputs.index(id_out)
             type_out = self.types_outputs[set_name][types_index]
-            if surpassed:
-                y = getattr(self, 'Y_' + set_name)[id_out][last:] + getattr(self, 'Y_' + set_name)[id_out][0:new_last]
-
-            else:
-                y = getattr(self, 'Y_' + set_name)[id_out][last:new_last]
+            y = self.__getSamples(set_name, id_out, 'Y', positions)
 
             # Pre-process outputs
             if not get_only_ids:
@@ -4188,11 +5711,7 @@ class Dataset(object):
                 elif type_out == '3DLabel':
                     nClasses = len(self.classes[id_out])
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    if surpassed:
-                        imlist = getattr(self, 'X_' + set_name)[assoc_id_in][last:] + getattr(self, 'X_' + set_name)[assoc_id_in][0:new_last]
-
-                    else:
-                        imlist = getattr(self, 'X_' + set_name)[assoc_id_in][last:new_last]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', positions)
 
                     y = self.load3DLabels(y,
                                           nClasses,
@@ -4205,10 +5724,7 @@ class Dataset(object):
                     nClasses = len(self.classes[id_out])
                     classes_to_colour = self.semantic_classes[id_out]
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    if surpassed:
-                        imlist = getattr(self, 'X_' + set_name)[assoc_id_in][last:] + getattr(self, 'X_' + set_name)[assoc_id_in][0:new_last]
-                    else:
-                        imlist = getattr(self, 'X_' + set_name)[assoc_id_in][last:new_last]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', positions)
 
                     y = self.load3DSemanticLabels(y,
                                                   nClasses,
@@ -4251,10 +5767,8 @@ class Dataset(object):
                                       self.words_so_far[id_out],
                                       loading_X=False)
 
-                    if self.label_smoothing[id_out][set_name] > 0.:
-                        y[0] = self.apply_label_smoothing(y[0],
-                                                          self.label_smoothing[id_out][set_name],
-                                                          self.vocabulary_len[id_out])
+                    # Label smoothing of sparse targets must be applied in the loss
+                    # (see cnn_model.sparse_categorical_crossentropy_smoothed)
                     y = (y[0][:, :, None], y[1])
 
             Y.append(y)
@@ -4300,13 +5814,13 @@ class Dataset(object):
             ghost_x = False
             if id_in in self.optional_inputs:
                 try:
-                    x = [getattr(self, 'X_' + set_name)[id_in][index] for index in k]
+                    x = self.__getSamples(set_name, id_in, 'X', k)
 
                 except Exception:
                     x = [[]] * len(k)
                     ghost_x = True
             else:
-                x = [getattr(self, 'X_' + set_name)[id_in][index] for index in k]
+                x = self.__getSamples(set_name, id_in, 'X', k)
 
             # Pre-process inputs
             if not get_only_ids and not ghost_x:
@@ -4320,7 +5834,8 @@ class Dataset(object):
                                           self.features_lengths[id_in],
                                           normalization_type,
                                           normalization,
-                                          data_augmentation=dataAugmentation)
+                                          data_augmentation=dataAugmentation,
+                                          data_id=id_in)
                 elif type_in == 'video-features':
                     x = self.loadVideoFeatures(x,
                                                id_in,
@@ -4381,7 +5896,7 @@ class Dataset(object):
             types_index = self.ids_outputs.index(id_out)
             type_out = self.types_outputs[set_name][types_index]
 
-            y = [getattr(self, 'Y_' + set_name)[id_out][index] for index in k]
+            y = self.__getSamples(set_name, id_out, 'Y', k)
 
             # Pre-process outputs
             if not get_only_ids:
@@ -4395,7 +5910,7 @@ class Dataset(object):
                 elif type_out == '3DLabel':
                     nClasses = len(self.classes[id_out])
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = [getattr(self, 'X_' + set_name)[assoc_id_in][index] for index in k]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', k)
 
                     y = self.load3DLabels(y, nClasses, dataAugmentation, daRandomParams,
                                           self.img_size[assoc_id_in], self.img_size_crop[assoc_id_in],
@@ -4404,7 +5919,7 @@ class Dataset(object):
                     nClasses = len(self.classes[id_out])
                     classes_to_colour = self.semantic_classes[id_out]
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = [getattr(self, 'X_' + set_name)[assoc_id_in][index] for index in k]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', k)
                     y = self.load3DSemanticLabels(y, nClasses, classes_to_colour, dataAugmentation, daRandomParams,
                                                   self.img_size[assoc_id_in], self.img_size_crop[assoc_id_in],
                                                   imlist)
@@ -4441,10 +5956,8 @@ class Dataset(object):
                                       self.words_so_far[id_out],
                                       loading_X=False)
 
-                    if self.label_smoothing[id_out][set_name] > 0.:
-                        y[0] = self.apply_label_smoothing(y[0],
-                                                          self.label_smoothing[id_out][set_name],
-                                                          self.vocabulary_len[id_out])
+                    # Label smoothing of sparse targets must be applied in the loss
+                    # (see cnn_model.sparse_categorical_crossentropy_smoothed)
                     y = (y[0][:, :, None], y[1])
 
             Y.append(y)
@@ -4487,12 +6000,12 @@ class Dataset(object):
             ghost_x = False
             if id_in in self.optional_inputs:
                 try:
-                    x = [getattr(self, 'X_' + set_name)[id_in][index] for index in k]
+                    x = self.__getSamples(set_name, id_in, 'X', k)
                 except Exception:
                     x = [[]] * len(k)
                     ghost_x = True
             else:
-                x = [getattr(self, 'X_' + set_name)[id_in][index] for index in k]
+                x = self.__getSamples(set_name, id_in, 'X', k)
 
             # Pre-process inputs
             if not get_only_ids and not ghost_x:
@@ -4506,7 +6019,8 @@ class Dataset(object):
                                           self.features_lengths[id_in],
                                           normalization_type,
                                           normalization,
-                                          data_augmentation=dataAugmentation)
+                                          data_augmentation=dataAugmentation,
+                                          data_id=id_in)
                 elif type_in == 'video-features':
                     x = self.loadVideoFeatures(x,
                                                id_in,
@@ -4595,7 +6109,7 @@ class Dataset(object):
             types_index = self.ids_outputs.index(id_out)
             type_out = self.types_outputs[set_name][types_index]
 
-            y = [getattr(self, 'Y_' + set_name)[id_out][index] for index in k]
+            y = self.__getSamples(set_name, id_out, 'Y', k)
 
             # Pre-process outputs
             if not get_only_ids:
@@ -4609,7 +6123,7 @@ class Dataset(object):
                 elif type_out == '3DLabel':
                     nClasses = len(self.classes[id_out])
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = [getattr(self, 'X_' + set_name)[assoc_id_in][index] for index in k]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', k)
 
                     y = self.load3DLabels(y, nClasses, dataAugmentation, daRandomParams,
                                           self.img_size[assoc_id_in], self.img_size_crop[assoc_id_in],
@@ -4618,7 +6132,7 @@ class Dataset(object):
                     nClasses = len(self.classes[id_out])
                     classes_to_colour = self.semantic_classes[id_out]
                     assoc_id_in = self.id_in_3DLabel[id_out]
-                    imlist = [getattr(self, 'X_' + set_name)[assoc_id_in][index] for index in k]
+                    imlist = self.__getSamples(set_name, assoc_id_in, 'X', k)
                     y = self.load3DSemanticLabels(y, nClasses, classes_to_colour, dataAugmentation, daRandomParams,
                                                   self.img_size[assoc_id_in], self.img_size_crop[assoc_id_in],
                                                   imlist)
@@ -4656,15 +6170,94 @@ class Dataset(object):
                                       self.words_so_far[id_out],
                                       loading_X=False)
 
-                    if self.label_smoothing[id_out][set_name] > 0.:
-                        y[0] = self.apply_label_smoothing(y[0],
-                                                          self.label_smoothing[id_out][set_name],
-                                                          self.vocabulary_len[id_out])
+                    # Label smoothing of sparse targets must be applied in the loss
+                    # (see cnn_model.sparse_categorical_crossentropy_smoothed)
                     y = (y[0][:, :, None], y[1]) if return_mask else y[0][:, :, None]
 
             Y.append(y)
         return Y
 
+    def getBatchIndices(self, set_name, batch_index, batch_size, epoch_seed=None, init_sample=0, final_sample=-1):
+        """
+        Gets the positions of the samples of a batch. It does not depend on the state of the dataset (counters), so it
+        can be called concurrently for any batch.
+        :param set_name: 'train', 'val' or 'test' set
+        :param batch_index: Index of the batch
+        :param batch_size: Number of samples of each batch (the last batch may be smaller)
+        :param epoch_seed: If not None, the samples are shuffled with a permutation which only depends on this seed
+        :param init_sample: First position of the batched samples
+        :param final_sample: Last position (not included) of the batched samples. If -1, the length of the set
+        :return: Array with the positions of the samples of the batch in the set
+        """
+        self.__checkSetName(set_name)
+        if final_sample == -1:
+            final_sample = getattr(self, 'len_' + set_name)
+        n_samples = final_sample - init_sample
+        first = batch_index * batch_size
+        if batch_index < 0 or first >= n_samples:
+            raise Exception('The batch ' + str(batch_index) + ' is out of the ' + set_name + ' set (' +
+                            str(n_samples) + ' samples in batches of ' + str(batch_size) + ').')
+        last = min(first + batch_size, n_samples)
+        if epoch_seed is None:
+            return np.arange(init_sample + first, init_sample + last)
+        key = (set_name, epoch_seed, init_sample, n_samples)
+        permutation_key, permutation = getattr(self, '_batch_permutation', (None, None))
+        if permutation_key != key:
+            permutation = np.random.RandomState(epoch_seed).permutation(n_samples) + init_sample
+            self._batch_permutation = (key, permutation)
+        return permutation[first:last]
+
+    def getXY_FromBatch(self, set_name, batch_index, batch_size, epoch_seed=None, normalization_type='(-1)-1',
+                        normalization=False, meanSubstraction=False,
+                        dataAugmentation=False,
+                        wo_da_patch_type='whole', da_patch_type='resize_and_rndcrop', da_enhance_list=None):
+        """
+        Gets the [X,Y] pairs of a batch of the desired set (see getBatchIndices). Unlike getXY, it does not modify the
+        state of the dataset.
+        :param set_name: 'train', 'val' or 'test' set
+        :param batch_index: Index of the batch
+        :param batch_size: Number of samples of each batch
+        :param epoch_seed: If not None, seed of the shuffling of the samples
+        See getXY_FromIndices for the rest of parameters.
+        :return: [X,Y], list of input and output data variables of the samples of the batch
+        """
+        return self.getXY_FromIndices(set_name,
+                                      self.getBatchIndices(set_name, batch_index, batch_size, epoch_seed=epoch_seed),
+                                      normalization_type=normalization_type,
+                                      normalization=normalization,
+                                      meanSubstraction=meanSubstraction,
+                                      dataAugmentation=dataAugmentation,
+                                      wo_da_patch_type=wo_da_patch_type,
+                                      da_patch_type=da_patch_type,
+                                      da_enhance_list=da_enhance_list)
+
+    def getX_FromBatch(self, set_name, batch_index, batch_size, epoch_seed=None, init_sample=0, final_sample=-1,
+                       normalization_type='(-1)-1', normalization=False, meanSubstraction=False,
+                       dataAugmentation=False,
+                       wo_da_patch_type='whole', da_patch_type='resize_and_rndcrop', da_enhance_list=None):
+        """
+        Gets the inputs of a batch of the desired set (see getBatchIndices). Unlike getX, it does not modify the
+        state of the dataset.
+        :param set_name: 'train', 'val' or 'test' set
+        :param batch_index: Index of the batch
+        :param batch_size: Number of samples of each batch
+        :param epoch_seed: If not None, seed of the shuffling of the samples
+        :param init_sample: First position of the batched samples
+        :param final_sample: Last position (not included) of the batched samples. If -1, the length of the set
+        See getX_FromIndices for the rest of parameters.
+        :return: X, list of input data variables of the samples of the batch
+        """
+        return self.getX_FromIndices(set_name,
+                                     self.getBatchIndices(set_name, batch_index, batch_size, epoch_seed=epoch_seed,
+                                                          init_sample=init_sample, final_sample=final_sample),
+                                     normalization_type=normalization_type,
+                                     normalization=normalization,
+                                     meanSubstraction=meanSubstraction,
+                                     dataAugmentation=dataAugmentation,
+                                     wo_da_patch_type=wo_da_patch_type,
+                                     da_patch_type=da_patch_type,
+                                     da_enhance_list=da_enhance_list)
+
     # ------------------------------------------------------- #
     #       AUXILIARY FUNCTIONS
     #
@@ -4737,9 +6330,9 @@ class Dataset(object):
             for id_in in self.ids_inputs:
                 if id_in not in self.optional_inputs:
                     plot_ids_in.append(id_in)
-                    lengths.append(len(getattr(self, 'X_' + set_name)[id_in]))
+                    lengths.append(self.__getNumSamples(set_name, id_in, 'X'))
             for id_out in self.ids_outputs:
-                lengths.append(len(getattr(self, 'Y_' + set_name)[id_out]))
+                lengths.append(self.__getNumSamples(set_name, id_out, 'Y'))
 
             if lengths[1:] != lengths[:-1]:
                 raise Exception('Inputs and outputs size '
@@ -4765,12 +6358,142 @@ class Dataset(object):
 
         return [new_last, last, surpassed]
 
+    def __getSamples(self, set_name, data_id, kind, k):
+        """
+        Gets the samples of an input or output in positions k of the set split, reading through the view of the split
+        and the repetition of the samples.
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_id: Input or output identifier.
+        :param kind: 'X' (input) or 'Y' (output).
+        :param k: slice or list of positions of the samples in the set split.
+        :return: Selected samples.
+        """
+        attr = kind + '_' + set_name
+        samples = getattr(self, attr)[data_id]
+        split_indices = getattr(self, 'indices_' + set_name)
+        repeat_indices = self.repeat_indices.get(attr, dict()).get(data_id)
+        if split_indices is None and repeat_indices is None:
+            if isinstance(k, slice):
+                return samples[k]
+            return self.__getSamplesFromIndices(samples, k)
+        if split_indices is not None:
+            k = split_indices[k]
+        elif isinstance(k, slice):
+            k = np.arange(*k.indices(len(repeat_indices)))
+        if repeat_indices is not None:
+            k = repeat_indices[k]
+        return self.__getSamplesFromIndices(samples, k)
+
+    def __getStoredIndices(self, set_name, data_id, kind, k):
+        """
+        Indices of the stored samples of an input or output in positions k of the set split (see __getSamples).
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_id: Input or output identifier.
+        :param kind: 'X' (input) or 'Y' (output).
+        :param k: List of positions of the samples in the set split.
+        :return: Array of indices in the stored samples.
+        """
+        k = np.asarray(k, dtype='int64')
+        split_indices = getattr(self, 'indices_' + set_name)
+        if split_indices is not None:
+            k = np.asarray(split_indices, dtype='int64')[k]
+        repeat_indices = self.repeat_indices.get(kind + '_' + set_name, dict()).get(data_id)
+        if repeat_indices is not None:
+            k = np.asarray(repeat_indices, dtype='int64')[k]
+        return k
+
+    def __getNumSamples(self, set_name, data_id, kind):
+        """
+        Number of samples of an input or output (taking into account their repetition).
+        :param set_name: 'train', 'val' or 'test'.
+        :param data_id: Input or output identifier.
+        :param kind: 'X' (input) or 'Y' (output).
+        :return: Number of samples.
+        """
+        attr = kind + '_' + set_name
+        repeat_indices = self.repeat_indices.get(attr, dict()).get(data_id)
+        if repeat_indices is not None:
+            return len(repeat_indices)
+        return len(getattr(self, attr)[data_id])
+
+    def __setRepeatIndices(self, attr, data_id, repeat_indices):
+        """
+        Stores (or removes, if repeat_indices is None) the repetition of the samples of an input or output.
+        """
+        if repeat_indices is not None:
+            self.repeat_indices.setdefault(attr, dict())[data_id] = repeat_indices
+        elif data_id in self.repeat_indices.get(attr, dict()):
+            del self.repeat_indices[attr][data_id]
+
+    def __addRepeatIndices(self, attr, data_id, n_stored, n_new, repeat_indices):
+        """
+        Updates the repetition of the samples of an input or output when n_new samples are added to the n_stored ones.
+        """
+        stored_indices = self.repeat_indices.get(attr, dict()).get(data_id)
+        if stored_indices is None and repeat_indices is None:
+            return
+        if stored_indices is None:
+            stored_indices = np.arange(n_stored)
+        if repeat_indices is None:
+            repeat_indices = np.arange(n_new)
+        self.__setRepeatIndices(attr, data_id, np.concatenate([stored_indices, repeat_indices + n_stored]))
+
+    def __setTextLengths(self, attr, data_id, data_type, samples, add_additional):
+        """
+        Stores the number of tokens of each new sample of a text input or output (see getTextLengths).
+        """
+        if data_type not in ['text', 'dense-text', 'text-features']:
+            return
+        stored_lengths = self.text_lengths.setdefault(attr, dict()).pop(data_id, None)
+        if add_additional and stored_lengths is None:
+            # Computed from all the samples when needed
+            return
+        lengths = self.__computeTextLengths(samples)
+        if add_additional:
+            lengths = np.concatenate([stored_lengths, lengths])
+        self.text_lengths[attr][data_id] = lengths
+
+    @staticmethod
+    def __computeTextLengths(samples):
+        """
+        Number of tokens of each sample (sentence, list of tokens or row of a RaggedArray).
+        """
+        if isinstance(samples, RaggedArray):
+            return samples.lengths.astype('int32')
+        return np.asarray([len(sample.strip().split(' ')) if isinstance(sample, string_types) else len(sample)
+                           for sample in samples], dtype='int32')
+
+    def __resetView(self, set_name):
+        """
+        Removes the view (shuffling, selection) of a set split.
+        """
+        if getattr(self, 'indices_' + set_name) is not None:
+            setattr(self, 'indices_' + set_name, None)
+            if not self.silence:
+                logger.info('The view of the "' + set_name + '" set has been reset.')
+
+    def __getSamplesFromIndices(self, samples, k):
+        """
+        Gathers the samples in positions k from a list (or RaggedArray) of samples.
+        :param samples: List or RaggedArray of samples.
+        :param k: Positions of the samples.
+        :return: Selected samples.
+        """
+        if isinstance(samples, RaggedArray):
+            return samples.take(k)
+        return [samples[index] for index in k]
+
     def __getstate__(self):
         """
             Behaviour applied when pickling a Dataset instance.
         """
         obj_dict = self.__dict__.copy()
         # del obj_dict['_Dataset__lock_read']
+        obj_dict.pop('_decoding_pool', None)
+        obj_dict.pop('_train_mean_cache', None)
+        obj_dict.pop('_batch_worker_pool', None)
+        obj_dict.pop('_batch_permutation', None)
+        obj_dict.pop('_frames_rows', None)
         return obj_dict
 
     def __setstate__(self, new_state):
@@ -445,17 +445,13 @@ class EvalPerformance(KerasCallback):
                                                     verbose=self.verbose)
 
                     # Prepare references
-                    # exec ("y_raw = self.ds.Y_" + s + "[gt_id]")
-                    y_split = getattr(self.ds, 'Y_' + s)
-                    y_raw = y_split[gt_id]
+                    y_raw = self.ds.getSplitSamples(s, gt_id)
                     self.extra_vars[gt_pos][s]['references'] = self.ds.loadBinary(y_raw, gt_id)
 
                 # Postprocess outputs of type 3DLabel
                 elif type_out == '3DLabel':
                     self.extra_vars[gt_pos][s] = dict()
-                    # exec ('ref=self.ds.Y_' + s + '["' + gt_id + '"]')
-                    y_split = getattr(self.ds, 'Y_' + s)
-                    ref = y_split[gt_id]
+                    ref = self.ds.getSplitSamples(s, gt_id)
                     [ref, original_sizes] = self.ds.convert_GT_3DLabels_to_bboxes(
                         ref)
                     self.extra_vars[gt_pos][s]['references'] = ref
@@ -465,9 +461,7 @@ class EvalPerformance(KerasCallback):
                 elif type_out == '3DSemanticLabel':
                     self.extra_vars[gt_pos]['eval_orig_size'] = self.eval_orig_size
                     self.extra_vars[gt_pos][s] = dict()
-                    # exec ('ref=self.ds.Y_' + s + '["' + gt_id + '"]')
-                    y_split = getattr(self.ds, 'Y_' + s)
-                    ref = y_split[gt_id]
+                    ref = self.ds.getSplitSamples(s, gt_id)
                     if self.eval_orig_size:
                         old_crop = copy.deepcopy(self.ds.img_size_crop)
                         self.ds.img_size_crop = copy.deepcopy(self.ds.img_size)
@@ -479,9 +473,7 @@ class EvalPerformance(KerasCallback):
 
                 # Other output data types
                 else:
-                    # exec ("self.extra_vars[gt_pos][s]['references'] = self.ds.Y_" + s + "[gt_id]")
-                    y_split = getattr(self.ds, 'Y_' + s)
-                    self.extra_vars[gt_pos][s]['references'] = y_split[gt_id]
+                    self.extra_vars[gt_pos][s]['references'] = self.ds.getSplitSamples(s, gt_id)
                 # Store predictions
                 if self.write_samples:
                     # Store result
@@ -490,9 +482,7 @@ class EvalPerformance(KerasCallback):
                         list2file(filepath, predictions)
                     elif write_type == 'vqa':
                         try:
-                            # exec ('refs = self.ds.Y_' + s + '[gt_id]')
-                            y_split = getattr(self.ds, 'Y_' + s)
-                            refs = y_split[gt_id]
+                            refs = self.ds.getSplitSamples(s, gt_id)
                         except Exception:
                             refs = ['N/A' for _ in range(probs.shape[0])]
                         extra_data_plot = {'reference': refs,
@@ -513,7 +503,7 @@ class EvalPerformance(KerasCallback):
                             epoch)  # results folder
                         numpy2imgs(folder_path,
                                    predictions,
-                                   eval('self.ds.X_' + s + '["' + self.input_id + '"]'),
+                                   self.ds.getSplitSamples(s, self.input_id, 'X'),
                                    self.ds)
                     else:
                         raise NotImplementedError('The store type "' + self.write_type + '" is not implemented.')
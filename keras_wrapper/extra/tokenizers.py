@@ -2,6 +2,53 @@
 import re
 import sys
 
+# Punctuation split (tokenize_basic) or removed (tokenize_aggressive)
+_PUNCTUATION = [u'.', u';', u',', u'，', u"/", u'[', u']', u'"', u'{', u'}', u'(', u')', u'=', u'+', u'\\', u'_',
+                u'-', u'>', u'<', u'@', u'`', u'¿', u'?', u'¡', u'!']
+_BASIC_REPLACEMENTS = [(u'\n', u' '), (u'\t', u' ')] + [(p, u' ' + p + u' ') for p in _PUNCTUATION]
+_AGGRESSIVE_REPLACEMENTS = [(p, u'') for p in _PUNCTUATION]
+_SPACES = re.compile(u' {2,}')
+_NEWLINES_TABS = re.compile(u'[\n\t]+')
+# Runs of the symbols split by tokenize_soft (each run is replaced by a single symbol surrounded by spaces)
+_SOFT_SYMBOLS = re.compile(u'([.,!?{}()\\[\\]"\'])\\1*')
+_MONTREAL_REMOVED = re.compile('[.,"\n\t]+')
+_MONTREAL_QUOTES = re.compile('[\']+')
+_CNN_REMOVED = re.compile(r"[^A-Za-z0-9(),!?\'\`]")
+_CNN_CONTRACTIONS = re.compile(r"(\'s|\'ve|n\'t|\'re|\'d|\'ll)")
+_CNN_REPLACEMENTS = [(u',', u' , '), (u'!', u' ! '), (u'(', u' \\( '), (u')', u' \\) '), (u'?', u' \\? ')]
+_CNN_SPACES = re.compile(r"\s{2,}")
+# Separator of the sentences joined by the batch tokenizers (it is not modified by any of the tokenizers)
+_BATCH_SEPARATOR = u'\x00'
+
+
+def _to_unicode(caption):
+    if isinstance(caption, str) and sys.version_info < (3, 0):
+        caption = caption.decode('utf-8')
+    return caption
+
+
+def _replace_all(text, replacements):
+    """
+    Applies a list of replacements (in order) to a text. Strings not present in the text are skipped,
+    which is faster than calling str.replace on each of them.
+    """
+    for old, new in replacements:
+        if old in text:
+            text = text.replace(old, new)
+    return text
+
+
+def _join_batch(captions):
+    """
+    Joins a batch of sentences with _BATCH_SEPARATOR, so that they are processed at once by the batch tokenizers.
+    :param captions: List of sentences
+    :return: Joined sentences, or None if any of them contains the separator
+    """
+    captions = [_to_unicode(caption) for caption in captions]
+    if any(_BATCH_SEPARATOR in caption for caption in captions):
+        return None
+    return _BATCH_SEPARATOR.join(captions)
+
 
 def tokenize_basic(caption, lowercase=True):
     """
@@ -13,50 +60,29 @@ def tokenize_basic(caption, lowercase=True):
     :param lowercase: Whether to lowercase the caption or not
     :return: Tokenized version of caption
     """
-
-    punct = [u'.',
-             u';',
-             u',',
-             u'，',
-             u"/",
-             u'[',
-             u']',
-             u'"',
-             u'{',
-             u'}',
-             u'(',
-             u')',
-             u'=',
-             u'+',
-             u'\\',
-             u'_',
-             u'-',
-             u'>',
-             u'<',
-             u'@',
-             u'`',
-             u'¿',
-             u'?',
-             u'¡',
-             u'!']
-
-    def processPunctuation(inText):
-        """
-        Removes punctuation.
-        """
-        outText = inText
-        for p in punct:
-            outText = outText.replace(p, u' ' + p + u' ')
-        return outText
-
-    resAns = caption.lower() if lowercase else caption
-    resAns = resAns.replace(u'\n', u' ')
-    resAns = resAns.replace(u'\t', u' ')
-    resAns = processPunctuation(resAns)
-    resAns = re.sub(u'[ ]+', u' ', resAns)
+    resAns = _to_unicode(caption)
+    resAns = resAns.lower() if lowercase else resAns
+    resAns = _replace_all(resAns, _BASIC_REPLACEMENTS)
+    resAns = _SPACES.sub(u' ', resAns)
     return resAns
 
 
+def tokenize_basic_batch(captions, lowercase=True):
+    """
+    Applies tokenize_basic to a list of sentences, processing all of them at once.
+
+    :param captions: List of strings to tokenize
+    :param lowercase: Whether to lowercase the captions or not
+    :return: List of tokenized captions
+    """
+    if len(captions) == 0:
+        return []
+    joined = _join_batch(captions)
+    if joined is None:
+        return [tokenize_basic(caption, lowercase=lowercase) for caption in captions]
+    return tokenize_basic(joined, lowercase=lowercase).split(_BATCH_SEPARATOR)
+
+
 def tokenize_aggressive(caption, lowercase=True):
     """
     Aggressive tokenizer for the input/output data of type 'text':
@@ -67,45 +93,32 @@ def tokenize_aggressive(caption, lowercase=True):
     :param lowercase: Whether to lowercase the caption or not
     :return: Tokenized version of caption
     """
-    punct = [u'.',
-             u';',
-             u',',
-             u'，',
-             u"/",
-             u'[',
-             u']',
-             u'"',
-             u'{',
-             u'}',
-             u'(',
-             u')',
-             u'=',
-             u'+',
-             u'\\',
-             u'_',
-             u'-',
-             u'>',
-             u'<',
-             u'@',
-             u'`',
-             u'¿',
-             u'?',
-             u'¡',
-             u'!']
-
-    def processPunctuation(inText):
-        outText = inText
-        for p in punct:
-            outText = outText.replace(p, '')
-        return outText
-
-    resAns = caption.lower() if lowercase else caption
-    resAns = processPunctuation(resAns)
-    resAns = re.sub('[ ]+', ' ', resAns)
+    resAns = _to_unicode(caption)
+    resAns = resAns.lower() if lowercase else resAns
+    resAns = _replace_all(resAns, _AGGRESSIVE_REPLACEMENTS)
+    resAns = _SPACES.sub(u' ', resAns)
     resAns = resAns.strip()
     return resAns
 
 
+def tokenize_aggressive_batch(captions, lowercase=True):
+    """
+    Applies tokenize_aggressive to a list of sentences, processing all of them at once.
+
+    :param captions: List of strings to tokenize
+    :param lowercase: Whether to lowercase the captions or not
+    :return: List of tokenized captions
+    """
+    if len(captions) == 0:
+        return []
+    joined = _join_batch(captions)
+    if joined is None:
+        return [tokenize_aggressive(caption, lowercase=lowercase) for caption in captions]
+    joined = joined.lower() if lowercase else joined
+    joined = _SPACES.sub(u' ', _replace_all(joined, _AGGRESSIVE_REPLACEMENTS))
+    return [caption.strip() for caption in joined.split(_BATCH_SEPARATOR)]
+
+
 def tokenize_icann(caption):
     """
     Tokenization used for the icann paper:
@@ -127,9 +140,9 @@ def tokenize_montreal(caption):
     :param caption: String to tokenize
     :return: Tokenized version of caption
     """
-    tokenized = re.sub('[.,"\n\t]+', '', caption.strip())
-    tokenized = re.sub('[\']+', " '", tokenized)
-    tokenized = re.sub('[ ]+', ' ', tokenized)
+    tokenized = _MONTREAL_REMOVED.sub('', caption.strip())
+    tokenized = _MONTREAL_QUOTES.sub(" '", tokenized)
+    tokenized = _SPACES.sub(' ', tokenized)
     tokenized = map(lambda x: x.lower(), tokenized.split())
     tokenized = " ".join(tokenized)
     return tokenized
@@ -144,24 +157,29 @@ def tokenize_soft(caption, lowercase=True):
     :param lowercase: Whether to lowercase the caption or not
     :return: Tokenized version of caption
     """
-    tokenized = re.sub(u'[\n\t]+', u'', caption.strip())
-    tokenized = re.sub(u'[\.]+', u' . ', tokenized)
-    tokenized = re.sub(u'[,]+', u' , ', tokenized)
-    tokenized = re.sub(u'[!]+', u' ! ', tokenized)
-    tokenized = re.sub(u'[?]+', u' ? ', tokenized)
-    tokenized = re.sub(u'[\{]+', u' { ', tokenized)
-    tokenized = re.sub(u'[\}]+', u' } ', tokenized)
-    tokenized = re.sub(u'[\(]+', u' ( ', tokenized)
-    tokenized = re.sub(u'[\)]+', u' ) ', tokenized)
-    tokenized = re.sub(u'[\[]+', u' [ ', tokenized)
-    tokenized = re.sub(u'[\]]+', u' ] ', tokenized)
-    tokenized = re.sub(u'["]+', u' " ', tokenized)
-    tokenized = re.sub(u'[\']+', u" ' ", tokenized)
-    tokenized = re.sub(u'[ ]+', u' ', tokenized)
-    # tokenized = u" ".join(tokenized)
+    tokenized = _NEWLINES_TABS.sub(u'', caption.strip())
+    tokenized = _SOFT_SYMBOLS.sub(u' \\1 ', tokenized)
+    tokenized = _SPACES.sub(u' ', tokenized)
     return tokenized if not lowercase else tokenized.lower()
 
 
+def tokenize_soft_batch(captions, lowercase=True):
+    """
+    Applies tokenize_soft to a list of sentences, processing all of them at once.
+
+    :param captions: List of strings to tokenize
+    :param lowercase: Whether to lowercase the captions or not
+    :return: List of tokenized captions
+    """
+    if len(captions) == 0:
+        return []
+    joined = _join_batch([_NEWLINES_TABS.sub(u'', caption.strip()) for caption in captions])
+    if joined is None:
+        return [tokenize_soft(caption, lowercase=lowercase) for caption in captions]
+    joined = _SPACES.sub(u' ', _SOFT_SYMBOLS.sub(u' \\1 ', joined))
+    return (joined if not lowercase else joined.lower()).split(_BATCH_SEPARATOR)
+
+
 def tokenize_none(caption):
     """
     Does not tokenizes the sentences. Only performs a stripping
@@ -169,7 +187,7 @@ def tokenize_none(caption):
     :param caption: String to tokenize
     :return: Tokenized version of caption
     """
-    tokenized = re.sub('[\n\t]+', '', caption.strip())
+    tokenized = _NEWLINES_TABS.sub('', caption.strip())
     return tokenized
 
 
@@ -189,19 +207,10 @@ def tokenize_none_char(caption):
     :param caption: String to tokenize
     :return: Tokenized version of caption
     """
-
-    def convert_chars(x):
-        """
-        Convert spaces to the '<space>' token.
-        """
-        if x == ' ':
-            return u'<space>'
-        else:
-            return x
-
-    tokenized = re.sub(u'[\n\t]+', u'', caption.strip())
-    tokenized = re.sub(u'[ ]+', u' ', tokenized)
-    tokenized = [convert_chars(char) for char in tokenized]
+    tokenized = _NEWLINES_TABS.sub(u'', caption.strip())
+    tokenized = _SPACES.sub(u' ', tokenized)
+    # Convert spaces to the '<space>' token
+    tokenized = [u'<space>' if char == u' ' else char for char in tokenized]
     tokenized = u" ".join(tokenized)
     return tokenized
 
@@ -213,22 +222,107 @@ def tokenize_CNN_sentence(caption):
     :param caption: String to tokenize
     :return: Tokenized version of caption
     """
-    tokenized = re.sub(r"[^A-Za-z0-9(),!?\'\`]", " ", caption)
-    tokenized = re.sub(r"\'s", " \'s", tokenized)
-    tokenized = re.sub(r"\'ve", " \'ve", tokenized)
-    tokenized = re.sub(r"n\'t", " n\'t", tokenized)
-    tokenized = re.sub(r"\'re", " \'re", tokenized)
-    tokenized = re.sub(r"\'d", " \'d", tokenized)
-    tokenized = re.sub(r"\'ll", " \'ll", tokenized)
-    tokenized = re.sub(r",", " , ", tokenized)
-    tokenized = re.sub(r"!", " ! ", tokenized)
-    tokenized = re.sub(r"\(", " \( ", tokenized)
-    tokenized = re.sub(r"\)", " \) ", tokenized)
-    tokenized = re.sub(r"\?", " \? ", tokenized)
-    tokenized = re.sub(r"\s{2,}", " ", tokenized)
+    tokenized = _CNN_REMOVED.sub(" ", _to_unicode(caption))
+    tokenized = _CNN_CONTRACTIONS.sub(r" \1", tokenized)
+    tokenized = _replace_all(tokenized, _CNN_REPLACEMENTS)
+    tokenized = _CNN_SPACES.sub(" ", tokenized)
     return tokenized.strip().lower()
 
 
+def tokenize_CNN_sentence_batch(captions):
+    """
+    Applies tokenize_CNN_sentence to a list of sentences.
+
+    :param captions: List of strings to tokenize
+    :return: List of tokenized captions
+    """
+    return [tokenize_CNN_sentence(caption) for caption in captions]
+
+
+# VQA questions normalization (tokenize_questions)
+_CONTRACTIONS = {"aint": "ain't", "arent": "aren't", "cant": "can't", "couldve": "could've",
+                 "couldnt": "couldn't",
+                 "couldn'tve": "couldn’t’ve", "couldnt’ve": "couldn’t’ve", "didnt": "didn’t",
+                 "doesnt": "doesn’t",
+                 "dont": "don’t", "hadnt": "hadn’t", "hadnt’ve": "hadn’t’ve", "hadn'tve": "hadn’t’ve",
+                 "hasnt": "hasn’t", "havent": "haven’t", "hed": "he’d", "hed’ve": "he’d’ve", "he’dve": "he’d’ve",
+                 "hes": "he’s", "howd": "how’d", "howll": "how’ll", "hows": "how’s", "Id’ve": "I’d’ve",
+                 "I’dve": "I’d’ve", "Im": "I’m", "Ive": "I’ve", "isnt": "isn’t", "itd": "it’d",
+                 "itd’ve": "it’d’ve",
+                 "it’dve": "it’d’ve", "itll": "it’ll", "let’s": "let’s", "maam": "ma’am", "mightnt": "mightn’t",
+                 "mightnt’ve": "mightn’t’ve", "mightn’tve": "mightn’t’ve", "mightve": "might’ve",
+                 "mustnt": "mustn’t",
+                 "mustve": "must’ve", "neednt": "needn’t", "notve": "not’ve", "oclock": "o’clock",
+                 "oughtnt": "oughtn’t",
+                 "ow’s’at": "’ow’s’at", "’ows’at": "’ow’s’at", "’ow’sat": "’ow’s’at", "shant": "shan’t",
+                 "shed’ve": "she’d’ve", "she’dve": "she’d’ve", "she’s": "she’s", "shouldve": "should’ve",
+                 "shouldnt": "shouldn’t", "shouldnt’ve": "shouldn’t’ve", "shouldn’tve": "shouldn’t’ve",
+                 "somebody’d": "somebodyd", "somebodyd’ve": "somebody’d’ve", "somebody’dve": "somebody’d’ve",
+                 "somebodyll": "somebody’ll", "somebodys": "somebody’s", "someoned": "someone’d",
+                 "someoned’ve": "someone’d’ve", "someone’dve": "someone’d’ve", "someonell": "someone’ll",
+                 "someones": "someone’s", "somethingd": "something’d", "somethingd’ve": "something’d’ve",
+                 "something’dve": "something’d’ve", "somethingll": "something’ll", "thats": "that’s",
+                 "thered": "there’d", "thered’ve": "there’d’ve", "there’dve": "there’d’ve",
+                 "therere": "there’re",
+                 "theres": "there’s", "theyd": "they’d", "theyd’ve": "they’d’ve", "they’dve": "they’d’ve",
+                 "theyll": "they’ll", "theyre": "they’re", "theyve": "they’ve", "twas": "’twas",
+                 "wasnt": "wasn’t",
+                 "wed’ve": "we’d’ve", "we’dve": "we’d’ve", "weve": "we've", "werent": "weren’t",
+                 "whatll": "what’ll",
+                 "whatre": "what’re", "whats": "what’s", "whatve": "what’ve", "whens": "when’s", "whered":
+                     "where’d", "wheres": "where's", "whereve": "where’ve", "whod": "who’d",
+                 "whod’ve": "who’d’ve",
+                 "who’dve": "who’d’ve", "wholl": "who’ll", "whos": "who’s", "whove": "who've", "whyll": "why’ll",
+                 "whyre": "why’re", "whys": "why’s", "wont": "won’t", "wouldve": "would’ve",
+                 "wouldnt": "wouldn’t",
+                 "wouldnt’ve": "wouldn’t’ve", "wouldn’tve": "wouldn’t’ve", "yall": "y’all",
+                 "yall’ll": "y’all’ll",
+                 "y’allll": "y’all’ll", "yall’d’ve": "y’all’d’ve", "y’alld’ve": "y’all’d’ve",
+                 "y’all’dve": "y’all’d’ve",
+                 "youd": "you’d", "youd’ve": "you’d’ve", "you’dve": "you’d’ve", "youll": "you’ll",
+                 "youre": "you’re", "youve": "you’ve"}
+_QUESTIONS_PUNCTUATION = [';', r"/", '[', ']', '"', '{', '}', '(', ')', '=', '+', '\\',
+                          '_', '-', '>', '<', '@', '`', ',', '?', '!']
+_COMMA_STRIP = re.compile(r"(\d)(\,)(\d)")
+_PERIOD_STRIP = re.compile(r"(?!<=\d)(\.)(?!\d)")
+_MANUAL_MAP = {'none': '0', 'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+               'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'}
+_ARTICLES = {'a', 'an', 'the'}
+
+
+def _processQuestionPunctuation(inText):
+    """
+    Process (remove) the punctuation of a question.
+    Each punctuation symbol is removed if it appears next to a blank space (or if the question contains a number
+    with a comma), or replaced by a blank space otherwise.
+    """
+    if isinstance(inText, str) and sys.version_info < (3, 0):
+        inText = inText.decode("utf-8").encode("utf-8")
+    comma_strip = _COMMA_STRIP.search(inText) is not None
+    outText = inText
+    for p in _QUESTIONS_PUNCTUATION:
+        if p in outText:
+            if comma_strip or p + ' ' in inText or ' ' + p in inText:
+                outText = outText.replace(p, '')
+            else:
+                outText = outText.replace(p, ' ')
+    # re.UNICODE is passed as the count argument (at most 32 periods are removed), as in the original VQA code
+    outText = _PERIOD_STRIP.sub("", outText, re.UNICODE)
+    return outText
+
+
+def _processDigitArticle(inText):
+    """
+    Converts numbers to digits, removes the articles and splits the contractions of a question.
+    """
+    outText = []
+    for word in inText.lower().split():
+        word = _MANUAL_MAP.get(word, word)
+        if word not in _ARTICLES:
+            outText.append(_CONTRACTIONS.get(word, word))
+    return ' '.join(outText)
+
+
 def tokenize_questions(caption):
     """
     Basic tokenizer for VQA questions:
@@ -240,95 +334,26 @@ def tokenize_questions(caption):
     :param caption: String to tokenize
     :return: Tokenized version of caption
     """
-    contractions = {"aint": "ain't", "arent": "aren't", "cant": "can't", "couldve": "could've",
-                    "couldnt": "couldn't",
-                    "couldn'tve": "couldn’t’ve", "couldnt’ve": "couldn’t’ve", "didnt": "didn’t",
-                    "doesnt": "doesn’t",
-                    "dont": "don’t", "hadnt": "hadn’t", "hadnt’ve": "hadn’t’ve", "hadn'tve": "hadn’t’ve",
-                    "hasnt": "hasn’t", "havent": "haven’t", "hed": "he’d", "hed’ve": "he’d’ve", "he’dve": "he’d’ve",
-                    "hes": "he’s", "howd": "how’d", "howll": "how’ll", "hows": "how’s", "Id’ve": "I’d’ve",
-                    "I’dve": "I’d’ve", "Im": "I’m", "Ive": "I’ve", "isnt": "isn’t", "itd": "it’d",
-                    "itd’ve": "it’d’ve",
-                    "it’dve": "it’d’ve", "itll": "it’ll", "let’s": "let’s", "maam": "ma’am", "mightnt": "mightn’t",
-                    "mightnt’ve": "mightn’t’ve", "mightn’tve": "mightn’t’ve", "mightve": "might’ve",
-                    "mustnt": "mustn’t",
-                    "mustve": "must’ve", "neednt": "needn’t", "notve": "not’ve", "oclock": "o’clock",
-                    "oughtnt": "oughtn’t",
-                    "ow’s’at": "’ow’s’at", "’ows’at": "’ow’s’at", "’ow’sat": "’ow’s’at", "shant": "shan’t",
-                    "shed’ve": "she’d’ve", "she’dve": "she’d’ve", "she’s": "she’s", "shouldve": "should’ve",
-                    "shouldnt": "shouldn’t", "shouldnt’ve": "shouldn’t’ve", "shouldn’tve": "shouldn’t’ve",
-                    "somebody’d": "somebodyd", "somebodyd’ve": "somebody’d’ve", "somebody’dve": "somebody’d’ve",
-                    "somebodyll": "somebody’ll", "somebodys": "somebody’s", "someoned": "someone’d",
-                    "someoned’ve": "someone’d’ve", "someone’dve": "someone’d’ve", "someonell": "someone’ll",
-                    "someones": "someone’s", "somethingd": "something’d", "somethingd’ve": "something’d’ve",
-                    "something’dve": "something’d’ve", "somethingll": "something’ll", "thats": "that’s",
-                    "thered": "there’d", "thered’ve": "there’d’ve", "there’dve": "there’d’ve",
-                    "therere": "there’re",
-                    "theres": "there’s", "theyd": "they’d", "theyd’ve": "they’d’ve", "they’dve": "they’d’ve",
-                    "theyll": "they’ll", "theyre": "they’re", "theyve": "they’ve", "twas": "’twas",
-                    "wasnt": "wasn’t",
-                    "wed’ve": "we’d’ve", "we’dve": "we’d’ve", "weve": "we've", "werent": "weren’t",
-                    "whatll": "what’ll",
-                    "whatre": "what’re", "whats": "what’s", "whatve": "what’ve", "whens": "when’s", "whered":
-                        "where’d", "wheres": "where's", "whereve": "where’ve", "whod": "who’d",
-                    "whod’ve": "who’d’ve",
-                    "who’dve": "who’d’ve", "wholl": "who’ll", "whos": "who’s", "whove": "who've", "whyll": "why’ll",
-                    "whyre": "why’re", "whys": "why’s", "wont": "won’t", "wouldve": "would’ve",
-                    "wouldnt": "wouldn’t",
-                    "wouldnt’ve": "wouldn’t’ve", "wouldn’tve": "wouldn’t’ve", "yall": "y’all",
-                    "yall’ll": "y’all’ll",
-                    "y’allll": "y’all’ll", "yall’d’ve": "y’all’d’ve", "y’alld’ve": "y’all’d’ve",
-                    "y’all’dve": "y’all’d’ve",
-                    "youd": "you’d", "youd’ve": "you’d’ve", "you’dve": "you’d’ve", "youll": "you’ll",
-                    "youre": "you’re", "youve": "you’ve"}
-    punct = [';', r"/", '[', ']', '"', '{', '}', '(', ')', '=', '+', '\\',
-             '_', '-', '>', '<', '@', '`', ',', '?', '!']
-    commaStrip = re.compile("(\d)(\,)(\d)")
-    periodStrip = re.compile("(?!<=\d)(\.)(?!\d)")
-    manualMap = {'none': '0', 'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
-                 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'}
-    articles = ['a', 'an', 'the']
-
-    def processPunctuation(inText):
-        """
-        Process (remove) the punctuation.
-        """
-        if isinstance(inText, str) and sys.version_info < (3, 0):
-            inText = inText.decode("utf-8").encode("utf-8")
-        outText = inText
-        for p in punct:
-            if (p + ' ' in inText or ' ' + p in inText) or (re.search(commaStrip, inText) is not None):
-                outText = outText.replace(p, '')
-            else:
-                outText = outText.replace(p, ' ')
-        outText = periodStrip.sub("", outText, re.UNICODE)
-        return outText
-
-    def processDigitArticle(inText):
-        outText = []
-        tempText = inText.lower().split()
-        for word in tempText:
-            word = manualMap.setdefault(word, word)
-            if word not in articles:
-                outText.append(word)
-            else:
-                pass
-        for wordId, word in list(enumerate(outText)):
-            if word in contractions:
-                outText[wordId] = contractions[word]
-        outText = ' '.join(outText)
-        return outText
-
     resAns = caption.lower()
     resAns = resAns.replace('\n', ' ')
     resAns = resAns.replace('\t', ' ')
     resAns = resAns.strip()
-    resAns = processPunctuation(resAns)
-    resAns = processDigitArticle(resAns)
+    resAns = _processQuestionPunctuation(resAns)
+    resAns = _processDigitArticle(resAns)
 
     return resAns
 
 
+def tokenize_questions_batch(captions):
+    """
+    Applies tokenize_questions to a list of sentences.
+
+    :param captions: List of strings to tokenize
+    :return: List of tokenized captions
+    """
+    return [tokenize_questions(caption) for caption in captions]
+
+
 def tokenize_bpe(BPE, caption):
     """
     Applies BPE segmentation (https://github.com/rsennrich/subword-nmt)
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 import copy
+import hashlib
 import itertools
+import os
 import sys
+import threading
 import time
+from collections import OrderedDict
 from six import iteritems
 import numpy as np
 import logging
@@ -448,9 +452,7 @@ def prepareECOCLossOutputs(net, ds, ecoc_table, input_name, output_names,
     # Insert ecoc-loss labels for each data split
     for s in splits:
         labels_ecoc = []
-        # exec ('labels = ds.Y_' + s + '[id_labels]')
-        y_split = getattr(ds, 'Y_' + s)
-        labels = y_split[gt_id]
+        labels = ds.getSplitSamples(s, gt_id)
         n = len(labels)
         for i in range(n):
             labels_ecoc.append(ecoc_table[labels[i]])
@@ -737,30 +739,29 @@ def simplifyDataset(ds, id_classes, n_classes=50):
     for s in ['train', 'val', 'test']:
         kept_Y = dict()
         kept_X = dict()
-        labels_set = getattr(ds, 'Y_' + s)[id_labels]
+        labels_set = ds.getSplitSamples(s, id_labels)
+        samples_Y = dict((id_out, ds.getSplitSamples(s, id_out)) for id_out in ds.ids_outputs)
+        samples_X = dict((id_in, ds.getSplitSamples(s, id_in, 'X')) for id_in in ds.ids_inputs)
         for i, y in list(enumerate(labels_set)):
             if y < n_classes:
                 for id_out in ds.ids_outputs:
-                    # exec ('sample = ds.Y_' + s + '[id_out][i]')
-                    y_split = getattr(ds, 'Y_' + s)
-                    sample = y_split[id_out][i]
+                    sample = samples_Y[id_out][i]
                     try:
                         kept_Y[id_out].append(sample)
                     except Exception:
                         kept_Y[id_out] = []
                         kept_Y[id_out].append(sample)
                 for id_in in ds.ids_inputs:
-                    # exec ('sample = ds.X_' + s + '[id_in][i]')
-                    x_split = getattr(ds, 'X_' + s)
-                    sample = x_split[id_in][i]
+                    sample = samples_X[id_in][i]
                     try:
                         kept_X[id_in].append(sample)
                     except Exception:
                         kept_X[id_in] = []
                         kept_X[id_in].append(sample)
-        # exec ('ds.X_' + s + ' = copy.copy(kept_X)')
-        # exec ('ds.Y_' + s + ' = copy.copy(kept_Y)')
-        # exec ('ds.len_' + s + ' = len(kept_Y[id_labels])')
+        # The kept samples are stored in order and without repetitions
+        for attr in ['X_' + s, 'Y_' + s]:
+            ds.repeat_indices.pop(attr, None)
+        setattr(ds, 'indices_' + s, None)
         setattr(ds, 'X_' + s, copy.copy(kept_X))
         setattr(ds, 'Y_' + s, copy.copy(kept_Y))
         setattr(ds, 'len_' + s, len(kept_Y[id_labels]))
@@ -867,6 +868,20 @@ def one_hot_2_indices(preds, pad_sequences=True, verbose=0):
     return preds
 
 
+def remove_batch_padding(sentence, pad_idx=0):
+    """
+    Removes the padding added to an encoded sentence for the longest sentence of its batch
+    (see Dataset.loadText with pad_on_batch, fill='end' and no offset). The position of the <eos> symbol is kept,
+    so the result is the sentence encoded alone.
+
+    :param sentence: Array of word indices.
+    :param pad_idx: Index of the padding (and <eos>) symbol.
+    :return: Array of word indices.
+    """
+    words = np.nonzero(np.asarray(sentence) != pad_idx)[0]
+    return sentence[:words[-1] + 2 if len(words) > 0 else 1]
+
+
 def indices_2_one_hot(indices, n):
     """
     Converts a list of indices into one hot codification
@@ -884,6 +899,22 @@ def indices_2_one_hot(indices, n):
     return one_hot
 
 
+def indices_2_words(index2word, indices):
+    """
+    Converts an array of word indices into words.
+
+    :param index2word: Mapping from word indices into words (IndexToWords or dictionary).
+    :param indices: Array (of any shape) of word indices.
+    :return: Object array of words with the shape of indices.
+    """
+    if isinstance(index2word, IndexToWords):
+        return index2word.take(indices)
+    indices = np.asarray(indices, dtype='int64')
+    words = np.empty(indices.shape, dtype=object)
+    words.flat[:] = [index2word[index] for index in indices.ravel().tolist()]
+    return words
+
+
 # From keras.utils.np_utils
 def to_categorical(y, num_classes=None):
     """Converts a class vector (integers) to binary class matrix.
@@ -922,6 +953,29 @@ def categorical_probas_to_classes(p):
 #           Functions for decoding predictions
 # ------------------------------------------------------- #
 
+def _join_sentences(words, lengths, stop_words=(), drop_last=False):
+    """
+    Joins the words of a batch of sentences.
+    :param words: Object array with the concatenation of the words of all sentences.
+    :param lengths: Number of words of each sentence.
+    :param stop_words: Each sentence is cut before the first occurrence of any of these words.
+    :param drop_last: Remove the last word of each sentence.
+    :return: List of sentences.
+    """
+    lengths = np.asarray(lengths, dtype='int64')
+    offsets = np.zeros(len(lengths) + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    ends = np.maximum(lengths - 1, 0) if drop_last else lengths.copy()
+    if len(stop_words) > 0 and len(words) > 0:
+        stop_positions = np.flatnonzero(np.logical_or.reduce([words == stop_word for stop_word in stop_words]))
+        stop_sentences = np.searchsorted(offsets, stop_positions, side='right') - 1
+        np.minimum.at(ends, stop_sentences, stop_positions - offsets[stop_sentences])
+    words = words.tolist()
+    if sys.version_info.major == 2:
+        words = [word.decode('utf-8') if isinstance(word, str) else word for word in words]
+    return [u' '.join(words[offsets[i]:offsets[i] + ends[i]]) for i in range(len(lengths))]
+
+
 def decode_predictions_one_hot(preds, index2word, pad_sequences=True, verbose=0):
     """
     Decodes predictions following a one-hot codification.
@@ -932,22 +986,10 @@ def decode_predictions_one_hot(preds, index2word, pad_sequences=True, verbose=0)
     """
     if verbose > 0:
         logger.info('Decoding one hot prediction ...')
-    preds = list(map(lambda prediction: np.argmax(prediction, axis=1), preds))
+    preds = [np.argmax(prediction, axis=1) for prediction in preds]
     PAD = '<pad>'
-    flattened_answer_pred = [list(map(lambda index: index2word[index], pred)) for
-                             pred in preds]
-    answer_pred_matrix = np.asarray(flattened_answer_pred)
-    answer_pred = []
-
-    for a_no in answer_pred_matrix:
-        end_token_pos = [j for j, x in list(enumerate(a_no)) if x == PAD]
-        end_token_pos = None if len(end_token_pos) == 0 or not pad_sequences else end_token_pos[0]
-        a_no = [a.decode('utf-8') if isinstance(a,
-                                                str) and sys.version_info.major == 2 else a
-                for a in a_no]
-        tmp = u' '.join(a_no[:end_token_pos])
-        answer_pred.append(tmp)
-    return answer_pred
+    words = indices_2_words(index2word, np.concatenate(preds) if len(preds) > 0 else [])
+    return _join_sentences(words, [len(pred) for pred in preds], stop_words=[PAD] if pad_sequences else [])
 
 
 def decode_predictions(preds, temperature, index2word, sampling_type, verbose=0):
@@ -964,17 +1006,16 @@ def decode_predictions(preds, temperature, index2word, sampling_type, verbose=0)
     if verbose > 0:
         logger.info('Decoding prediction ...')
     flattened_preds = preds.reshape(-1, preds.shape[-1])
-    flattened_answer_pred = list(map(lambda index: index2word[index], sampling(scores=flattened_preds,
-                                                                               sampling_type=sampling_type,
-                                                                               temperature=temperature)))
-    answer_pred_matrix = np.asarray(flattened_answer_pred).reshape(preds.shape[:-1])
+    answer_pred_matrix = indices_2_words(index2word, sampling(scores=flattened_preds,
+                                                              sampling_type=sampling_type,
+                                                              temperature=temperature)).reshape(preds.shape[:-1])
 
     answer_pred = []
     EOS = '<eos>'
     PAD = '<pad>'
 
     for a_no in answer_pred_matrix:
-        if len(a_no.shape) > 1:  # only process word by word if our prediction has more than one output
+        if np.ndim(a_no) > 1:  # only process word by word if our prediction has more than one output
             init_token_pos = 0
             end_token_pos = [j for j, x in list(enumerate(a_no)) if x == EOS or x == PAD]
             end_token_pos = None if len(end_token_pos) == 0 else end_token_pos[0]
@@ -1111,12 +1152,14 @@ def decode_predictions_beam_search(preds, index2word, glossary=None, alphas=None
         if verbose > 0:
             logger.info('Using heuristic %d' % heuristic)
     if pad_sequences:
-        preds = [pred[:sum([int(elem > 0) for elem in pred]) + 1] for pred in preds]
-    flattened_predictions = [list(map(lambda x: index2word[x], pred)) for pred in
-                             preds]
-    final_predictions = []
+        preds = [pred[:np.count_nonzero(pred) + 1] for pred in preds]
+    lengths = [len(pred) for pred in preds]
+    words = indices_2_words(index2word, np.concatenate(preds) if len(preds) > 0 else [])
 
     if alphas is not None:
+        offsets = np.cumsum([0] + lengths)
+        flattened_predictions = [words[offsets[i]:offsets[i + 1]].tolist() for i in range(len(preds))]
+        final_predictions = []
         x_text = list(map(lambda x: x.split(), x_text))
         hard_alignments = list(
             map(lambda alignment, x_sentence: np.argmax(
@@ -1139,12 +1182,7 @@ def decode_predictions_beam_search(preds, index2word, glossary=None, alphas=None
             tmp = u' '.join(a_no[:-1])
             final_predictions.append(tmp)
     else:
-        for a_no in flattened_predictions:
-            a_no = [a.decode('utf-8') if isinstance(a,
-                                                    str) and sys.version_info.major == 2 else a
-                    for a in a_no]
-            tmp = u' '.join(a_no[:-1])
-            final_predictions.append(tmp)
+        final_predictions = _join_sentences(words, lengths, drop_last=True)
     return final_predictions
 
 
@@ -1174,7 +1212,359 @@ def sampling(scores, sampling_type='max_likelihood', temperature=1.0):
         raise NotImplementedError()
 
 
+# Image-related utils
+def resize_image(im, size):
+    """
+    Resizes an image with bilinear interpolation (as the images loaded by the Dataset).
+    :param im: Image array with shape (height, width[, channels]) and values in [0, 255].
+    :param size: (height, width) of the resized image.
+    :return: uint8 array with shape (size[0], size[1][, channels])
+    """
+    from PIL import Image as pilimage
+
+    im = np.asarray(im)
+    shape = im.shape
+    if im.ndim == 3 and shape[2] == 1:
+        im = im[:, :, 0]
+    im = pilimage.fromarray(im.astype(np.uint8)).resize((int(size[1]), int(size[0])), pilimage.BILINEAR)
+    return np.asarray(im).reshape((int(size[0]), int(size[1])) + shape[2:])
+
+
+def resize_maps(maps, size, interpolation='bilinear'):
+    """
+    Resizes a stack of 2D maps (e.g. the class channels of a segmentation) at once.
+    The centers of the input and output pixels are aligned (without antialiasing).
+    The maps are processed in blocks of about 64k pixels, which are kept in the CPU caches between passes.
+    :param maps: Array with shape (..., height, width).
+    :param size: Output (height, width).
+    :param interpolation: 'bilinear' or 'nearest' (which keeps the values, e.g. for maps of class ids).
+    :return: Array with shape (..., size[0], size[1]). Float32 for 'bilinear', same type as maps for 'nearest'.
+    """
+    if interpolation not in ['bilinear', 'nearest']:
+        raise NotImplementedError('The interpolation "' + str(interpolation) + '" is not implemented.')
+    maps = np.asarray(maps)
+    dtype = np.float32 if interpolation == 'bilinear' else maps.dtype
+    height, width = maps.shape[-2:]
+    flat_maps = maps.reshape((-1, height, width))
+    resized = np.zeros((len(flat_maps),) + tuple(size), dtype=dtype)
+
+    # Position of each output pixel in the input maps and its interpolation weights
+    axes = []
+    for old_len, new_len in zip([height, width], size):
+        coords = (np.arange(new_len) + 0.5) * (float(old_len) / new_len) - 0.5
+        if interpolation == 'nearest':
+            axes.append((np.clip(np.floor(coords + 0.5).astype('int64'), 0, old_len - 1), None, None))
+        else:
+            coords = np.clip(coords, 0, old_len - 1)
+            low = np.floor(coords).astype('int64')
+            axes.append((low, np.minimum(low + 1, old_len - 1), (coords - low).astype(np.float32)))
+
+    block_size = max(1, 2 ** 16 // max(1, height * width))
+    for start in range(0, len(flat_maps), block_size):
+        block = flat_maps[start:start + block_size].astype(dtype)
+        for axis, (low, high, weights) in zip([1, 2], axes):
+            if block.shape[axis] == len(low) and np.array_equal(low, np.arange(len(low))):
+                continue
+            low_values = np.take(block, low, axis=axis)
+            if weights is not None:
+                difference = np.take(block, high, axis=axis)
+                difference -= low_values
+                difference *= weights.reshape([-1] + [1] * (2 - axis))
+                low_values += difference
+            block = low_values
+        resized[start:start + block_size] = block
+    return resized.reshape(maps.shape[:-2] + tuple(size))
+
+
 # Data structures-related utils
+class RaggedArray(object):
+    """
+    Sequence of variable-length rows stored as a flat numpy array plus the offsets of each row
+    (row i is data[offsets[i]:offsets[i + 1]]).
+    Optionally, per-row arrays (fields) can be attached. They follow the rows when indexing.
+    """
+
+    def __init__(self, data, offsets, fields=None):
+        """
+        :param data: Flat array with the concatenation of all rows.
+        :param offsets: Array of len(rows) + 1 positions. Row i spans data[offsets[i]:offsets[i + 1]].
+        :param fields: Dictionary of arrays with one value per row.
+        """
+        self.data = data
+        self.offsets = offsets
+        self.fields = fields if fields is not None else dict()
+
+    @classmethod
+    def from_sequences(cls, sequences, dtype='int32', fields=None):
+        """
+        Builds a RaggedArray from a list of sequences.
+        :param sequences: List of sequences (lists or arrays).
+        :param dtype: Data type of the flat array.
+        :param fields: Dictionary of per-row values.
+        :return: RaggedArray instance.
+        """
+        lengths = np.fromiter(map(len, sequences), dtype='int64', count=len(sequences))
+        offsets = np.zeros(len(sequences) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        if len(sequences) > 0 and offsets[-1] > 0:
+            data = np.concatenate([np.asarray(sequence, dtype=dtype) for sequence in sequences])
+        else:
+            data = np.zeros(0, dtype=dtype)
+        if fields is not None:
+            fields = dict((name, np.asarray(values)) for name, values in iteritems(fields))
+        return cls(data, offsets, fields)
+
+    @classmethod
+    def concatenate(cls, ragged_arrays):
+        """
+        Concatenates several RaggedArrays.
+        :param ragged_arrays: List of RaggedArray instances.
+        :return: RaggedArray with the rows of all the arrays.
+        """
+        data = np.concatenate([r.data[r.offsets[0]:r.offsets[-1]] for r in ragged_arrays])
+        offsets = np.zeros(sum(len(r) for r in ragged_arrays) + 1, dtype='int64')
+        np.cumsum(np.concatenate([r.lengths for r in ragged_arrays]), out=offsets[1:])
+        fields = dict((name, np.concatenate([r.fields[name] for r in ragged_arrays]))
+                      for name in ragged_arrays[0].fields)
+        return cls(data, offsets, fields)
+
+    @property
+    def lengths(self):
+        """
+        Length of each row.
+        """
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __add__(self, other):
+        return RaggedArray.concatenate([self, other])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            return self.data[self.offsets[key]:self.offsets[key + 1]]
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                fields = dict((name, values[start:stop]) for name, values in iteritems(self.fields))
+                return RaggedArray(self.data, self.offsets[start:stop + 1], fields)
+            key = np.arange(start, stop, step)
+        return self.take(key)
+
+    def take(self, indices):
+        """
+        Gathers a set of rows.
+        :param indices: Positions of the rows to gather.
+        :return: RaggedArray containing (a copy of) the selected rows.
+        """
+        indices = np.asarray(indices, dtype='int64').reshape(-1)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        # Position of each element of the gathered rows in the flat array
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        fields = dict((name, values[indices]) for name, values in iteritems(self.fields))
+        return RaggedArray(self.data[positions], offsets, fields)
+
+    def tolist(self):
+        """
+        :return: List with a python list for each row.
+        """
+        return [row.tolist() for row in self]
+
+
+class LRUArrayCache(object):
+    """
+    Cache of numpy arrays with least-recently-used eviction.
+    The in-memory tier holds at most max_bytes. Optionally, an on-disk tier stores every cached array as a .npy file
+    in cache_path, which is memory-mapped when read. The on-disk tier is kept across runs, so keys must identify the
+    cached content (e.g. file path and processing parameters).
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, cache_path=None):
+        """
+        :param max_bytes: Maximum number of bytes stored in memory.
+        :param cache_path: Directory of the on-disk tier. If None, only the in-memory tier is used.
+        """
+        self.max_bytes = max_bytes
+        self.cache_path = cache_path
+        if cache_path is not None and not os.path.isdir(cache_path):
+            os.makedirs(cache_path)
+        self.__init_memory()
+
+    def __init_memory(self):
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __disk_file(self, key):
+        return os.path.join(self.cache_path, hashlib.md5(repr(key).encode('utf-8')).hexdigest() + '.npy')
+
+    def get(self, key):
+        """
+        Gets a cached array.
+        :param key: Hashable key of the array.
+        :return: Cached array (read-only if it comes from the on-disk tier) or None if it is not cached.
+        """
+        with self.lock:
+            array = self.entries.get(key)
+            if array is not None:
+                # Mark as the most recently used
+                del self.entries[key]
+                self.entries[key] = array
+                self.hits += 1
+                return array
+        if self.cache_path is not None:
+            disk_file = self.__disk_file(key)
+            if os.path.isfile(disk_file):
+                try:
+                    array = np.load(disk_file, mmap_mode='r')
+                except Exception:
+                    array = None
+        with self.lock:
+            if array is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return array
+
+    def put(self, key, array):
+        """
+        Caches an array, evicting the least recently used ones if the memory budget is exceeded.
+        :param key: Hashable key of the array.
+        :param array: Numpy array.
+        """
+        if self.cache_path is not None:
+            disk_file = self.__disk_file(key)
+            if not os.path.isfile(disk_file):
+                # Write to a temporary file first, so that concurrent readers never see partial files
+                tmp_file = disk_file[:-4] + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident) + '.tmp'
+                with open(tmp_file, 'wb') as f:
+                    np.save(f, array)
+                os.rename(tmp_file, disk_file)
+        if array.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = array
+            self.n_bytes += array.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        """
+        Empties the in-memory tier. The on-disk tier is kept.
+        """
+        self.__init_memory()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # The in-memory tier is not stored
+        return {'max_bytes': self.max_bytes, 'cache_path': self.cache_path}
+
+    def __setstate__(self, state):
+        self.max_bytes = state['max_bytes']
+        self.cache_path = state['cache_path']
+        self.__init_memory()
+
+
+class IndexToWords(object):
+    """
+    Read-only mapping from word indices into words (the 'idx2words' of a vocabulary).
+    The words are stored in a numpy object array indexed by the word index, so that whole arrays of indices are
+    decoded with a single take. Indices without a word are stored as None.
+    It behaves as the dictionary {index: word} for single lookups and iteration.
+    """
+
+    def __init__(self, words2idx):
+        """
+        :param words2idx: Mapping from words into non-negative word indices.
+        """
+        indices = np.fromiter(words2idx.values(), dtype='int64', count=len(words2idx))
+        if len(indices) > 0 and indices.min() < 0:
+            raise AssertionError('The word indices must be non-negative.')
+        self.words = np.empty(indices.max() + 1 if len(indices) > 0 else 0, dtype=object)
+        words = np.empty(len(indices), dtype=object)
+        words[:] = list(words2idx)
+        self.words[indices] = words
+        self.present = np.not_equal(self.words, None)
+        self.n_words = int(np.count_nonzero(self.present))
+
+    def take(self, indices):
+        """
+        Decodes an array of word indices.
+        :param indices: Array (of any shape) of word indices.
+        :return: Object array of words with the shape of indices.
+        """
+        return self.words.take(np.asarray(indices, dtype='int64'))
+
+    def __getitem__(self, index):
+        word = self.words[index] if 0 <= index < len(self.words) else None
+        if word is None:
+            raise KeyError(index)
+        return word
+
+    def get(self, index, default=None):
+        word = self.words[index] if 0 <= index < len(self.words) else None
+        return default if word is None else word
+
+    def __contains__(self, index):
+        return self.get(index) is not None
+
+    def __len__(self):
+        return self.n_words
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.present).tolist())
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return self.words[self.present].tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __eq__(self, other):
+        if isinstance(other, IndexToWords):
+            return len(self.words) == len(other.words) and bool(np.all(self.words == other.words))
+        return isinstance(other, dict) and dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def build_index2word(words2idx):
+    """
+    Builds the mapping from word indices into words of a vocabulary.
+    :param words2idx: Mapping from words into word indices.
+    :return: IndexToWords instance, or a dictionary if the indices are negative or too sparse to be stored
+             in an array (more than twice as many indices as words).
+    """
+    indices = list(words2idx.values())
+    if len(indices) > 0 and (min(indices) < 0 or max(indices) >= 2 * len(indices)):
+        return dict((idx, word) for word, idx in iteritems(words2idx))
+    return IndexToWords(words2idx)
+
+
 def flatten_list_of_lists(list_of_lists):
     """
     Flattens a list of lists
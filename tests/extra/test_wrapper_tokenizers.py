@@ -60,13 +60,38 @@ def test_tokenize_none_char():
 
 
 def test_tokenize_CNN_sentence():
-    # TODO
-    pass
+    untokenized_string = u'This, ¿is a      , .sentence with weird\xbb symbols ù ä ë ï ö ü ^首先 ,!!!\n\n'
+    expected_string = u'this , is a , sentence with weird symbols , ! ! !'
+    assert expected_string == tokenize_CNN_sentence(untokenized_string)
+    untokenized_string = u"It's (not) what you'd think, isn't it?!"
+    expected_string = u"it 's \\( not \\) what you 'd think , is n't it \\? !"
+    assert expected_string == tokenize_CNN_sentence(untokenized_string)
 
 
 def test_tokenize_questions():
-    # TODO
-    pass
+    untokenized_string = u'Isnt the dog (near two cats)? It costs 1,000 dollars; a/b.\n'
+    expected_string = u'isn’t dog near 2 cats it costs 1000 dollars ab'
+    assert expected_string == tokenize_questions(untokenized_string)
+    untokenized_string = u'Whats the man-eating [thing] over there?'
+    expected_string = u'what’s man eating thing over there'
+    assert expected_string == tokenize_questions(untokenized_string)
+
+
+def test_batch_tokenizers():
+    untokenized_strings = [u'This, ¿is a      , .sentence with weird\xbb symbols ù ä ë ï ö ü ^首先 ,!!!\n\n',
+                           u'', u'  The dog (near two cats)?  ', u'Separator \x00 inside']
+    for tokenizer, batch_tokenizer in [(tokenize_basic, tokenize_basic_batch),
+                                       (tokenize_aggressive, tokenize_aggressive_batch),
+                                       (tokenize_soft, tokenize_soft_batch)]:
+        for lowercase in [True, False]:
+            expected_strings = [tokenizer(string, lowercase=lowercase) for string in untokenized_strings]
+            assert expected_strings == batch_tokenizer(untokenized_strings, lowercase=lowercase)
+            assert expected_strings[:-1] == batch_tokenizer(untokenized_strings[:-1], lowercase=lowercase)
+    assert [tokenize_questions(string) for string in untokenized_strings] == \
+        tokenize_questions_batch(untokenized_strings)
+    assert [tokenize_CNN_sentence(string) for string in untokenized_strings] == \
+        tokenize_CNN_sentence_batch(untokenized_strings)
+    assert tokenize_basic_batch([]) == []
 
 
 def test_tokenize_bpe():
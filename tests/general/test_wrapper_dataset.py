@@ -1,9 +1,572 @@
+import os
 import pytest
+import numpy as np
 from six import iteritems
+from keras_wrapper.dataset import Dataset, saveDataset, loadDataset, LazyColumnDict, ImageShard, \
+    Data_Batch_Generator, Parallel_Data_Batch_Generator, Prefetch_Batch_Generator, \
+    Bucketed_Data_Batch_Generator
+from keras_wrapper.utils import RaggedArray, resize_maps
 
 
 def test_dataset():
     pass
 
+
+def build_toy_dataset(encode_text=False):
+    ds = Dataset('toy_dataset', '.', silence=True)
+    for split, n_samples in [('train', 6), ('val', 2)]:
+        ds.setInput(['sentence number ' + str(i) + ' ' * (i % 2) for i in range(n_samples)], split,
+                    type='text', id='source_text', build_vocabulary=split == 'train', max_text_len=5,
+                    offset=1, encode_text=encode_text)
+        ds.setOutput([i % 3 for i in range(n_samples)], split, type='real', id='label')
+    return ds
+
+
+def test_columnar_save_load(tmpdir):
+    ds = build_toy_dataset()
+    saveDataset(ds, str(tmpdir), format='columnar')
+    loaded_ds = loadDataset(str(tmpdir) + '/Dataset_toy_dataset')
+    assert isinstance(loaded_ds.X_train, LazyColumnDict)
+    assert not loaded_ds.X_val.is_loaded('source_text')
+    assert loaded_ds.len_train == ds.len_train
+    assert loaded_ds.vocabulary == ds.vocabulary
+    assert loaded_ds.X_train['source_text'] == ds.X_train['source_text']
+    assert loaded_ds.X_train.is_loaded('source_text')
+    assert not loaded_ds.X_val.is_loaded('source_text')
+    assert list(loaded_ds.Y_val['label']) == list(ds.Y_val['label'])
+
+
+def test_pickle_save_load(tmpdir):
+    ds = build_toy_dataset()
+    saveDataset(ds, str(tmpdir))
+    loaded_ds = loadDataset(str(tmpdir) + '/Dataset_toy_dataset.pkl')
+    assert loaded_ds.X_train['source_text'] == ds.X_train['source_text']
+    assert loaded_ds.Y_train['label'] == ds.Y_train['label']
+
+
+def test_columnar_save_load_encoded_text(tmpdir):
+    ds = build_toy_dataset(encode_text=True)
+    saveDataset(ds, str(tmpdir), format='columnar')
+    loaded_ds = loadDataset(str(tmpdir) + '/Dataset_toy_dataset')
+    assert isinstance(loaded_ds.X_train['source_text'], RaggedArray)
+    assert loaded_ds.X_train['source_text'].tolist() == ds.X_train['source_text'].tolist()
+
+
+def test_encoded_text():
+    ds = build_toy_dataset()
+    encoded_ds = build_toy_dataset(encode_text=True)
+    assert isinstance(encoded_ds.X_train['source_text'], RaggedArray)
+    assert len(encoded_ds.X_train['source_text']) == encoded_ds.len_train
+    for indices in [[0, 1, 2], [5, 3], [4]]:
+        X, Y = ds.getXY_FromIndices('train', indices)
+        encoded_X, encoded_Y = encoded_ds.getXY_FromIndices('train', indices)
+        assert np.all(X[0] == encoded_X[0])
+        assert X[0].dtype == encoded_X[0].dtype
+    assert np.all(ds.getX('val', 0, 2)[0] == encoded_ds.getX('val', 0, 2)[0])
+
+
+def test_loadText():
+    ds = Dataset('toy_dataset', '.', silence=True)
+    vocabularies = {'words2idx': {'<pad>': 0, '<unk>': 1, '<null>': 2, 'a': 3, 'b': 4}}
+    X, X_mask = ds.loadText(['a b', 'b'], vocabularies, 5, 0, 'end', True, False)
+    assert X.dtype == np.uint8
+    assert X.tolist() == [[3, 4, 0], [4, 0, 0]]
+    assert X_mask.tolist() == [[1, 1, 1], [1, 1, 0]]
+    X, X_mask = ds.loadText(['a b', 'c'], vocabularies, 5, 1, 'end', True, False)
+    assert X.tolist() == [[2, 3, 4], [2, 1, 0]]
+    assert X_mask.tolist() == [[1, 1, 1], [1, 1, 1]]
+    X, X_mask = ds.loadText(['a b', 'b'], vocabularies, 5, 0, 'start', False, False)
+    assert X.tolist() == [[0, 3, 4, 0, 0], [0, 0, 4, 0, 0]]
+    assert X_mask.tolist() == [[0, 1, 1, 1, 0], [0, 0, 1, 1, 0]]
+
+
+def test_sparse_text_targets():
+    sentences = ['a b', 'b', 'b a a']
+    ds = Dataset('toy_dataset', '.', silence=True)
+    ds.setInput(list(sentences), 'train', type='text', id='source', build_vocabulary=True, max_text_len=5)
+    ds.setOutput(list(sentences), 'train', type='text', id='dense_target', build_vocabulary=True, max_text_len=5,
+                 sample_weights=True)
+    ds.setOutput(list(sentences), 'train', type='dense-text', id='sparse_target', build_vocabulary='dense_target',
+                 max_text_len=5, sample_weights=True, label_smoothing=0.1)
+    X, Y = ds.getXY_FromIndices('train', [0, 1, 2])
+    (dense_y, dense_mask), (sparse_y, sparse_mask) = Y
+    assert sparse_y.shape == dense_y.shape[:-1] + (1,)
+    assert np.all(np.argmax(dense_y, axis=-1) == sparse_y[:, :, 0])
+    assert np.all(dense_mask == sparse_mask)
+
+
+def test_repeat_set():
+    ds = build_toy_dataset()
+    repeated_ds = Dataset('toy_dataset', '.', silence=True)
+    repeated_ds.setInput(['sentence number ' + str(i) + ' ' * (i % 2) for i in range(2)], 'val',
+                         type='text', id='source_text', build_vocabulary=ds.vocabulary['source_text'],
+                         max_text_len=5, offset=1, repeat_set=[4, 2])
+    repeated_ds.setOutput([i % 3 for i in range(2)], 'val', type='real', id='label', repeat_set=[4, 2])
+    assert len(repeated_ds.X_val['source_text']) == 2
+    assert repeated_ds.len_val == 6
+    assert repeated_ds.getSplitSamples('val', 'label') == [0, 0, 0, 0, 1, 1]
+    X, Y = repeated_ds.getXY_FromIndices('val', [3, 4, 5])
+    expected_X, expected_Y = ds.getXY_FromIndices('val', [0, 1, 1])
+    assert np.all(X[0] == expected_X[0])
+    assert np.all(Y[0] == expected_Y[0])
+
+
+def test_shuffle_and_keep_top_outputs():
+    ds = build_toy_dataset()
+    stored_X = list(ds.X_train['source_text'])
+    np.random.seed(1)
+    ds.shuffleTraining()
+    assert ds.X_train['source_text'] == stored_X
+    shuffled_X = ds.getSplitSamples('train', 'source_text', 'X')
+    shuffled_Y = ds.getSplitSamples('train', 'label')
+    assert sorted(shuffled_X) == sorted(stored_X)
+    assert [stored_X.index(x) % 3 for x in shuffled_X] == shuffled_Y
+
+    ds.keepTopOutputs('train', 'label', 2)
+    assert ds.len_train == 4
+    kept_Y = ds.getSplitSamples('train', 'label')
+    assert len(set(kept_Y)) == 2
+    assert [stored_X.index(x) % 3 for x in ds.getSplitSamples('train', 'source_text', 'X')] == kept_Y
+    X, Y = ds.getXY('train', 4)
+    assert Y[0].tolist() == kept_Y
+
+
+def test_image_shard(tmpdir):
+    images = ['a.jpg', 'b.jpg', 'c.jpg']
+    shard_path = str(tmpdir) + '/shard'
+    data = np.arange(3 * 4 * 5 * 3, dtype=np.uint8).reshape(3, 4, 5, 3)
+    np.save(shard_path + '.npy', data)
+    with open(shard_path + '.txt', 'w') as f:
+        f.write('\n'.join(images) + '\n')
+    direct_shard = ImageShard(shard_path)
+    assert direct_shard.data is None
+    direct_shard.load()
+    assert direct_shard.rows == {'a.jpg': 0, 'b.jpg': 1, 'c.jpg': 2}
+    assert np.array_equal(direct_shard.data[direct_shard.getRows(['b.jpg', 'c.jpg'])], data[1:])
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(images, 'train', type='raw-image', id='image', img_size=[4, 5, 3], img_size_crop=[2, 2, 3])
+    ds.setImageShard(shard_path, 'image')
+    shard = ds.image_shards['image']
+    assert list(shard.getRows(['c.jpg', 'a.jpg'])) == [2, 0]
+    with pytest.raises(Exception):
+        shard.getRows(['d.jpg'])
+    saveDataset(ds, str(tmpdir))
+    loaded_ds = loadDataset(str(tmpdir) + '/Dataset_toy_dataset.pkl')
+    assert loaded_ds.image_shards['image'].data is None
+    assert loaded_ds.image_shards['image'].shape == (3, 4, 5, 3)
+    with pytest.raises(Exception):
+        ds.setInput(images, 'val', type='raw-image', id='image_small', img_size=[2, 2, 3], img_size_crop=[2, 2, 3])
+        ds.setImageShard(shard_path, 'image_small')
+
+
+def test_feature_store(tmpdir):
+    features = ['feat_' + str(i) + '.npy' for i in range(6)]
+    for i, feat in enumerate(features):
+        np.save(str(tmpdir) + '/' + feat, np.arange(4, dtype='float32') + i)
+    store_path = str(tmpdir) + '/store'
+    np.save(store_path + '.npy', np.stack([np.load(str(tmpdir) + '/' + feat) for feat in features[::-1]]))
+    with open(store_path + '.txt', 'w') as f:
+        f.write('\n'.join(features[::-1]) + '\n')
+    with open(str(tmpdir) + '/frames.txt', 'w') as f:
+        f.write('\n'.join(features) + '\n')
+    with open(str(tmpdir) + '/counts.txt', 'w') as f:
+        f.write('1\n3\n2\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(features, 'train', type='image-features', id='image_features', feat_len=4)
+    ds.setInput([str(tmpdir) + '/frames.txt', str(tmpdir) + '/counts.txt'], 'train', type='video-features',
+                id='video_features', max_video_len=2, feat_len=4, data_augmentation_types=['noise'])
+    assert list(ds.frames_offsets['video_features']['train']) == [0, 1, 4, 6]
+    assert ds.getFramesPaths([2, 0, 1], 'video_features', 'train', 2, False) == \
+        [features[4:6], features[0:1], [features[1], features[3]]]
+
+    for data_augmentation in [False, True]:
+        np.random.seed(1)
+        X_files = ds.getX_FromIndices('train', [2, 0, 1], normalization=True, normalization_type='L2',
+                                      dataAugmentation=data_augmentation)
+        ds.setFeatureStore(store_path, 'image_features')
+        ds.setFeatureStore(store_path, 'video_features')
+        np.random.seed(1)
+        X_store = ds.getX_FromIndices('train', [2, 0, 1], normalization=True, normalization_type='L2',
+                                      dataAugmentation=data_augmentation)
+        for x_files, x_store in zip(X_files, X_store):
+            assert np.allclose(x_files, x_store)
+        ds.setFeatureStore(None, 'image_features')
+        ds.setFeatureStore(None, 'video_features')
+    assert np.allclose(X_files[1][2, 1], (np.arange(4) + 3) / np.linalg.norm(np.arange(4) + 3), atol=.1)
+    assert not X_files[1][1, 1].any()
+
+    with pytest.raises(Exception):
+        ds.setInput(features, 'val', type='image-features', id='image_features_small', feat_len=3)
+        ds.setFeatureStore(store_path, 'image_features_small')
+
+
+def test_video_frames_offsets(tmpdir):
+    frames = ['video_' + str(v) + '_' + str(f) + '.jpg' for v, count in enumerate([3, 5, 1]) for f in range(count)]
+    with open(str(tmpdir) + '/frames.txt', 'w') as f:
+        f.write('\n'.join(frames) + '\n')
+    with open(str(tmpdir) + '/counts.txt', 'w') as f:
+        f.write('3\n5\n1\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput([str(tmpdir) + '/frames.txt', str(tmpdir) + '/counts.txt'], 'train', type='video', id='video',
+                max_video_len=4, img_size=[4, 4, 3], img_size_crop=[4, 4, 3])
+    assert list(ds.X_train['video']) == [3, 5, 1]
+    assert list(ds.frames_offsets['video']['train']) == [0, 3, 8, 9]
+    saveDataset(ds, str(tmpdir))
+    loaded_ds = loadDataset(str(tmpdir) + '/Dataset_toy_dataset.pkl')
+    assert list(loaded_ds.frames_offsets['video']['train']) == [0, 3, 8, 9]
+    # The frames of each video are read through the view of the split and the repetition of the samples
+    videos_frames = [frames[0:3], frames[3:7], frames[8:9]]
+    np.random.seed(2)
+    ds.shuffleTraining()
+    positions = np.arange(3)
+    assert ds.getVideosFramesPaths(positions, 'video', 'train', 4) == \
+        [videos_frames[i] for i in ds.indices_train]
+    assert list(ds.getSplitSamples('train', 'video', 'X')) == [[3, 5, 1][i] for i in ds.indices_train]
+    ds.setInput([str(tmpdir) + '/frames.txt', str(tmpdir) + '/counts.txt'], 'val', type='video', id='video',
+                max_video_len=4, img_size=[4, 4, 3], img_size_crop=[4, 4, 3], repeat_set=[1, 2, 1])
+    assert ds.getVideosFramesPaths([3, 1, 2], 'video', 'val', 4) == [videos_frames[2]] + [videos_frames[1]] * 2
+
+
+def test_3DLabels(tmpdir):
+    labels = ['[[2, 1, 3, 2], 1];[[1, 2, 2, 4], 0];[4, 3, 3]', '[5, 2, 3]', '[[1, 1, 2, 5], 0];[5, 2, 3]']
+    with open(str(tmpdir) + '/labels.txt', 'w') as f:
+        f.write('\n'.join(labels) + '\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(['a.jpg', 'b.jpg', 'c.jpg'], 'train', type='raw-image', id='image', img_size=[4, 4, 3],
+                img_size_crop=[4, 4, 3])
+    ds.setOutput(str(tmpdir) + '/labels.txt', 'train', type='3DLabel', id='bboxes', associated_id_in='image')
+    bboxes = ds.Y_train['bboxes']
+    assert list(bboxes.lengths) == [2, 0, 1]
+    assert ds.convert_GT_3DLabels_to_bboxes(bboxes) == ds.convert_GT_3DLabels_to_bboxes(labels) == \
+        [[[[[2, 1, 3, 2], [1, 2, 2, 4]], [1, 0]], [[], []], [[[1, 1, 2, 5]], [0]]], [[3, 4], [2, 5], [2, 5]]]
+    label3D = ds.rasterize3DLabel(bboxes[0], 2, 3, 4)
+    expected = np.zeros((2, 3, 4), dtype=np.float32)
+    expected[1, 1:3, 0:2] = 1
+    expected[0, 0:2, 1:4] = 1
+    assert np.array_equal(label3D, expected)
+    assert not ds.rasterize3DLabel(bboxes[1], 2, 2, 5).any()
+    assert ds.rasterize3DLabel(bboxes[2], 1, 2, 5).sum() == 10
+    # Label maps resized to the crop size
+    images = ['a.jpg', 'b.jpg', 'c.jpg']
+    labels = ds.load3DLabels(bboxes, 2, False, None, [4, 4, 3], [4, 4, 3], images)
+    assert labels.shape == (3, 16, 2)
+    maps = labels.transpose(0, 2, 1).reshape(3, 2, 4, 4)
+    expected = resize_maps(label3D, (4, 4))
+    assert np.allclose(maps[0], expected / expected.max(axis=(1, 2), keepdims=True))
+    assert not maps[1].any()
+    assert maps[2, 0].max() == 1 and not maps[2, 1].any()
+    # Label maps randomly cropped and flipped (as the images)
+    params = {'left': [1, 0], 'hflip': 0., 'prob_flip_horizontal': 0.5, 'vflip': 1., 'prob_flip_vertical': 0.5}
+    cropped = ds.load3DLabels(bboxes, 2, True, dict((image, params) for image in images), [4, 4, 3], [2, 3, 3],
+                              images)
+    assert cropped.shape == (3, 6, 2)
+    assert np.allclose(cropped.transpose(0, 2, 1).reshape(3, 2, 2, 3), maps[:, :, 1:3, 2::-1])
+
+
+def test_3DSemanticLabels(tmpdir):
+    from PIL import Image as pilimage
+    label_images = [np.array([[0, 0, 1, 1], [0, 2, 2, 1], [0, 2, 2, 1]], dtype=np.uint8),
+                    np.array([[1, 1, 1, 1], [2, 2, 0, 0], [2, 2, 0, 5]], dtype=np.uint8)]
+    for i, label_image in enumerate(label_images):
+        pilimage.fromarray(label_image).save(str(tmpdir) + '/label_' + str(i) + '.png')
+    with open(str(tmpdir) + '/labels.txt', 'w') as f:
+        f.write('label_0\nlabel_1.png\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(['a.jpg', 'b.jpg'], 'train', type='raw-image', id='image', img_size=[3, 4, 3],
+                img_size_crop=[2, 2, 3])
+    ds.setOutput(str(tmpdir) + '/labels.txt', 'train', type='3DSemanticLabel', id='segmentation',
+                 associated_id_in='image')
+    ds.semantic_classes['segmentation'] = {0: [0, 0, 0], 1: [255, 0, 0], 2: [0, 255, 0]}
+    labels = ds.load3DSemanticLabels(ds.Y_train['segmentation'], 3, ds.semantic_classes['segmentation'], True,
+                                     {'a.jpg': {'left': [1, 2], 'hflip': 0., 'prob_flip_horizontal': .5,
+                                                'vflip': 1., 'prob_flip_vertical': .5},
+                                      'b.jpg': {'left': [0, 0], 'hflip': 1., 'prob_flip_horizontal': .5,
+                                                'vflip': 1., 'prob_flip_vertical': .5}},
+                                     [3, 4, 3], [2, 2, 3], ['a.jpg', 'b.jpg'])
+    assert labels.shape == (2, 4, 3)
+    assert np.array_equal(labels, np.eye(3)[[[1, 2, 1, 2], [1, 1, 2, 2]]])
+    ds.img_size_crop['image'] = [3, 4, 3]
+    ds.num_poolings_model['segmentation'] = None
+    gt = ds.load_GT_3DSemanticLabels(ds.Y_train['segmentation'], 'segmentation')
+    assert np.array_equal(gt[0], label_images[0].reshape(-1))
+    assert np.array_equal(gt[1], np.where(label_images[1] < 3, label_images[1], 0).reshape(-1))
+    prediction = np.eye(3)[label_images[0].reshape(-1)]
+    assert np.array_equal(ds.resize_semantic_output([prediction], ['segmentation'])[0], prediction)
+
+
+def test_calculate_train_mean(tmpdir):
+    images = ['image_' + str(i) + '.jpg' for i in range(5)]
+    data = np.random.RandomState(0).randint(0, 256, (5, 4, 3, 3)).astype(np.uint8)
+    shard_path = str(tmpdir) + '/shard'
+    np.save(shard_path + '.npy', data)
+    with open(shard_path + '.txt', 'w') as f:
+        f.write('\n'.join(images) + '\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(images, 'train', type='raw-image', id='image', img_size=[4, 3, 3], img_size_crop=[4, 3, 3])
+    ds.setImageShard(shard_path, 'image')
+    mean = ds.calculateTrainMean('image', batch_size=2)
+    assert mean.dtype == np.float32 and np.allclose(mean, data.mean(axis=0))
+    assert np.allclose(ds.train_std['image'], data.reshape(-1, 3).std(axis=0))
+    ds.train_mean.pop('image')
+    assert np.array_equal(ds.calculateTrainMean('image', n_workers=2, batch_size=2), mean)
+    assert np.allclose(ds.calculateTrainMean('image', per_channel=True), data.reshape(-1, 3).mean(axis=0))
+    # The stored mean image is loaded with the input
+    new_ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    new_ds.setInput(images, 'train', type='raw-image', id='image', img_size=[4, 3, 3], img_size_crop=[4, 3, 3])
+    assert np.allclose(new_ds.train_mean['image'], mean)
+    # Mean images stored as image files
+    from PIL import Image
+    Image.fromarray(data[0]).save(str(tmpdir) + '/mean.png')
+    new_ds.setTrainMean(str(tmpdir) + '/mean.png', 'image')
+    assert np.array_equal(new_ds.train_mean['image'], data[0])
+
+
+def test_resized_images(tmpdir):
+    from PIL import Image
+    images = ['image_' + str(i) + '.png' for i in range(3)]
+    data = np.random.RandomState(0).randint(0, 256, (3, 8, 6, 3)).astype(np.uint8)
+    for image, im in zip(images, data):
+        Image.fromarray(im).save(str(tmpdir) + '/' + image)
+    expected = np.asarray([np.asarray(Image.fromarray(im).resize((3, 4), Image.BILINEAR)) for im in data])
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    # Images read from their files
+    ds.setInput(images, 'train', type='raw-image', id='image', img_size=[8, 6, 3], img_size_crop=[4, 3, 3])
+    images_sum, _, n_images = ds.getImagesStatistics(images, 'image')
+    assert n_images == 3 and np.array_equal(images_sum, expected.sum(axis=0))
+    # Images read from a shard
+    shard_path = str(tmpdir) + '/shard'
+    np.save(shard_path + '.npy', data)
+    with open(shard_path + '.txt', 'w') as f:
+        f.write('\n'.join(images) + '\n')
+    ds.setInput(images, 'train', type='raw-image', id='image_shard', img_size=[8, 6, 3], img_size_crop=[4, 3, 3])
+    ds.setImageShard(shard_path, 'image_shard')
+    assert np.array_equal(ds.getImagesStatistics(images, 'image_shard')[0], expected.sum(axis=0))
+
+
+def test_build_vocabulary(tmpdir):
+    rng = np.random.RandomState(0)
+    words = ['w' + str(i) for i in range(50)]
+    sentences = [' '.join(rng.choice(words, rng.randint(1, 10))) for _ in range(200)]
+    corpus_path = str(tmpdir) + '/corpus.txt'
+    with open(corpus_path, 'w') as f:
+        f.write('\n'.join(sentences) + '\n')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.build_vocabulary(sentences, 'sequential', min_occ=2, n_words=30)
+    ds.setTextProcessing(n_workers=2, chunk_size=7)
+    ds.build_vocabulary(sentences, 'parallel', min_occ=2, n_words=30)
+    ds.build_vocabulary(corpus_path, 'streamed', min_occ=2, n_words=30)
+    for data_id in ['parallel', 'streamed']:
+        assert ds.vocabulary[data_id] == ds.vocabulary['sequential']
+        assert ds.vocabulary_len[data_id] == ds.vocabulary_len['sequential'] == 30
+    ds.build_vocabulary(['x y', 'w0 z'], 'extra', use_extra_words=False)
+    ds.merge_vocabularies(['sequential', 'extra'])
+    merged = ds.vocabulary['extra']['words2idx']
+    assert ds.vocabulary_len['extra'] == 33 and sorted(merged.values()) == list(range(33))
+    assert all(merged[w] == idx for w, idx in iteritems(ds.vocabulary['parallel']['words2idx']))
+
+
+def test_parallel_tokenization(tmpdir):
+    bpe_codes = str(tmpdir) + '/codes.bpe'
+    with open(bpe_codes, 'w') as f:
+        f.write('#version: 0.2\nt h\nth e</w>\na n\n')
+    sentences = ['The cat, and the DOG.', 'then an ant ran', 'x'] * 7
+    for tokenization in ['tokenize_basic', 'tokenize_bpe']:
+        datasets = []
+        for n_workers in [1, 2]:
+            ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+            ds.setTextProcessing(chunk_size=4)
+            ds.setInput(list(sentences), 'train', type='text', id='source', tokenization=tokenization,
+                        build_vocabulary=True, bpe_codes=bpe_codes, n_workers=n_workers)
+            datasets.append(ds)
+        assert datasets[0].X_train['source'] == datasets[1].X_train['source']
+        assert datasets[0].vocabulary['source'] == datasets[1].vocabulary['source']
+    assert datasets[1].X_train['source'][1] == 'th@@ e@@ n a@@ n an@@ t r@@ a@@ n'
+
+
+def test_parallel_tokenizer_config(tmpdir):
+    bpe_codes = str(tmpdir) + '/codes.bpe'
+    with open(bpe_codes, 'w') as f:
+        f.write('#version: 0.2\nt h\nth e</w>\na n\n')
+    sentences = [u"l'amour et l'eau, c'est la vie.", u'then an ant ran'] * 5
+    tokenized = dict()
+    for tokenization in ['tokenize_moses', 'tokenize_bpe']:
+        for n_workers in [1, 2]:
+            ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+            ds.setTextProcessing(chunk_size=3)
+            # Non-default tokenizers, which must be rebuilt in the same way by the workers
+            ds.build_moses_tokenizer(language='fr')
+            ds.build_bpe(bpe_codes, glossaries=['then'])
+            ds.setInput(list(sentences), 'train', type='text', id='source', tokenization=tokenization,
+                        build_vocabulary=True, bpe_codes=bpe_codes, n_workers=n_workers)
+            tokenized[tokenization, n_workers] = ds.X_train['source']
+        assert tokenized[tokenization, 1] == tokenized[tokenization, 2]
+    assert tokenized['tokenize_moses', 2][0] == u"l' amour et l' eau , c' est la vie ."
+    assert tokenized['tokenize_bpe', 2][1] == u'then a@@ n an@@ t r@@ a@@ n'
+    assert ds.getTokenizerConfig('tokenize_moses') == {'moses_language': 'fr'}
+    assert ds.getTokenizerConfig('tokenize_basic') == {}
+
+
+def test_text_cache(tmpdir):
+    cache_path = str(tmpdir) + '/text_cache'
+    sentences = [u'The cat, and the DOG.', u'', u'首 先  x'] * 3
+    tokenized = []
+    for tokenization in ['tokenize_basic', 'tokenize_basic', 'tokenize_none', 'tokenize_basic']:
+        ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+        ds.setTextCache(cache_path)
+        ds.setInput(list(sentences), 'train', type='text', id='source', tokenization=tokenization,
+                    build_vocabulary=True)
+        tokenized.append(ds.X_train['source'])
+    assert tokenized[0] == tokenized[1] == tokenized[3] == [ds.tokenize_basic(s) for s in sentences]
+    assert tokenized[2] == sentences
+    assert len(os.listdir(cache_path)) == 2
+    # A different corpus leads to a new entry
+    ds.setInput(sentences[:2], 'val', type='text', id='source', tokenization='tokenize_basic')
+    assert len(os.listdir(cache_path)) == 3
+    # So does a different configuration of the tokenizer
+    moses_tokenized = []
+    for language in ['en', 'fr', 'fr']:
+        ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+        ds.setTextCache(cache_path)
+        ds.build_moses_tokenizer(language=language)
+        ds.setInput([u"l'eau"], 'train', type='text', id='source', tokenization='tokenize_moses',
+                    build_vocabulary=True)
+        moses_tokenized.append(ds.X_train['source'])
+    assert moses_tokenized == [[u"l 'eau"], [u"l' eau"], [u"l' eau"]]
+    assert len(os.listdir(cache_path)) == 5
+
+
+def test_getDataAugmentationRandomParams():
+    images = ['a.jpg', 'b.jpg', 'c.jpg']
+    ds = Dataset('toy_dataset', '.', silence=True)
+    ds.setInput(images, 'train', type='raw-image', id='image', img_size=[8, 6, 3], img_size_crop=[4, 6, 3])
+    np.random.seed(0)
+    params = ds.getDataAugmentationRandomParams(images, 'image', prob_flip_vertical=0.2)
+    np.random.seed(0)
+    flips = [np.random.rand() for _ in range(2 * len(images))]
+    for i, image in enumerate(images):
+        assert 0 <= params[image]['left'][0] < 4 and params[image]['left'][1] == 0
+        assert [params[image]['hflip'], params[image]['vflip']] == flips[2 * i:2 * i + 2]
+        assert params[image]['prob_flip_vertical'] == 0.2
+
+
+def test_resolve_image_paths(tmpdir):
+    tmpdir.mkdir('images')
+    for filename in ['a.png', 'ab.jpg', 'b.jpg']:
+        tmpdir.join('images', filename).write('')
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(['images/a', 'images/b', 'images/b.jpg', 'images/c'], 'train', type='raw-image', id='image',
+                img_size=[4, 4, 3], img_size_crop=[4, 4, 3])
+    path = str(tmpdir) + '/images/'
+    assert ds.resolved_paths[path + 'a'] in [path + 'a.png', path + 'ab.jpg']
+    assert ds.resolved_paths[path + 'b'] == path + 'b.jpg'
+    assert len(ds.resolved_paths) == 2
+
+
+def test_dtype_policy(tmpdir):
+    features = ['feat_' + str(i) + '.npy' for i in range(3)]
+    for i, feat in enumerate(features):
+        np.save(str(tmpdir) + '/' + feat, np.arange(4, dtype='float64') + i)
+    ds = Dataset('toy_dataset', str(tmpdir), silence=True)
+    ds.setInput(features, 'train', type='image-features', id='features', feat_len=4)
+    X_64 = ds.getX_FromIndices('train', [2, 0], normalization=True, normalization_type='L2')[0]
+    ds.setDtype('float32', 'features')
+    X_32 = ds.getX_FromIndices('train', [2, 0], normalization=True, normalization_type='L2')[0]
+    assert X_64.dtype == np.float64 and X_32.dtype == np.float32
+    assert np.allclose(X_64, X_32)
+    with pytest.raises(NotImplementedError):
+        ds.setDtype('int8', 'features')
+
+
+class ToyNet(object):
+    def prepareData(self, X, Y):
+        return [X, Y]
+
+
+def test_parallel_data_batch_generator():
+    ds = build_toy_dataset()
+    net = ToyNet()
+    np.random.seed(1)
+    batches = Data_Batch_Generator('train', net, ds, 2, batch_size=4, data_augmentation=False).generator()
+    expected = [next(batches) for _ in range(6)]
+    ds.indices_train = None
+    np.random.seed(1)
+    parallel_generator = Parallel_Data_Batch_Generator('train', net, ds, 2, batch_size=4, data_augmentation=False,
+                                                       n_parallel_loaders=2)
+    parallel_batches = parallel_generator.generator()
+    pool = parallel_generator.getPool()
+    for (X, Y), (expected_X, expected_Y) in zip([next(parallel_batches) for _ in range(6)][-3:], expected[-3:]):
+        assert np.all(X[0] == expected_X[0]) and np.all(Y[0] == expected_Y[0])
+    # The pool is reused by the next generators
+    val_batches = Parallel_Data_Batch_Generator('val', net, ds, 1, batch_size=2, predict=True,
+                                                n_parallel_loaders=2).generator()
+    assert np.all(next(val_batches)[0] == ds.getX('val', 0, 2)[0])
+    assert ds._batch_worker_pool[1] is pool
+    parallel_generator.terminateThreads()
+    assert pool.closed
+
+
+def test_prefetch_batch_generator():
+    ds = build_toy_dataset()
+    net = ToyNet()
+    np.random.seed(1)
+    batches = Data_Batch_Generator('train', net, ds, 2, batch_size=4, data_augmentation=False).generator()
+    expected = [next(batches) for _ in range(5)]
+    ds.indices_train = None
+    np.random.seed(1)
+    batches = Data_Batch_Generator('train', net, ds, 2, batch_size=4, data_augmentation=False).generator()
+    prefetched_batches = Prefetch_Batch_Generator(batches, n_prefetch=2).generator()
+    for (X, Y), (expected_X, expected_Y) in zip([next(prefetched_batches) for _ in range(5)], expected):
+        assert np.all(X[0] == expected_X[0]) and np.all(Y[0] == expected_Y[0])
+
+    def failing_generator():
+        yield 1
+        raise ValueError('Wrong batch')
+    prefetched_batches = Prefetch_Batch_Generator(failing_generator()).generator()
+    assert next(prefetched_batches) == 1
+    with pytest.raises(ValueError):
+        next(prefetched_batches)
+
+
+def test_batch_indices():
+    ds = build_toy_dataset()
+    batches = [ds.getBatchIndices('train', i, 4, epoch_seed=3) for i in range(2)]
+    assert [len(b) for b in batches] == [4, 2]
+    assert sorted(np.concatenate(batches)) == list(range(6))
+    assert np.all(ds.getBatchIndices('train', 1, 4, epoch_seed=3) == batches[1])
+    assert list(ds.getBatchIndices('train', 1, 4)) == [4, 5]
+    assert list(ds.getBatchIndices('val', 0, 4, init_sample=1, final_sample=2)) == [1]
+    with pytest.raises(Exception):
+        ds.getBatchIndices('train', 2, 4)
+    X, Y = ds.getXY_FromBatch('train', 0, 4, epoch_seed=3)
+    expected_X, expected_Y = ds.getXY_FromIndices('train', batches[0])
+    assert np.all(X[0] == expected_X[0]) and np.all(Y[0] == expected_Y[0])
+    assert np.all(ds.getX_FromBatch('val', 0, 4)[0] == ds.getX('val', 0, 2)[0])
+
+
+def test_bucketed_batches():
+    sentences = ['a ' * (i % 7 + 1) for i in range(30)]
+    ds = Dataset('toy_dataset', '.', silence=True)
+    ds.setInput(sentences[:20], 'train', type='text', id='source', build_vocabulary=True, max_text_len=10)
+    ds.setInput(sentences[20:], 'train', type='text', id='source', build_vocabulary='source', max_text_len=10,
+                add_additional=True)
+    ds.setOutput(sentences[::-1], 'train', type='text', id='target', build_vocabulary=True, max_text_len=10)
+    assert len(ds.text_lengths['X_train']['source']) == 30
+    lengths = np.maximum([s.count('a') for s in sentences], [s.count('a') for s in sentences[::-1]])
+    assert list(ds.getSampleLengths('train')) == list(lengths)
+    np.random.seed(1)
+    batches = ds.getBucketedBatches('train', 12, shuffle=True)
+    assert sorted(np.concatenate(batches)) == list(range(30))
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * max(lengths[batch]) <= 12
+    assert max(len(batch) for batch in ds.getBucketedBatches('train', 100, max_batch_size=4)) == 4
+
+    generator = Bucketed_Data_Batch_Generator('train', ToyNet(), ds, 12, data_augmentation=False, shuffle=False)
+    batches = generator.generator()
+    for batch in generator.batches[:3]:
+        X, Y = next(batches)
+        expected_X, expected_Y = ds.getXY_FromIndices('train', batch)
+        assert np.all(X[0] == expected_X[0])
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
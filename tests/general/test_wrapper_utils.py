@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import pytest
+from keras_wrapper.dataset import Dataset
 from keras_wrapper.utils import *
 
 
@@ -119,6 +120,19 @@ def test_one_hot_2_indices():
     assert np.all(desired_indices == indices)
 
 
+def test_remove_batch_padding():
+    assert list(remove_batch_padding(np.array([4, 3, 0, 0, 0]))) == [4, 3, 0]
+    assert list(remove_batch_padding(np.array([0, 0]))) == [0]
+    # The samples of bucketed batches are searched as if they were loaded alone (see predictBeamSearchNet)
+    sentences = ['a b c', 'a', 'b b b b b b', 'c a', 'b'] * 3
+    ds = Dataset('toy_dataset', '.', silence=True)
+    ds.setInput(sentences, 'test', type='text', id='source', build_vocabulary=True, max_text_len=5, pad_on_batch=True)
+    for batch in ds.getBucketedBatches('test', 12, data_ids=['source']):
+        for position, sample in zip(batch, ds.getX_FromIndices('test', batch)[0]):
+            assert np.array_equal(remove_batch_padding(sample, ds.extra_words['<pad>']),
+                                  ds.getX_FromIndices('test', [position])[0][0])
+
+
 def test_indices_2_one_hot():
     indices = np.array([2, 3, 5])
     desired_one_hot = np.array(
@@ -430,5 +444,72 @@ def test_key_with_max_val():
     assert key == 5
 
 
+def test_resize_maps():
+    maps = np.arange(24, dtype='float32').reshape(2, 3, 4)
+    assert np.array_equal(resize_maps(maps, (3, 4)), maps)
+    resized = resize_maps(maps, (6, 8))
+    assert resized.shape == (2, 6, 8) and resized.dtype == np.float32
+    assert np.allclose(resized[:, ::5, ::7], maps[:, ::2, ::3])
+    assert np.allclose(resize_maps(maps, (3, 2))[0], [[0.5, 2.5], [4.5, 6.5], [8.5, 10.5]])
+    ids = np.array([[0, 1], [2, 3]], dtype='uint8')
+    nearest = resize_maps(ids, (4, 4), interpolation='nearest')
+    assert nearest.dtype == np.uint8 and np.array_equal(nearest, ids.repeat(2, axis=0).repeat(2, axis=1))
+    with pytest.raises(NotImplementedError):
+        resize_maps(maps, (2, 2), interpolation='bicubic')
+
+
+def test_RaggedArray():
+    sequences = [[1, 2, 3], [], [4], [5, 6]]
+    ragged = RaggedArray.from_sequences(sequences, fields={'n': [3, 0, 1, 2]})
+    assert len(ragged) == 4
+    assert list(ragged.lengths) == [3, 0, 1, 2]
+    assert ragged.tolist() == sequences
+    assert ragged[-1].tolist() == [5, 6]
+    assert ragged[1:3].tolist() == [[], [4]]
+    assert ragged[::2].tolist() == [[1, 2, 3], [4]]
+    taken = ragged.take([3, 0, 3])
+    assert taken.tolist() == [[5, 6], [1, 2, 3], [5, 6]]
+    assert list(taken.fields['n']) == [2, 3, 2]
+    concatenated = ragged[2:] + ragged[:1]
+    assert concatenated.tolist() == [[4], [5, 6], [1, 2, 3]]
+    assert list(concatenated.fields['n']) == [1, 2, 3]
+
+
+def test_LRUArrayCache(tmpdir):
+    cache = LRUArrayCache(max_bytes=200)
+    cache.put('a', np.zeros(10, dtype='uint8'))
+    cache.put('b', np.ones(100, dtype='uint8'))
+    assert cache.get('a') is not None  # 'b' becomes the least recently used
+    cache.put('c', np.ones(100, dtype='uint8'))
+    assert cache.get('b') is None
+    assert cache.get('c') is not None and len(cache) == 2
+    cache.put('d', np.ones(300, dtype='uint8'))  # Larger than the budget
+    assert cache.get('d') is None
+
+    cache = LRUArrayCache(max_bytes=0, cache_path=str(tmpdir))
+    cache.put(('image.jpg', (2, 2), True), np.arange(4, dtype='uint8').reshape(2, 2))
+    assert len(cache) == 0
+    cached = LRUArrayCache(cache_path=str(tmpdir)).get(('image.jpg', (2, 2), True))
+    assert cached.tolist() == [[0, 1], [2, 3]]
+
+
+def test_IndexToWords():
+    words2idx = {u'<pad>': 0, u'<unk>': 1, u'<eos>': 2, u'This': 3, u'is': 4, u'text': 6, u'首': 7}
+    index2word = build_index2word(words2idx)
+    assert isinstance(index2word, IndexToWords) and len(index2word) == 7
+    assert index2word == dict((idx, word) for word, idx in iteritems(words2idx))
+    assert index2word[7] == u'首' and index2word.get(5) is None and 5 not in index2word
+    with pytest.raises(KeyError):
+        index2word[8]
+    assert indices_2_words(index2word, [[3, 4], [6, 0]]).tolist() == [[u'This', u'is'], [u'text', u'<pad>']]
+    preds = [[3, 4, 6, 7, 2], [3, 1, 2, 0, 0]]
+    assert decode_predictions_beam_search(preds, index2word) == [u'This is text 首', u'This <unk> <eos> <pad>']
+    assert decode_predictions_beam_search(preds, index2word,
+                                          pad_sequences=True) == [u'This is text 首', u'This <unk> <eos>']
+    assert decode_predictions_one_hot(np.eye(8)[preds], index2word) == [u'This is text 首 <eos>', u'This <unk> <eos>']
+    # Sparse or negative indices are kept in a dictionary
+    assert isinstance(build_index2word({u'a': 0, u'b': 10}), dict)
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
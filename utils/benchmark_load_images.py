@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import timeit
+import numpy as np
+from PIL import Image as pilimage
+from keras_wrapper.dataset import Dataset
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Benchmarks Dataset.loadImages on random JPEG images for an increasing number "
+                                     "of decoding threads, with and without reduced-resolution JPEG decoding.")
+    parser.add_argument("-n", "--n-images", type=int, default=64, help="Number of images (batch size)")
+    parser.add_argument("-s", "--source-size", type=int, nargs=2, default=[480, 640], help="Size of the JPEG images")
+    parser.add_argument("-i", "--img-size", type=int, nargs=2, default=[256, 256], help="img_size of the input")
+    parser.add_argument("-c", "--img-size-crop", type=int, nargs=2, default=[224, 224], help="img_size_crop of the input")
+    parser.add_argument("-t", "--threads", type=int, nargs='+',
+                        default=sorted(set([1, 2, 4, 8, multiprocessing.cpu_count()])),
+                        help="Numbers of threads to benchmark")
+    parser.add_argument("-r", "--repetitions", type=int, default=5, help="Repetitions of each measurement")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    images_path = tempfile.mkdtemp()
+    try:
+        images = []
+        for i in range(args.n_images):
+            # Smooth random images (noise is not representative of JPEG decoding costs)
+            image = np.random.rand(args.source_size[0] // 16, args.source_size[1] // 16, 3) * 255
+            image = pilimage.fromarray(image.astype(np.uint8)).resize((args.source_size[1], args.source_size[0]),
+                                                                      pilimage.BILINEAR)
+            image.save(images_path + '/image_' + str(i) + '.jpg', quality=90)
+            images.append('image_' + str(i) + '.jpg')
+
+        ds = Dataset('benchmark', images_path, silence=True)
+        ds.setInput(images, 'train', type='raw-image', id='image',
+                    img_size=args.img_size + [3], img_size_crop=args.img_size_crop + [3])
+
+        print('threads\tdraft\tno augmentation (ms)\taugmentation (ms)\tspeedup')
+        for draft in [False, True]:
+            reference_time = None
+            for n_threads in args.threads:
+                ds.setImageDecoding(n_threads, draft=draft)
+                time = timeit.timeit(lambda: ds.loadImages(images, 'image'), number=args.repetitions) / args.repetitions
+                da_time = timeit.timeit(lambda: ds.loadImages(images, 'image', dataAugmentation=True,
+                                                              daRandomParams=ds.getDataAugmentationRandomParams(images, 'image')),
+                                        number=args.repetitions) / args.repetitions
+                if reference_time is None:
+                    reference_time = time
+                print('%d\t%s\t%.1f\t%.1f\t%.1fx' % (n_threads, draft, time * 1000., da_time * 1000., reference_time / time))
+    finally:
+        shutil.rmtree(images_path)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import random
+import timeit
+import numpy as np
+from keras_wrapper.dataset import Dataset
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Benchmarks Dataset.loadText against a word-by-word implementation "
+                                     "on random sentences. Both outputs are checked to be identical.")
+    parser.add_argument("-b", "--batch-sizes", type=int, nargs='+', default=[50, 128, 256, 512],
+                        help="Batch sizes to benchmark")
+    parser.add_argument("-l", "--max-text-len", type=int, default=50, help="Maximum text length")
+    parser.add_argument("-v", "--vocabulary-size", type=int, default=30000, help="Vocabulary size")
+    parser.add_argument("-r", "--repetitions", type=int, default=20, help="Repetitions of each measurement")
+    return parser.parse_args()
+
+
+def load_text_loop(ds, X, vocab, max_len, offset, fill, pad_on_batch):
+    """
+    Word-by-word text encoder (reference implementation of Dataset.loadText, without words_so_far).
+    """
+    n_batch = len(X)
+    if len(vocab) < 255:
+        dtype_text = 'uint8'
+    elif len(vocab) < 65535:
+        dtype_text = 'uint16'
+    else:
+        dtype_text = 'uint32'
+    if pad_on_batch:
+        max_len_batch = min(max([len(words.split(' ')) for words in X]) + 1, max_len)
+    else:
+        max_len_batch = max_len
+    X_out = np.ones((n_batch, max_len_batch)).astype(dtype_text) * ds.extra_words[ds.pad_symbol]
+    X_mask = np.zeros((n_batch, max_len_batch)).astype('int8')
+    max_len_batch -= 1
+    for sentence_idx in range(n_batch):
+        words = X[sentence_idx].strip().split(' ')
+        len_j = len(words)
+        if fill == 'start':
+            offset_j = max_len_batch - len_j - 1
+        elif fill == 'center':
+            offset_j = (max_len_batch - len_j) // 2
+            len_j += offset_j
+        else:
+            offset_j = 0
+            len_j = min(len_j, max_len_batch)
+        if offset_j < 0:
+            len_j += offset_j
+            offset_j = 0
+        for word_idx, word in list(zip(range(len_j), words[:len_j])):
+            X_out[sentence_idx, word_idx + offset_j] = vocab.get(word, vocab[ds.unk_symbol])
+            X_mask[sentence_idx, word_idx + offset_j] = 1
+        X_mask[sentence_idx, len_j + offset_j] = 1
+        if offset > 0:
+            X_out[sentence_idx] = np.append([vocab[ds.null_symbol]] * offset, X_out[sentence_idx, :-offset])
+            X_mask[sentence_idx] = np.append([1] * offset, X_mask[sentence_idx, :-offset])
+    return np.asarray(X_out, dtype=dtype_text), np.asarray(X_mask, dtype='int8')
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    words = ['w' + str(i) for i in range(args.vocabulary_size)]
+    ds = Dataset('benchmark', '.', silence=True)
+    vocab = dict((word, i + 3) for i, word in enumerate(words))
+    vocab.update(ds.extra_words)
+    vocabularies = {'words2idx': vocab}
+
+    print('batch_size\tfill\toffset\tloop (ms)\tloadText (ms)\tloadText encoded (ms)\tspeedup')
+    for batch_size in args.batch_sizes:
+        sentences = [' '.join(random.choice(words) for _ in range(random.randint(1, 2 * args.max_text_len)))
+                     for _ in range(batch_size)]
+        encoded_sentences = ds.encodeText(sentences, vocab)
+        for fill, offset in [('end', 0), ('end', 1), ('start', 0)]:
+            loop_output = load_text_loop(ds, sentences, vocab, args.max_text_len, offset, fill, True)
+            output = ds.loadText(sentences, vocabularies, args.max_text_len, offset, fill, True, False)
+            encoded_output = ds.loadText(encoded_sentences, vocabularies, args.max_text_len, offset, fill, True, False)
+            for reference, result in zip(loop_output, output + encoded_output):
+                assert reference.dtype == result.dtype and np.array_equal(reference, result)
+
+            loop_time = timeit.timeit(lambda: load_text_loop(ds, sentences, vocab, args.max_text_len, offset, fill, True),
+                                      number=args.repetitions) / args.repetitions
+            load_time = timeit.timeit(lambda: ds.loadText(sentences, vocabularies, args.max_text_len, offset, fill, True, False),
+                                      number=args.repetitions) / args.repetitions
+            encoded_time = timeit.timeit(lambda: ds.loadText(encoded_sentences, vocabularies, args.max_text_len, offset, fill, True, False),
+                                         number=args.repetitions) / args.repetitions
+            print('%d\t%s\t%d\t%.3f\t%.3f\t%.3f\t%.1fx' % (batch_size, fill, offset, loop_time * 1000., load_time * 1000.,
+                                                           encoded_time * 1000., loop_time / encoded_time))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import shutil
+import tempfile
+import timeit
+import numpy as np
+from PIL import Image as pilimage
+from six import iteritems
+from keras_wrapper.dataset import Dataset
+from keras_wrapper.utils import resize_maps
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Benchmarks the loading of '3DSemanticLabel' outputs (training labels and GT) "
+                                     "and the resizing of the predictions against per-pixel and per-class "
+                                     "implementations on random label images. Both outputs are checked to be "
+                                     "identical.")
+    parser.add_argument("-s", "--size", type=int, nargs=2, default=[512, 512], help="Size of the label images")
+    parser.add_argument("-c", "--crop-size", type=int, nargs=2, default=[256, 256], help="Size of the labels")
+    parser.add_argument("-n", "--n-classes", type=int, default=21, help="Number of classes")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="Number of label images")
+    parser.add_argument("-r", "--repetitions", type=int, default=3, help="Repetitions of each measurement")
+    return parser.parse_args()
+
+
+def one_hot_loop(labeled_im, n_classes, classes_to_colour):
+    """
+    Pixel-by-pixel one-hot encoding (reference implementation).
+    """
+    label3D = np.zeros((n_classes,) + labeled_im.shape, dtype=np.float32)
+    for class_id, colour in iteritems(classes_to_colour):
+        indices = np.where(labeled_im == class_id)
+        for idx_pos in range(len(indices[0])):
+            x, y = indices[0][idx_pos], indices[1][idx_pos]
+            label3D[class_id, x, y] = 1.
+    return label3D
+
+
+def load_labels_loop(ds, images, n_classes, classes_to_colour, size, crop_size):
+    """
+    Loads the training labels (without data augmentation), resizing each class separately
+    (reference implementation of Dataset.load3DSemanticLabels).
+    """
+    labels = np.zeros((len(images), n_classes) + tuple(crop_size), dtype=np.float32)
+    for i, image in enumerate(images):
+        labeled_im = resize_maps(np.asarray(pilimage.open(ds.path + '/' + image)), size, interpolation='nearest')
+        label3D = one_hot_loop(labeled_im, n_classes, classes_to_colour)
+        for j in range(n_classes):
+            label2D = resize_maps(label3D[j], crop_size)
+            maxval = np.max(label2D)
+            if maxval > 0:
+                label2D /= maxval
+            labels[i, j] = label2D
+    return labels
+
+
+def load_gt_loop(ds, images, n_classes, classes_to_colour, size, crop_size):
+    """
+    Loads the GT class ids (reference implementation of Dataset.load_GT_3DSemanticLabels).
+    """
+    labels = load_labels_loop(ds, images, n_classes, classes_to_colour, size, crop_size)
+    return [np.argmax(label, axis=0).reshape(-1) for label in labels]
+
+
+def resize_output_loop(pred, in_size, out_size):
+    """
+    Resizes each class of a prediction separately (reference implementation of Dataset.resize_semantic_output).
+    """
+    pred = np.reshape(np.transpose(pred, [1, 0]), (-1, in_size[0], in_size[1]))
+    new_pred = np.zeros((len(pred),) + tuple(out_size), dtype=np.float32)
+    for pos, p in enumerate(pred):
+        new_pred[pos] = resize_maps(p, out_size)
+    return np.transpose(np.reshape(new_pred, (len(pred), -1)), [1, 0])
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    path = tempfile.mkdtemp()
+    try:
+        images = ['label_' + str(i) + '.png' for i in range(args.batch_size)]
+        for image in images:
+            # Random blocks of classes
+            blocks = np.random.randint(0, args.n_classes, (args.size[0] // 32 + 1, args.size[1] // 32 + 1))
+            labeled_im = blocks.repeat(32, axis=0).repeat(32, axis=1)[:args.size[0], :args.size[1]]
+            pilimage.fromarray(labeled_im.astype(np.uint8)).save(path + '/' + image)
+        with open(path + '/labels.txt', 'w') as f:
+            f.write('\n'.join(images) + '\n')
+
+        ds = Dataset('benchmark', path, silence=True)
+        ds.setInput(images, 'test', type='raw-image', id='image', img_size=args.size + [3],
+                    img_size_crop=args.crop_size + [3])
+        ds.setOutput(path + '/labels.txt', 'test', type='3DSemanticLabel', id='labels', associated_id_in='image')
+        ds.semantic_classes['labels'] = dict((c, [c, c, c]) for c in range(args.n_classes))
+        ds.num_poolings_model['labels'] = None
+        classes_to_colour = ds.semantic_classes['labels']
+
+        def load_labels():
+            return ds.load3DSemanticLabels(images, args.n_classes, classes_to_colour, False, None,
+                                           args.size + [3], args.crop_size + [3], images)
+
+        def load_labels_reference():
+            labels = load_labels_loop(ds, images, args.n_classes, classes_to_colour, args.size, args.crop_size)
+            return np.transpose(np.reshape(labels, (len(images), args.n_classes, -1)), (0, 2, 1))
+
+        def load_gt():
+            return ds.load_GT_3DSemanticLabels(images, 'labels')
+
+        def load_gt_reference():
+            return load_gt_loop(ds, images, args.n_classes, classes_to_colour, args.size, args.crop_size)
+
+        pred = np.random.rand(args.crop_size[0] * args.crop_size[1], args.n_classes).astype(np.float32)
+
+        assert np.array_equal(load_labels(), load_labels_reference())
+        assert all(np.array_equal(g, reference_g) for g, reference_g in zip(load_gt(), load_gt_reference()))
+        assert np.allclose(ds.resize_semantic_output([pred], ['labels'])[0],
+                           resize_output_loop(pred, args.crop_size, args.size))
+
+        print('task\tloop (ms)\tvectorized (ms)\tspeedup')
+        for task, loop_fun, fun in [('labels', load_labels_reference, load_labels),
+                                    ('GT', load_gt_reference, load_gt),
+                                    ('resize output',
+                                     lambda: resize_output_loop(pred, args.crop_size, args.size),
+                                     lambda: ds.resize_semantic_output([pred], ['labels']))]:
+            loop_time = timeit.timeit(loop_fun, number=args.repetitions) / args.repetitions
+            vectorized_time = timeit.timeit(fun, number=args.repetitions) / args.repetitions
+            print('%s\t%.1f\t%.1f\t%.1fx' % (task, loop_time * 1000., vectorized_time * 1000.,
+                                             loop_time / vectorized_time))
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import random
+import re
+import timeit
+from keras_wrapper.extra import tokenizers
+from keras_wrapper.extra.tokenizers import _CONTRACTIONS, _MANUAL_MAP, _PUNCTUATION, _QUESTIONS_PUNCTUATION
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Benchmarks the tokenizers of keras_wrapper.extra.tokenizers (and their batch "
+                                     "variants) against implementations which process each punctuation symbol "
+                                     "separately, on random sentences. All outputs are checked to be identical.")
+    parser.add_argument("-n", "--n-sentences", type=int, default=1000000, help="Number of sentences")
+    parser.add_argument("-l", "--max-len", type=int, default=30, help="Maximum number of words of each sentence")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args()
+
+
+def tokenize_basic_loop(caption, lowercase=True):
+    """
+    Punctuation-by-punctuation tokenize_basic (reference implementation).
+    """
+    resAns = caption.lower() if lowercase else caption
+    resAns = resAns.replace(u'\n', u' ')
+    resAns = resAns.replace(u'\t', u' ')
+    for p in _PUNCTUATION:
+        resAns = resAns.replace(p, u' ' + p + u' ')
+    return re.sub(u'[ ]+', u' ', resAns)
+
+
+def tokenize_aggressive_loop(caption, lowercase=True):
+    """
+    Punctuation-by-punctuation tokenize_aggressive (reference implementation).
+    """
+    resAns = caption.lower() if lowercase else caption
+    for p in _PUNCTUATION:
+        resAns = resAns.replace(p, '')
+    return re.sub('[ ]+', ' ', resAns).strip()
+
+
+def tokenize_soft_loop(caption, lowercase=True):
+    """
+    Symbol-by-symbol tokenize_soft (reference implementation).
+    """
+    tokenized = re.sub(u'[\n\t]+', u'', caption.strip())
+    for symbol in u'.,!?{}()[]"\'':
+        tokenized = re.sub(u'[' + re.escape(symbol) + u']+', u' ' + symbol + u' ', tokenized)
+    tokenized = re.sub(u'[ ]+', u' ', tokenized)
+    return tokenized if not lowercase else tokenized.lower()
+
+
+def tokenize_questions_loop(caption):
+    """
+    tokenize_questions compiling its expressions at each call and processing each punctuation symbol separately
+    (reference implementation).
+    """
+    commaStrip = re.compile(r"(\d)(\,)(\d)")
+    periodStrip = re.compile(r"(?!<=\d)(\.)(?!\d)")
+    manualMap = dict(_MANUAL_MAP)
+    inText = caption.lower().replace('\n', ' ').replace('\t', ' ').strip()
+    outText = inText
+    for p in _QUESTIONS_PUNCTUATION:
+        if (p + ' ' in inText or ' ' + p in inText) or (re.search(commaStrip, inText) is not None):
+            outText = outText.replace(p, '')
+        else:
+            outText = outText.replace(p, ' ')
+    outText = periodStrip.sub("", outText, re.UNICODE)
+    words = []
+    for word in outText.lower().split():
+        word = manualMap.setdefault(word, word)
+        if word not in ['a', 'an', 'the']:
+            words.append(word)
+    for wordId, word in list(enumerate(words)):
+        if word in _CONTRACTIONS:
+            words[wordId] = _CONTRACTIONS[word]
+    return ' '.join(words)
+
+
+def random_sentence(words, max_len):
+    """
+    Random sentence of words, numbers and punctuation.
+    """
+    return u' '.join(random.choice(words) for _ in range(random.randint(1, max_len)))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    random.seed(args.seed)
+    words = [u'The', u'dog', u'is', u'running', u'in', u'a', u'park', u'dont', u'two', u'1,000', u'3.5', u'cat\'s',
+             u'(near', u'the)', u'river.', u'Where?', u'wow!', u'é', u'首先', u'"quoted"', u'e-mail', u'a/b', u'x;',
+             u'[1]', u'{', u'}', u'=', u'+', u'_', u'<tag>', u'@user', u'`', u'¿qué', u'¡sí', u'，', u'...']
+    sentences = [random_sentence(words, args.max_len) for _ in range(args.n_sentences)]
+
+    print('tokenizer\tloop (s)\ttokenizer (s)\tbatch (s)\tspeedup')
+    for name, loop_tokenizer in [('tokenize_basic', tokenize_basic_loop),
+                                 ('tokenize_aggressive', tokenize_aggressive_loop),
+                                 ('tokenize_soft', tokenize_soft_loop),
+                                 ('tokenize_questions', tokenize_questions_loop)]:
+        tokenizer = getattr(tokenizers, name)
+        batch_tokenizer = getattr(tokenizers, name + '_batch')
+        outputs = {}
+        times = {}
+        for kind, function in [('loop', lambda: [loop_tokenizer(sentence) for sentence in sentences]),
+                               ('tokenizer', lambda: [tokenizer(sentence) for sentence in sentences]),
+                               ('batch', lambda: batch_tokenizer(sentences))]:
+            start = timeit.default_timer()
+            outputs[kind] = function()
+            times[kind] = timeit.default_timer() - start
+        assert outputs['loop'] == outputs['tokenizer'] == outputs['batch']
+        print('%s\t%.2f\t%.2f\t%.2f\t%.1fx' % (name, times['loop'], times['tokenizer'], times['batch'],
+                                               times['loop'] / min(times['tokenizer'], times['batch'])))
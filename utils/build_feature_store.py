@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import codecs
+import shutil
+import tempfile
+import numpy as np
+from keras_wrapper.dataset import loadDataset, saveDataset
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Packs all the feature files (.npy) of an 'image-features' or 'video-features' "
+                                     "input of a dataset into a single memory-mapped feature store. "
+                                     "The dataset is saved reading the input from the store.")
+    parser.add_argument("-d", "--dataset", required=True, help="Stored instance of the dataset")
+    parser.add_argument("-i", "--id", required=True,
+                        help="Identifier of the 'image-features' or 'video-features' input")
+    parser.add_argument("-s", "--splits", nargs='+', default=['train', 'val', 'test'], help="Splits to store")
+    parser.add_argument("-o", "--output", required=True, help="Path of the store files (without extension)")
+    parser.add_argument("-t", "--dtype", default='float32', help="Data type of the stored features")
+    parser.add_argument("-e", "--external", action='store_true', default=False,
+                        help="The features are stored with absolute paths")
+    return parser.parse_args()
+
+
+def get_input_type(ds, data_id, splits):
+    """
+    Type of an input of the dataset, as loaded in the first split which contains it.
+    :param ds: Dataset instance.
+    :param data_id: Identifier of the input.
+    :param splits: Split names.
+    :return: Type of the input.
+    """
+    for split in splits:
+        if data_id in ds.ids_inputs and data_id in getattr(ds, 'X_' + split, dict()):
+            return ds.types_inputs[split][ds.ids_inputs.index(data_id)]
+    raise Exception('The input "' + data_id + '" is not loaded in the splits ' + str(splits) + '.')
+
+
+def get_features(ds, data_id, split):
+    """
+    Names of the features of an input in a split.
+    :param ds: Dataset instance.
+    :param data_id: Identifier of the input.
+    :param split: Split name.
+    :return: List of feature names (as stored in the dataset).
+    """
+    if data_id not in getattr(ds, 'X_' + split, dict()):
+        return []
+    if ds.types_inputs[split][ds.ids_inputs.index(data_id)] == 'video-features':
+        return list(ds.paths_frames.get(data_id, dict()).get(split, []))
+    return list(getattr(ds, 'X_' + split)[data_id])
+
+
+def save_dataset(ds, dataset_path):
+    """
+    Saves the dataset in the format ('pickle' file or 'columnar' directory) and location it was loaded from.
+    :param ds: Dataset instance.
+    :param dataset_path: Path of the stored dataset.
+    """
+    dataset_path = os.path.normpath(dataset_path)
+    store_format = 'columnar' if os.path.isdir(dataset_path) else 'pickle'
+    # The dataset is written next to the stored one and then moved into its place
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dataset_path)))
+    try:
+        saveDataset(ds, tmp_path, format=store_format)
+        saved_path = os.path.join(tmp_path, 'Dataset_' + ds.name + ('.pkl' if store_format == 'pickle' else ''))
+        if store_format == 'columnar':
+            shutil.rmtree(dataset_path)
+        os.rename(saved_path, dataset_path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    # Load dataset
+    ds = loadDataset(args.dataset)
+    type_input = get_input_type(ds, args.id, args.splits)
+    if type_input not in ['image-features', 'video-features']:
+        raise Exception('The input "' + args.id + '" has type "' + type_input +
+                        '", only "image-features" and "video-features" inputs can be stored.')
+    # Unique features of all the splits
+    features = []
+    for split in args.splits:
+        features += get_features(ds, args.id, split)
+    features = sorted(set(features))
+
+    shape = [len(features)] + list(ds.features_lengths[args.id])
+    logger.info('Storing %d features with shape %s into %s.npy' % (len(features), str(shape[1:]), args.output))
+    data = np.lib.format.open_memmap(args.output + '.npy', mode='w+', dtype=args.dtype, shape=tuple(shape))
+    for i, feature in enumerate(features):
+        data[i] = np.load(feature if args.external else ds.path + '/' + feature)
+        if (i + 1) % 10000 == 0:
+            logger.info('Stored %d/%d features' % (i + 1, len(features)))
+    data.flush()
+    del data
+    with codecs.open(args.output + '.txt', 'w', encoding='utf-8') as f:
+        for feature in features:
+            f.write(feature + '\n')
+
+    # Save dataset
+    ds.setFeatureStore(args.output, args.id)
+    save_dataset(ds, args.dataset)
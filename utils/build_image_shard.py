@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import argparse
+import fnmatch
+import logging
+import os
+import codecs
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from PIL import Image as pilimage
+from keras_wrapper.dataset import loadDataset, saveDataset
+from keras_wrapper.utils import resize_image
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Argument parser
+    :return:
+    """
+    parser = argparse.ArgumentParser("Decodes once all the images of a 'raw-image' input (or the frames of a 'video' "
+                                     "input) of a dataset, resizes them to its img_size and packs them into a single "
+                                     "uint8 memory-mapped shard. "
+                                     "The dataset is saved reading the input from the shard.")
+    parser.add_argument("-d", "--dataset", required=True, help="Stored instance of the dataset")
+    parser.add_argument("-i", "--id", required=True, help="Identifier of the 'raw-image' or 'video' input")
+    parser.add_argument("-s", "--splits", nargs='+', default=['train', 'val', 'test'], help="Splits to store")
+    parser.add_argument("-o", "--output", required=True, help="Path of the shard files (without extension)")
+    parser.add_argument("-e", "--external", action='store_true', default=False,
+                        help="The images are stored with absolute paths")
+    return parser.parse_args()
+
+
+def read_image(ds, image, data_id, external=False):
+    """
+    Reads and resizes an image as Dataset.loadImages does.
+    :param ds: Dataset instance.
+    :param image: Image name (as stored in the dataset).
+    :param data_id: Identifier of the 'raw-image' or 'video' input.
+    :param external: Whether the image name is an absolute path.
+    :return: uint8 array with shape img_size (without the channels dimension for grayscale images).
+    """
+    im = image if external else ds.path + '/' + image
+    [path, filename] = os.path.split(im)
+    [filename, ext] = os.path.splitext(filename)
+    if not ext:
+        if os.path.isfile(ds.resolved_paths.get(im, '')):
+            im = ds.resolved_paths[im]
+        else:
+            filename = fnmatch.filter(os.listdir(path), filename + '*')
+            if not filename:
+                raise Exception('Non existent image ' + im)
+            im = path + '/' + filename[0]
+    try:
+        im = pilimage.open(im)
+        im = im.convert('RGB' if ds.use_RGB[data_id] else 'L')
+        im = np.asarray(im, dtype=np.uint8)
+    except Exception:
+        logger.warning("Can't load image " + str(im))
+        return np.zeros(list(ds.img_size[data_id][0:2]) + ([3] if ds.use_RGB[data_id] else []), dtype=np.uint8)
+    return resize_image(im, ds.img_size[data_id][0:2])
+
+
+def get_input_type(ds, data_id, splits):
+    """
+    Type of an input of the dataset, as loaded in the first split which contains it.
+    :param ds: Dataset instance.
+    :param data_id: Identifier of the input.
+    :param splits: Split names.
+    :return: Type of the input.
+    """
+    for split in splits:
+        if data_id in ds.ids_inputs and data_id in getattr(ds, 'X_' + split, dict()):
+            return ds.types_inputs[split][ds.ids_inputs.index(data_id)]
+    raise Exception('The input "' + data_id + '" is not loaded in the splits ' + str(splits) + '.')
+
+
+def save_dataset(ds, dataset_path):
+    """
+    Saves the dataset in the format ('pickle' file or 'columnar' directory) and location it was loaded from.
+    :param ds: Dataset instance.
+    :param dataset_path: Path of the stored dataset.
+    """
+    dataset_path = os.path.normpath(dataset_path)
+    store_format = 'columnar' if os.path.isdir(dataset_path) else 'pickle'
+    # The dataset is written next to the stored one and then moved into its place
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dataset_path)))
+    try:
+        saveDataset(ds, tmp_path, format=store_format)
+        saved_path = os.path.join(tmp_path, 'Dataset_' + ds.name + ('.pkl' if store_format == 'pickle' else ''))
+        if store_format == 'columnar':
+            shutil.rmtree(dataset_path)
+        os.rename(saved_path, dataset_path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    # Load dataset
+    ds = loadDataset(args.dataset)
+    # Unique images of all the splits
+    images = []
+    if get_input_type(ds, args.id, args.splits) == 'video':
+        # The frames of each video are stored contiguously
+        for split in args.splits:
+            images += [frame for frame in ds.paths_frames.get(args.id, dict()).get(split, [])]
+        images = list(OrderedDict.fromkeys(images))
+    else:
+        for split in args.splits:
+            images += [image for image in getattr(ds, 'X_' + split).get(args.id, [])]
+        images = sorted(set(images))
+
+    shape = [len(images)] + list(ds.img_size[args.id][0:2])
+    if ds.use_RGB[args.id]:
+        shape += [3]
+    logger.info('Storing %d images with shape %s into %s.npy' % (len(images), str(shape[1:]), args.output))
+    data = np.lib.format.open_memmap(args.output + '.npy', mode='w+', dtype=np.uint8, shape=tuple(shape))
+    for i, image in enumerate(images):
+        data[i] = read_image(ds, image, args.id, external=args.external)
+        if (i + 1) % 1000 == 0:
+            logger.info('Stored %d/%d images' % (i + 1, len(images)))
+    data.flush()
+    del data
+    with codecs.open(args.output + '.txt', 'w', encoding='utf-8') as f:
+        for image in images:
+            f.write(image + '\n')
+
+    # Save dataset
+    ds.setImageShard(args.output, args.id)
+    save_dataset(ds, args.dataset)